@@ -1,4 +1,4 @@
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_restx import Api, Namespace
 from flask_migrate import Migrate
@@ -27,11 +27,45 @@ DB_URI = f'postgresql+psycopg2://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}
 
 app.config['SQLALCHEMY_DATABASE_URI'] = DB_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# List endpoints served through the column-projection read path (readModels.py)
+app.config['PROJECTION_READ_ENDPOINTS'] = ['TasksByCompany', 'CardsByCompany', 'FilesByCompany']
+# Let the front web server stream /uploads files: None, 'x-accel-redirect' (nginx) or 'x-sendfile' (downloads.py)
+app.config['DOWNLOAD_OFFLOAD'] = os.environ.get('DOWNLOAD_OFFLOAD')
+app.config['DOWNLOAD_ACCEL_PREFIX'] = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+# Where uploaded bytes are stored: 'local' (BLOB_FOLDER) or 's3' (storageBackends.py)
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+app.config['S3_REGION'] = os.environ.get('S3_REGION')
+app.config['PRESIGNED_URL_EXPIRY'] = int(os.environ.get('PRESIGNED_URL_EXPIRY', 3600))
+# Seconds between in-process upload sweeps (uploadSweeper.py); unset to rely on `flask sweep-uploads`
+app.config['UPLOAD_SWEEP_INTERVAL'] = int(os.environ.get('UPLOAD_SWEEP_INTERVAL', 0)) or None
+# Threads of the job worker each API process starts (jobs.py); 0 when only `flask run-worker` processes run jobs
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# Seconds between in-process purges of deleted rows (tombstones.py), only within TOMBSTONE_PURGE_HOURS; unset to rely on `flask purge-tombstones`
+app.config['TOMBSTONE_PURGE_INTERVAL'] = int(os.environ.get('TOMBSTONE_PURGE_INTERVAL', 0)) or None
+app.config['TOMBSTONE_PURGE_HOURS'] = os.environ.get('TOMBSTONE_PURGE_HOURS', '2-5')
 
 # Initialize database
 from database import db
 db.init_app(app)
 migrate = Migrate(app, db)
+import queryStats
+queryStats.init_app(app)
+import fieldsets
+fieldsets.init_app(app)
+from downloads import send_upload
+import uploadSweeper
+uploadSweeper.init_app(app)
+import uploadLayout
+uploadLayout.init_app(app)
+import changeFeed
+import tombstones
+tombstones.init_app(app)
+import jobs
+jobs.init_app(app)
+import deletionJobs
 from models import *
 import migration
 # Import routes
@@ -52,6 +86,7 @@ eventNameSpace = Namespace('Event', description='Operations for event')
 pageNameSpace = Namespace('Page', description='Operations for pages')
 cardNameSpace = Namespace('Card', description='Operations for cards')
 imageNameSpace = Namespace('Image', description='Operations for Image')
+jobNameSpace = Namespace('Job', description='Operations for background jobs')
 
 import routes.routesTask as routesTask
 import routes.routesFolder as routesFolder
@@ -70,6 +105,7 @@ import routes.routesEvent as routesEvent
 import routes.routesPage as routesPage
 import routes.routesCard as routesCard
 import routes.routesImage as routesImage
+import routes.routesJob as routesJob
 
 # Add namespaces to API
 api.add_namespace(taskNameSpace)
@@ -89,18 +125,26 @@ api.add_namespace(eventNameSpace)
 api.add_namespace(pageNameSpace)
 api.add_namespace(cardNameSpace)
 api.add_namespace(imageNameSpace)
+api.add_namespace(jobNameSpace)
 
 # Route to serve uploaded files
 @app.route('/uploads/<path:pageId>/<path:filename>')
 def download_file(pageId, filename):
-    upload_folder = os.path.join('uploads', pageId)
-    return send_from_directory(upload_folder, filename)
+    upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], pageId)
+    if pageId.startswith('workspace/') and pageId[len('workspace/'):].isdigit():
+        files = File.query.filter_by(WorkspaceId=int(pageId[len('workspace/'):]))
+    elif pageId.isdigit():
+        files = File.query.filter_by(PageId=int(pageId))
+    else:
+        files = None
+    return send_upload(upload_folder, filename, files)
 
 # Route to serve files from folders
 @app.route('/uploads/folders/<path:folderId>/<path:filename>')
 def download_folder_file(folderId, filename):
-    upload_folder = os.path.join('uploads', 'folders', folderId)
-    return send_from_directory(upload_folder, filename)
+    upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'folders', folderId)
+    files = File.query.filter_by(FolderId=int(folderId)) if folderId.isdigit() else None
+    return send_upload(upload_folder, filename, files)
 
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=5000)
@@ -0,0 +1,84 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert
+from werkzeug.formparser import parse_form_data
+from database import db
+from models import File
+from blobStore import spool_upload, store_spool, discard_spool, locate_blob, count_references
+from changeFeed import record_changes
+
+# Batch uploads: many files in one multipart request. Werkzeug writes every
+# part straight into a hashing temporary file beside the blobs, so a part is
+# never held in memory or copied twice; once the request has been read each
+# part is moved into the blob store and all File rows go in with a single
+# INSERT ... RETURNING and one commit. Every part gets its own result, so one
+# empty or unreadable part does not fail the whole batch.
+# The single-file POST /File/ reads its request the same way (parse_upload).
+
+BATCH_UPLOAD_MAX_FILES = 500
+
+
+def parse_batch(environ, maxContentLength=None):
+    """Parse a multipart batch request; returns (form, the `files` parts)"""
+    _, form, files = parse_form_data(
+        environ, stream_factory=spool_upload, max_content_length=maxContentLength,
+        # Form fields (destination, createdBy) come on top of the files
+        max_form_parts=BATCH_UPLOAD_MAX_FILES + 10
+    )
+    for key, part in files.items(multi=True):
+        if key != 'files':
+            discard_spool(part.stream)
+    return form, files.getlist('files')
+
+
+def parse_upload(environ, maxContentLength=None):
+    """Parse a multipart request into hashing spools like parse_batch; returns (form, files) with every part"""
+    _, form, files = parse_form_data(environ, stream_factory=spool_upload, max_content_length=maxContentLength)
+    return form, files
+
+
+def create_files(parts, **columns):
+    """Store every part and create its File row in one INSERT; returns one result per part, in order.
+
+    A result is {'name', 'status'} plus the serialized 'file' (status 201) or
+    an error 'message'. columns (destination, CreatedBy, ...) apply to every row.
+    """
+    results = []
+    rows = []
+    created = []
+    now = datetime.now()
+    for part in parts:
+        spool = part.stream
+        if not part.filename:
+            discard_spool(spool)
+            results.append({'name': None, 'status': 400, 'message': 'No selected file'})
+            continue
+        try:
+            contentHash, size = store_spool(spool)
+        except OSError as e:
+            discard_spool(spool)
+            results.append({'name': part.filename, 'status': 500, 'message': f'Could not store file: {e}'})
+            continue
+        result = {'name': part.filename, 'status': 201}
+        results.append(result)
+        created.append(result)
+        rows.append(dict(columns, Name=part.filename, Path=locate_blob(contentHash), ContentHash=contentHash, Size=size,
+                         CreatedDateTime=now, Iso365File=False))
+    if not rows:
+        return results
+
+    # RETURNING order is not guaranteed for a multi-row INSERT, but rows with
+    # the same name and content are interchangeable, so they are matched on that
+    inserted = {}
+    fileIds = []
+    for file in db.session.scalars(insert(File).returning(File), rows):
+        inserted.setdefault((file.Name, file.ContentHash), []).append(file)
+        fileIds.append(file.Id)
+    for result, row in zip(created, rows):
+        result['file'] = inserted[row['Name'], row['ContentHash']].pop().serialize()
+    # The bulk INSERT bypasses the mapper events that keep the blob reference counts, and the change feed
+    count_references(db.session, Counter(row['ContentHash'] for row in rows),
+                     {row['ContentHash']: row['Size'] for row in rows})
+    record_changes(db.session, File, File.Id.in_(fileIds))
+    db.session.commit()
+    return results
@@ -0,0 +1,310 @@
+import hashlib
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import datetime
+from io import BytesIO
+from flask import current_app
+from sqlalchemy import event, inspect, update, select, func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+from database import db
+from models import Blob, File, Image
+from storageBackends import storage, blob_folder
+
+# Content-addressed blob store for image and file bytes. A blob is written once
+# under its SHA-256 hex digest and never modified, so rows only keep the hash
+# and identical uploads share one object. The blobs table counts the File and
+# Image rows referencing each blob; unreferenced blobs are left in storage
+# until the upload sweeper removes them. The bytes live in the configured
+# storage backend (storageBackends.py).
+#
+# Blobs are fanned out into nested directories named after leading slices of
+# the hash (BLOB_FANOUT, by default ab/cd/abcd...), so no directory grows
+# beyond a few hundred entries. On local storage, blobs written before the
+# fan-out sit directly in the blob folder and are still found until
+# `flask migrate-upload-layout` (uploadLayout.py) has moved them.
+
+DEFAULT_BLOB_FANOUT = (2, 2)
+CONTENT_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Leading bytes of the image formats the client uploads
+MIME_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+
+# Read size when hashing files from disk
+HASH_READ_SIZE = 64 * 1024
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def stream_content_hash(stream):
+    """SHA-256 of a binary stream, read in bounded chunks"""
+    sha256 = hashlib.sha256()
+    for data in iter(lambda: stream.read(HASH_READ_SIZE), b''):
+        sha256.update(data)
+    return sha256.hexdigest()
+
+
+def file_content_hash(path):
+    """SHA-256 of a file on disk"""
+    with open(path, 'rb') as file:
+        return stream_content_hash(file)
+
+
+def is_content_hash(name):
+    return bool(CONTENT_HASH_PATTERN.match(name))
+
+
+def fanout_parts(contentHash):
+    """Directory names a blob is sharded into, e.g. ('ab', 'cd') for the default fan-out"""
+    parts = []
+    start = 0
+    for width in current_app.config.get('BLOB_FANOUT', DEFAULT_BLOB_FANOUT):
+        parts.append(contentHash[start:start + width])
+        start += width
+    return parts
+
+
+def blob_key(contentHash):
+    """Storage key of a blob, e.g. 'ab/cd/abcd...'"""
+    return '/'.join(fanout_parts(contentHash) + [contentHash])
+
+
+def blob_path(contentHash):
+    """Where a blob is written on local storage"""
+    return os.path.join(blob_folder(), *fanout_parts(contentHash), contentHash)
+
+
+def flat_blob_path(contentHash):
+    """Where a blob was written before the fan-out layout"""
+    return os.path.join(blob_folder(), contentHash)
+
+
+def locate_blob(contentHash):
+    """Location of a stored blob (a path on local storage, in either layout), or None when it is not stored"""
+    return storage().locate(blob_key(contentHash), contentHash)
+
+
+def guess_mime_type(data):
+    for signature, mimeType in MIME_SIGNATURES:
+        if data.startswith(signature):
+            return mimeType
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def _reuse(contentHash):
+    """Whether the blob is already stored, in either layout.
+
+    An existing blob's modified time is refreshed, so the upload sweeper's
+    grace period covers the new reference until it is committed. On a remote
+    store that is the LastModifyDateTime of its blobs row, updated before the
+    object is looked up: the row stays locked until the caller commits, and a
+    sweep that got to it first has removed the object by then.
+    """
+    backend = storage()
+    if backend.remote:
+        db.session.execute(update(Blob).where(Blob.ContentHash == contentHash).values(LastModifyDateTime=datetime.now())
+                           .execution_options(synchronize_session=False))
+    return backend.touch(blob_key(contentHash), contentHash)
+
+
+def put_blob(data):
+    """Store data and return its content hash; storing the same bytes twice is a no-op"""
+    contentHash = content_hash(data)
+    if not _reuse(contentHash):
+        storage().put_stream(blob_key(contentHash), BytesIO(data))
+    return contentHash
+
+
+def put_stream(stream):
+    """Store a seekable binary stream and return (content hash, size).
+
+    The stream is hashed first, so content that is already stored is never
+    written to disk again.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    for data in iter(lambda: stream.read(HASH_READ_SIZE), b''):
+        sha256.update(data)
+        size += len(data)
+    contentHash = sha256.hexdigest()
+    if not _reuse(contentHash):
+        stream.seek(0)
+        storage().put_stream(blob_key(contentHash), stream)
+    return contentHash, size
+
+
+def put_file(path, contentHash):
+    """Move a finished local file whose hash is already known into the store and return the blob location"""
+    if _reuse(contentHash):
+        os.remove(path)
+        return locate_blob(contentHash)
+    storage().put_file(blob_key(contentHash), path)
+    return storage().location(blob_key(contentHash))
+
+
+class _HashingSpool:
+    """Temporary file in the blob folder that hashes the bytes written to it"""
+
+    def __init__(self):
+        folder = blob_folder()
+        os.makedirs(folder, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=folder, prefix='.upload-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def spool_upload(total_content_length=None, content_type=None, filename=None, content_length=None):
+    """Werkzeug stream_factory that writes each uploaded file next to the blobs, hashing it on the way"""
+    return _HashingSpool()
+
+
+def store_spool(spool):
+    """Move a received spool into the store and return (content hash, size)"""
+    spool.close()
+    contentHash = spool.hexdigest()
+    put_file(spool.name, contentHash)
+    return contentHash, spool.size
+
+
+def discard_spool(spool):
+    spool.close()
+    if os.path.exists(spool.name):
+        os.remove(spool.name)
+
+
+def put_object(key, contentHash):
+    """Move an object already in storage (a direct upload) whose hash is verified into the store and return the blob location"""
+    if not _reuse(contentHash):
+        storage().copy(key, blob_key(contentHash))
+    storage().delete(key)
+    return storage().location(blob_key(contentHash))
+
+
+def open_blob(contentHash):
+    """Binary stream of a stored blob; FileNotFoundError when it is not stored"""
+    return storage().open(blob_key(contentHash), contentHash)
+
+
+def read_blob(contentHash):
+    with open_blob(contentHash) as blob:
+        return blob.read()
+
+
+def _references(session):
+    return session.info.setdefault('blobRefDeltas', Counter()), session.info.setdefault('blobSizes', {})
+
+
+def _add_reference(target, contentHash, delta):
+    if contentHash:
+        deltas, sizes = _references(object_session(target))
+        deltas[contentHash] += delta
+        if delta > 0:
+            sizes[contentHash] = target.ContentSize if isinstance(target, Image) else target.Size
+
+
+# Reference counting. Mapper events record every change to a File/Image
+# ContentHash during a flush, including rows removed by ORM cascades, and the
+# totals are applied to the blobs table in the same transaction once the flush
+# has run, so a rollback undoes the counts together with the rows.
+@event.listens_for(File, 'after_insert')
+@event.listens_for(Image, 'after_insert')
+def _count_inserted_reference(mapper, connection, target):
+    _add_reference(target, target.ContentHash, 1)
+
+
+@event.listens_for(File, 'after_update')
+@event.listens_for(Image, 'after_update')
+def _count_updated_reference(mapper, connection, target):
+    history = inspect(target).attrs.ContentHash.history
+    for contentHash in history.added:
+        _add_reference(target, contentHash, 1)
+    for contentHash in history.deleted:
+        _add_reference(target, contentHash, -1)
+
+
+@event.listens_for(File, 'before_delete')
+@event.listens_for(Image, 'before_delete')
+def _count_deleted_reference(mapper, connection, target):
+    # Read before the row is gone, in case the hash still has to be loaded
+    _add_reference(target, target.ContentHash, -1)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_blob_references(session, flushContext):
+    deltas = session.info.pop('blobRefDeltas', None)
+    sizes = session.info.pop('blobSizes', {})
+    if deltas:
+        count_references(session, deltas, sizes)
+
+
+def count_references(session, deltas, sizes):
+    """Add deltas ({hash: change}) to the blob reference counts, creating blobs rows of the given sizes.
+
+    Called for every flush; bulk INSERTs that bypass the mapper events call it
+    directly for the rows they create.
+    """
+    blobs = Blob.__table__
+    connection = session.connection()
+    now = datetime.now()
+    for contentHash, delta in sorted(deltas.items()):
+        if delta > 0:
+            dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+            insert = dialect.insert(blobs).values(
+                ContentHash=contentHash, Size=sizes.get(contentHash), RefCount=delta,
+                CreatedDateTime=now, LastModifyDateTime=now
+            )
+            connection.execute(insert.on_conflict_do_update(
+                index_elements=[blobs.c.ContentHash],
+                set_={'RefCount': blobs.c.RefCount + delta, 'LastModifyDateTime': now}
+            ))
+        elif delta < 0:
+            connection.execute(
+                update(blobs).where(blobs.c.ContentHash == contentHash)
+                .values(RefCount=blobs.c.RefCount + delta, LastModifyDateTime=now)
+            )
+
+
+def release_references(connection, fileCondition, imageCondition):
+    """Take the File and Image rows matching the conditions off the blob reference counts, in one UPDATE.
+
+    For rows about to go in a bulk DELETE or an ON DELETE CASCADE, which the
+    mapper events never see; connection is a Connection or a Session.
+    """
+    fileRefs = select(func.count()).where(fileCondition, File.ContentHash == Blob.ContentHash).scalar_subquery()
+    imageRefs = select(func.count()).where(imageCondition, Image.ContentHash == Blob.ContentHash).scalar_subquery()
+    connection.execute(update(Blob).where(or_(
+        Blob.ContentHash.in_(select(File.ContentHash).where(fileCondition)),
+        Blob.ContentHash.in_(select(Image.ContentHash).where(imageCondition))
+    )).values(RefCount=Blob.RefCount - fileRefs - imageRefs, LastModifyDateTime=datetime.now())
+        .execution_options(synchronize_session=False))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_blob_references(session):
+    session.info.pop('blobRefDeltas', None)
+    session.info.pop('blobSizes', None)
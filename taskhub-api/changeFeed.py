@@ -0,0 +1,199 @@
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import event, select, insert, update, delete, literal, func, and_, or_, DateTime
+from sqlalchemy.orm import Session, aliased
+from database import db
+from models import Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, File, Url, Collaboration, User, Change
+from loaders import serialize_loaders
+
+# Change feed for delta sync (GET /Sync/changes). Every insert, update and
+# delete of a synced row appends (entity, id, vault) to the changes table.
+# Flushes are recorded by the session events below, with one INSERT ... SELECT
+# per model and flush; bulk statements that bypass the flush call
+# record_changes themselves (tombstones.tombstone, batch uploads, the
+# reference clean-up of treeDeletes.delete_tree, the upload layout
+# migration). Deletes are tombstones, so a deleted row is still there to
+# record, and read_changes reports it as deleted.
+#
+# The server's change sequence is Seq, numbered when the transaction commits,
+# not when it flushes: before_commit takes a lock held until the commit (an
+# advisory lock on PostgreSQL; SQLite runs one writing transaction at a time
+# anyway) and numbers the transaction's changes after the highest Seq so far.
+# Seq therefore follows commit order, so no change can become visible behind
+# a cursor a client already holds, however long its transaction ran.
+#
+# A client keeps the cursor of its last page and asks for what came after it.
+# Each page holds the current state of the rows changed since, once per row,
+# and a cursor to continue from. Changes are kept as long as tombstones
+# (purge_tombstones trims them); a cursor older than that, or no cursor at
+# all, gets a reset: reload everything, then go on from the cursor of the
+# reset page.
+#
+# Rows outside any vault (e.g. tasks not on a page) have no vault. They are
+# scoped like the /Company/<id> listings instead: a user gets those created
+# by someone of their own company. A row moved to another vault shows up in
+# the feed of the vault it moved to.
+
+SYNCED_MODELS = {model.__name__: model for model in (Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, File, Url)}
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+# pg_advisory_xact_lock key that orders the commits numbering changes
+CHANGE_SEQUENCE_LOCK = 0x53594e43
+
+
+def _folder_vault(folderId):
+    folder = aliased(Folder)
+    return [(folder, folder.Id == folderId)], folder.VaultId
+
+
+def _workspace_vault(workspaceId):
+    workspace = aliased(Workspace)
+    joins, vault = _folder_vault(workspace.FolderId)
+    return [(workspace, workspace.Id == workspaceId)] + joins, vault
+
+
+def _page_vault(pageId):
+    page = aliased(Page)
+    joins, vault = _workspace_vault(page.WorkspaceId)
+    return [(page, page.Id == pageId)] + joins, vault
+
+
+def _vault_of(model):
+    """(outer joins, column) that give the vault a row of model is in"""
+    if model is Vault:
+        return [], Vault.Id
+    if model is Folder:
+        return [], Folder.VaultId
+    if model in (Workspace, Url):
+        return _folder_vault(model.FolderId)
+    if model is Page:
+        return _workspace_vault(Page.WorkspaceId)
+    if model is File:
+        paths = [_folder_vault(File.FolderId), _workspace_vault(File.WorkspaceId), _page_vault(File.PageId)]
+        return [join for joins, _ in paths for join in joins], func.coalesce(*(vault for _, vault in paths))
+    return _page_vault(model.PageId)
+
+
+def record_changes(session, model, condition, now=None):
+    """Append a change for every row of model matching condition, in one INSERT ... SELECT.
+
+    The rows must still exist; the changes are numbered when session commits.
+    """
+    joins, vault = _vault_of(model)
+    creator = aliased(User)
+    rows = select(literal(model.__name__), model.Id, vault, creator.CompanyId, literal(now or datetime.now(), DateTime)) \
+        .select_from(model).outerjoin(creator, model.CreatedBy == creator.Id)
+    for target, onclause in joins:
+        rows = rows.outerjoin(target, onclause)
+    session.execute(insert(Change.__table__).from_select(
+        ['Entity', 'EntityId', 'VaultId', 'CompanyId', 'ChangedDateTime'], rows.where(condition)))
+    session.info['changesRecorded'] = True
+
+
+def _record(session, objects, now):
+    ids = {}
+    for obj in objects:
+        if type(obj).__name__ in SYNCED_MODELS and obj.Id is not None:
+            ids.setdefault(type(obj), set()).add(obj.Id)
+    for model, modelIds in ids.items():
+        record_changes(session, model, model.Id.in_(sorted(modelIds)), now)
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_deletes(session, flushContext, instances):
+    # Recorded while the rows still exist; rows the database cascades along are not
+    _record(session, session.deleted, datetime.now())
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_writes(session, flushContext):
+    modified = (obj for obj in session.dirty if session.is_modified(obj, include_collections=False))
+    _record(session, chain(session.new, modified), datetime.now())
+
+
+@event.listens_for(Session, 'before_commit')
+def _number_changes(session):
+    # The commit's own flush would only come after this event
+    session.flush()
+    if not session.info.pop('changesRecorded', False):
+        return
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute(select(func.pg_advisory_xact_lock(CHANGE_SEQUENCE_LOCK)))
+    # Changes without a Seq that this transaction can see are its own
+    changes = Change.__table__
+    last = select(func.coalesce(func.max(changes.c.Seq), 0)).scalar_subquery()
+    numbered = select(changes.c.Id, (last + func.row_number().over(order_by=changes.c.Id)).label('Seq')) \
+        .where(changes.c.Seq.is_(None)).subquery()
+    connection.execute(update(changes).where(changes.c.Id == numbered.c.Id).values(Seq=numbered.c.Seq))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_recorded_changes(session):
+    session.info.pop('changesRecorded', None)
+
+
+def visible_vaults(userId):
+    """SELECT of the ids of the vaults a user created or collaborates on, as GET /Vault/?userId= lists them"""
+    return select(Vault.Id).where(or_(
+        Vault.CreatedBy == userId, Vault.Id.in_(select(Collaboration.VaultId).where(Collaboration.UserId == userId))))
+
+
+def cursor_before(moment):
+    """The cursor of the last change before moment, e.g. the newest LastModifyDateTime a client holds.
+
+    None when the feed does not reach back that far, which read_changes answers with a reset.
+    """
+    before, after = db.session.execute(select(
+        select(func.max(Change.Seq)).where(Change.ChangedDateTime < moment).scalar_subquery(),
+        select(func.min(Change.Seq)).where(Change.ChangedDateTime >= moment).scalar_subquery())).one()
+    if before is None or after is None:
+        return before
+    # A change made after moment may have committed, and been numbered, before one made earlier
+    return min(before, after - 1)
+
+
+def read_changes(since, limit=SYNC_PAGE_SIZE, userId=None):
+    """The page of the feed after cursor since: {'changes', 'cursor', 'hasMore', 'reset'}"""
+    oldest, newest = db.session.execute(select(func.min(Change.Seq), func.max(Change.Seq))).one()
+    if since is None or (oldest is not None and since < oldest - 1):
+        # Changes after since are gone or were never recorded
+        return {'changes': [], 'cursor': newest or 0, 'hasMore': False, 'reset': True}
+
+    query = select(Change).where(Change.Seq > since).order_by(Change.Seq).limit(limit + 1)
+    if userId is not None:
+        company = select(User.CompanyId).where(User.Id == userId).scalar_subquery()
+        query = query.where(or_(Change.VaultId.in_(visible_vaults(userId)),
+                                and_(Change.VaultId.is_(None), Change.CompanyId == company)))
+    rows = db.session.execute(query).scalars().all()
+    hasMore = len(rows) > limit
+    page = rows[:limit]
+
+    # Once per row, where it last changed in the page
+    latest = {}
+    for change in page:
+        latest.pop((change.Entity, change.EntityId), None)
+        latest[change.Entity, change.EntityId] = change
+    current = {}
+    for name, model in SYNCED_MODELS.items():
+        ids = [entityId for entity, entityId in latest if entity == name]
+        if ids:
+            current.update(((name, row.Id), row) for row in db.session.execute(
+                select(model).options(*serialize_loaders(model)).where(model.Id.in_(ids))
+                .execution_options(include_deleted=True)).unique().scalars())
+    changes = []
+    for key, change in latest.items():
+        row = current.get(key)
+        if row is None or row.DeletedAt is not None:
+            changes.append({'type': change.Entity, 'id': change.EntityId, 'deleted': True, 'data': None})
+        else:
+            changes.append({'type': change.Entity, 'id': change.EntityId, 'deleted': False, 'data': row.serialize()})
+    return {'changes': changes, 'cursor': page[-1].Seq if page else since, 'hasMore': hasMore, 'reset': False}
+
+
+def trim_changes(cutoff, batchSize):
+    """Delete up to batchSize changes recorded before cutoff, always keeping the newest; returns how many"""
+    newest = select(func.max(Change.Seq)).scalar_subquery()
+    doomed = select(Change.Id).where(Change.ChangedDateTime < cutoff, Change.Seq < newest).order_by(Change.Seq).limit(batchSize)
+    return db.session.execute(delete(Change).where(Change.Id.in_(doomed))
+                              .execution_options(synchronize_session=False)).rowcount
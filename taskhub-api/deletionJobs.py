@@ -0,0 +1,91 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, or_
+from database import db
+from models import Vault, Folder, Workspace, Page, File, Url
+from jobs import job_handler, enqueue_job, report_progress
+from tombstones import tombstone, tombstone_pages
+from treeDeletes import folder_tree_query, delete_tree, delete_pages, delete_vault
+
+# Deleting a vault, folder or workspace happens in two steps. The request
+# marks the target and every row below it deleted with a few UPDATEs, which
+# hides them at once (tombstones.py), and queues a job.
+# The job then purges the pages of the tree PURGE_BATCH_SIZE at a time, one
+# transaction per batch and reporting progress in pages. Finally it removes
+# the emptied workspaces, folders and vault with treeDeletes.delete_tree.
+# An interrupted purge simply starts over on what is left.
+
+PURGE_BATCH_SIZE = 200
+
+
+def _mark_deleted(folderIds=(), workspaceIds=()):
+    # folderIds is a list of ids or a SELECT of them (folder_tree_query)
+    now = datetime.now()
+    workspaceCondition = or_(Workspace.FolderId.in_(folderIds), Workspace.Id.in_(workspaceIds))
+    workspaces = select(Workspace.Id).where(workspaceCondition)
+    tombstone_pages(Page.WorkspaceId.in_(workspaces), now)
+    tombstone(File, or_(File.FolderId.in_(folderIds), File.WorkspaceId.in_(workspaces)), now)
+    tombstone(Url, Url.FolderId.in_(folderIds), now)
+    tombstone(Workspace, workspaceCondition, now)
+    tombstone(Folder, Folder.Id.in_(folderIds), now)
+    return now
+
+
+def schedule_vault_delete(vaultId, createdBy=None):
+    """Hide a vault with its whole tree and queue the job that purges it; the caller commits and starts the job"""
+    now = _mark_deleted(folder_tree_query(Folder.VaultId == vaultId))
+    tombstone(Vault, Vault.Id == vaultId, now)
+    return enqueue_job('delete-vault', {'vaultId': vaultId}, createdBy)
+
+
+def schedule_folder_delete(folderId, createdBy=None):
+    """Hide a folder with its subfolders and workspaces and queue the job that purges them"""
+    _mark_deleted(folder_tree_query(Folder.Id == folderId))
+    return enqueue_job('delete-folder', {'folderId': folderId}, createdBy)
+
+
+def schedule_workspace_delete(workspaceId, createdBy=None):
+    """Hide a workspace and queue the job that purges it"""
+    _mark_deleted(workspaceIds=[workspaceId])
+    return enqueue_job('delete-workspace', {'workspaceId': workspaceId}, createdBy)
+
+
+def _purge_pages(job, workspaceCondition):
+    """Delete the pages of the matching workspaces in batches, committing and reporting progress after each"""
+    pageIds = db.session.execute(
+        select(Page.Id).join(Workspace, Page.WorkspaceId == Workspace.Id).where(workspaceCondition)
+        .order_by(Page.Id).execution_options(include_deleted=True)
+    ).scalars().all()
+    # One more step for the rows above the pages
+    report_progress(job, 0, len(pageIds) + 1)
+    for start in range(0, len(pageIds), PURGE_BATCH_SIZE):
+        batch = pageIds[start:start + PURGE_BATCH_SIZE]
+        delete_pages(batch)
+        report_progress(job, start + len(batch))
+
+
+@job_handler('delete-vault')
+def purge_vault(job, payload):
+    vaultId = payload['vaultId']
+    _purge_pages(job, Workspace.FolderId.in_(folder_tree_query(Folder.VaultId == vaultId)))
+    counts = delete_vault(vaultId)
+    db.session.commit()
+    current_app.logger.info('Purged vault %s: %s', vaultId, counts)
+
+
+@job_handler('delete-folder')
+def purge_folder(job, payload):
+    folderId = payload['folderId']
+    _purge_pages(job, Workspace.FolderId.in_(folder_tree_query(Folder.Id == folderId)))
+    counts = delete_tree(folder_tree_query(Folder.Id == folderId))
+    db.session.commit()
+    current_app.logger.info('Purged folder %s: %s', folderId, counts)
+
+
+@job_handler('delete-workspace')
+def purge_workspace(job, payload):
+    workspaceId = payload['workspaceId']
+    _purge_pages(job, Workspace.Id == workspaceId)
+    counts = delete_tree(workspaceIds=[workspaceId])
+    db.session.commit()
+    current_app.logger.info('Purged workspace %s: %s', workspaceId, counts)
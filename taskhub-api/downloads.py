@@ -0,0 +1,117 @@
+import mimetypes
+import os
+from urllib.parse import quote
+from flask import current_app, redirect, request, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+from blobStore import blob_key, is_content_hash
+from storageBackends import storage, PRESIGNED_URL_EXPIRY
+
+# Serving of /uploads files. Responses carry a strong ETag, answer
+# If-None-Match with 304 and Range with 206. The ETag is never computed from
+# the bytes: a blob is named after its content hash, which goes into the ETag
+# with the size; a legacy file gets its size and modification time instead.
+# DOWNLOAD_OFFLOAD hands the byte transfer to the front web server instead:
+#   'x-accel-redirect'  nginx; the file is addressed as DOWNLOAD_ACCEL_PREFIX +
+#                       its path under UPLOAD_FOLDER, which must map to an
+#                       internal location aliased to the uploads directory
+#   'x-sendfile'        Apache mod_xsendfile / lighttpd; absolute file path
+# The front server then handles ranges itself; Python only answers 304s.
+# With a remote storage backend, stored objects are not served here at all:
+# the response redirects to a short-lived presigned URL of the object.
+
+DEFAULT_ACCEL_PREFIX = '/protected-uploads/'
+
+
+def file_etag(path):
+    """ETag of a local file from its name and stat, without reading it"""
+    stat = os.stat(path)
+    name = os.path.basename(path)
+    if is_content_hash(name):
+        return f'{name}-{stat.st_size}'
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def _offloaded_response(path, offload, mimetype=None):
+    uploadRoot = os.path.abspath(current_app.config.get('UPLOAD_FOLDER', 'uploads'))
+    response = current_app.response_class(mimetype=mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if offload == 'x-accel-redirect':
+        relative = os.path.relpath(os.path.abspath(path), uploadRoot).replace(os.sep, '/')
+        prefix = current_app.config.get('DOWNLOAD_ACCEL_PREFIX', DEFAULT_ACCEL_PREFIX)
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative)
+    else:
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(file_etag(path))
+    response.last_modified = os.path.getmtime(path)
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        response.headers.pop('X-Accel-Redirect', None)
+        response.headers.pop('X-Sendfile', None)
+    return response
+
+
+def stored_file(files, filename):
+    """Newest file in the files query with stored content whose download name is filename"""
+    from models import File
+    stored = files.filter(File.ContentHash.isnot(None)).order_by(File.Id.desc())
+    file = stored.filter(File.Name == filename).first()
+    if file is not None:
+        return file
+    # Only names secure_filename rewrote (spaces, accents, ...) are compared here, over their ids and names
+    for fileId, name in stored.with_entities(File.Id, File.Name):
+        if secure_filename(name or '') == filename:
+            return files.session.get(File, fileId)
+    return None
+
+
+def send_path(path, mimetype=None, downloadName=None):
+    """Serve a local file with content ETags, conditional and range support"""
+    if downloadName and not mimetype:
+        mimetype = mimetypes.guess_type(downloadName)[0]
+    offload = current_app.config.get('DOWNLOAD_OFFLOAD')
+    if offload in ('x-accel-redirect', 'x-sendfile'):
+        return _offloaded_response(path, offload, mimetype)
+    return send_file(os.path.abspath(path), mimetype=mimetype, download_name=downloadName,
+                     etag=file_etag(path), conditional=True)
+
+
+def send_stored(key, legacyKey=None, mimetype=None, downloadName=None):
+    """Serve an object of the storage backend: its local file, or a redirect to a presigned URL"""
+    backend = storage()
+    if backend.remote:
+        if downloadName and not mimetype:
+            mimetype = mimetypes.guess_type(downloadName)[0]
+        expiresIn = current_app.config.get('PRESIGNED_URL_EXPIRY', PRESIGNED_URL_EXPIRY)
+        return redirect(backend.presigned_download(key, mimetype, downloadName, expiresIn))
+    path = backend.locate(key, legacyKey)
+    if path is None:
+        raise NotFound()
+    return send_path(path, mimetype, downloadName)
+
+
+def send_file_content(file):
+    """Serve the content of a File row, whether in the blob store or in the legacy layout"""
+    downloadName = secure_filename(file.Name or '') or None
+    if file.ContentHash:
+        return send_stored(blob_key(file.ContentHash), file.ContentHash, downloadName=downloadName)
+    if not file.Path or not os.path.isfile(file.Path):
+        raise NotFound()
+    return send_path(file.Path, downloadName=downloadName)
+
+
+def send_upload(directory, filename, files=None):
+    """Serve directory/filename with content ETags, conditional and range support.
+
+    Deduplicated uploads are not stored under their page/workspace/folder
+    directory; when the path does not exist, files (a File query for that
+    location) is searched for an upload with the same name and its blob served.
+    """
+    path = safe_join(directory, filename)
+    if path is not None and os.path.isfile(path):
+        return send_path(path)
+    file = stored_file(files, filename) if files is not None else None
+    if file is None:
+        raise NotFound()
+    return send_stored(blob_key(file.ContentHash), file.ContentHash, downloadName=filename)
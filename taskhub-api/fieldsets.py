@@ -0,0 +1,34 @@
+from flask import request
+
+# Sparse fieldsets: ?fields=id,title,status on the namespaces below returns only
+# the listed keys. The output is trimmed by flask-restx's own field mask; the
+# list and detail resources also pass requested_fields() to serialize_loaders()
+# so the joins and heavy columns behind dropped fields are never loaded.
+
+SPARSE_NAMESPACES = {'Task', 'Card', 'Image', 'TextBox', 'File', 'Workspace'}
+FIELDS_HELP = 'Comma separated list of fields to return, e.g. id,title,status'
+
+
+def _sparse_namespace():
+    return request.path.strip('/').split('/', 1)[0] in SPARSE_NAMESPACES
+
+
+def requested_fields():
+    """The field names selected with ?fields=, or None for the full representation"""
+    fields = request.args.get('fields')
+    if not fields or not _sparse_namespace():
+        return None
+    return {field.strip() for field in fields.split(',') if field.strip()}
+
+
+def init_app(app):
+    maskEnvironKey = 'HTTP_' + app.config.get('RESTX_MASK_HEADER', 'X-Fields').upper().replace('-', '_')
+
+    @app.before_request
+    def apply_fields_mask():
+        # marshal_with only reads the mask from the X-Fields header; request
+        # headers are a live view of the WSGI environ, so an explicit header
+        # still wins and ?fields= fills in for it otherwise.
+        fields = request.args.get('fields')
+        if fields and _sparse_namespace() and maskEnvironKey not in request.environ:
+            request.environ[maskEnvironKey] = fields
@@ -0,0 +1,66 @@
+import os
+from io import BytesIO
+from PIL import Image as PILImage, ImageOps, UnidentifiedImageError
+from blobStore import blob_folder, fanout_parts, read_blob
+from storageBackends import storage
+
+# Derived versions of stored images. Variants are keyed by the source blob's
+# content hash, so they are rendered once per distinct image and a changed
+# source simply gets new variants; nothing has to be invalidated.
+
+IMAGE_VARIANTS = {
+    'thumbnail': {'maxSize': (320, 320), 'quality': 75},
+    'web': {'maxSize': (1600, 1600), 'quality': 82},
+}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_MIME_TYPE = 'image/webp'
+
+
+def variant_key(contentHash, variant):
+    return '/'.join(['variants', variant] + fanout_parts(contentHash) + [f'{contentHash}.webp'])
+
+
+def flat_variant_key(contentHash, variant):
+    """Key a variant was written under before the fan-out layout"""
+    return f'variants/{variant}/{contentHash}.webp'
+
+
+def variant_path(contentHash, variant):
+    """Where a variant is written on local storage"""
+    return os.path.join(blob_folder(), *variant_key(contentHash, variant).split('/'))
+
+
+def flat_variant_path(contentHash, variant):
+    return os.path.join(blob_folder(), *flat_variant_key(contentHash, variant).split('/'))
+
+
+def render_variant(data, variant):
+    """Return the variant of the encoded image data, scaled down to fit its bounding box"""
+    spec = IMAGE_VARIANTS[variant]
+    with PILImage.open(BytesIO(data)) as source:
+        # Bake the camera orientation in, since the EXIF data is not carried over
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail(spec['maxSize'])
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+        output = BytesIO()
+        image.save(output, VARIANT_FORMAT, quality=spec['quality'])
+    return output.getvalue()
+
+
+def ensure_variant(contentHash, variant):
+    """Location of a blob's variant, rendering it on first use; None when the blob is not a decodable image"""
+    key = variant_key(contentHash, variant)
+    location = storage().locate(key, flat_variant_key(contentHash, variant))
+    if location:
+        return location
+    try:
+        data = render_variant(read_blob(contentHash), variant)
+    except (UnidentifiedImageError, PILImage.DecompressionBombError, OSError):
+        return None
+    storage().put_stream(key, BytesIO(data))
+    return storage().location(key)
+
+
+def generate_variants(contentHash):
+    for variant in IMAGE_VARIANTS:
+        ensure_variant(contentHash, variant)
@@ -0,0 +1,332 @@
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, update, or_
+from database import db
+from models import Job
+
+# Durable background jobs for work too slow to finish inside a request. A job
+# is a row in the jobs table with a kind, a JSON payload, a priority and a
+# status that moves from queued to running to succeeded or failed. The row
+# also holds the progress the handler reports, which clients poll through
+# /Job/<id>. The table is the whole queue, so nothing is needed beyond the
+# database.
+#
+# Handlers are registered per kind with @job_handler and get (job, payload).
+# A handler commits as it goes (report_progress), so a long job is a series of
+# short transactions. It may run more than once: an exception puts the job
+# back in the queue with an exponential backoff until it has used up
+# MaxAttempts, and a job whose worker stops heartbeating is taken over by
+# another. Handlers must therefore be safe to run again over their own
+# partial work. Raise JobFailed to fail a job without retrying.
+#
+# Workers claim queued jobs with SELECT ... FOR UPDATE SKIP LOCKED, highest
+# priority first, so any number of them can share the table. `flask
+# run-worker` runs a dedicated worker with a thread or process pool. With
+# JOB_WORKERS set, each API process also starts a small thread worker the
+# first time a request queues a job (start_job). Set JOB_WORKERS to 0 when
+# only dedicated workers should run jobs.
+#
+# An idle worker polls less and less often, up to JOB_MAX_POLL_INTERVAL, and
+# a job queued by a request of its own process wakes it at once. Stale jobs
+# are looked for every half JOB_LOCK_TIMEOUT, not on every poll.
+
+JOB_WORKERS = 2
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = timedelta(seconds=30)
+JOB_MAX_RETRY_DELAY = timedelta(hours=1)
+JOB_POLL_INTERVAL = 1.0
+# An empty queue is polled at most this far apart
+JOB_MAX_POLL_INTERVAL = 30.0
+# A running job whose worker has not heartbeated for this long is queued again
+JOB_LOCK_TIMEOUT = timedelta(minutes=5)
+JOB_HANDLERS = {}
+
+_workerLock = threading.Lock()
+# The app of a `run-worker --pool process` worker, inherited by its forked processes
+_processApp = None
+
+
+class JobFailed(Exception):
+    """Raised by a handler to fail its job for good, without further attempts"""
+
+
+def job_handler(kind):
+    """Register fn(job, payload) as the handler of a job kind"""
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue_job(kind, payload=None, createdBy=None, priority=0, maxAttempts=JOB_MAX_ATTEMPTS, runAfter=None):
+    """Add a queued job to the session; workers see it once the caller has committed (see job_response)"""
+    now = datetime.now()
+    job = Job(Kind=kind, Payload=json.dumps(payload), Status='queued', Priority=priority, Attempts=0,
+              MaxAttempts=maxAttempts, RunAfter=runAfter, Progress=0, CreatedBy=createdBy,
+              CreatedDateTime=now, LastModifyDateTime=now)
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def report_progress(job, done, total=None):
+    """Record how far a running job has got, committing the handler's work with it"""
+    job.Progress = done
+    if total is not None:
+        job.Total = total
+    job.LastModifyDateTime = datetime.now()
+    db.session.commit()
+
+
+def retry_delay(attempts):
+    """How long a job waits before its next attempt after failing attempts times"""
+    # Doubling past 2**16 only overflows; the cap is reached long before
+    return min(JOB_RETRY_DELAY * 2 ** min(max(attempts - 1, 0), 16), JOB_MAX_RETRY_DELAY)
+
+
+def _start(job, workerId, now):
+    job.Status = 'running'
+    job.LockedBy = workerId
+    job.Attempts = (job.Attempts or 0) + 1
+    job.StartedDateTime = job.LastModifyDateTime = now
+
+
+def claim_jobs(workerId, limit):
+    """Mark up to limit due jobs as running for workerId, highest priority first, and return their ids"""
+    now = datetime.now()
+    jobs = db.session.execute(
+        select(Job).where(Job.Status == 'queued', or_(Job.RunAfter.is_(None), Job.RunAfter <= now))
+        .order_by(Job.Priority.desc(), Job.Id).limit(limit).with_for_update(skip_locked=True)
+    ).scalars().all()
+    for job in jobs:
+        _start(job, workerId, now)
+    db.session.commit()
+    return [job.Id for job in jobs]
+
+
+def claim_job(jobId, workerId):
+    """Mark one queued job as running for workerId; False when it is not queued (finished, or taken by another worker)"""
+    job = db.session.execute(
+        select(Job).where(Job.Id == jobId, Job.Status == 'queued').with_for_update(skip_locked=True)
+    ).scalar_one_or_none()
+    if job is not None:
+        _start(job, workerId, datetime.now())
+    db.session.commit()
+    return job is not None
+
+
+def heartbeat(workerId, jobIds):
+    """Tell other workers the jobs workerId is running are still alive"""
+    if jobIds:
+        db.session.execute(update(Job).where(Job.Id.in_(list(jobIds)), Job.Status == 'running', Job.LockedBy == workerId)
+                           .values(LastModifyDateTime=datetime.now()).execution_options(synchronize_session=False))
+        db.session.commit()
+
+
+def recover_stale_jobs(lockTimeout=JOB_LOCK_TIMEOUT):
+    """Queue again the running jobs whose worker went silent, or fail them when they are out of attempts"""
+    now = datetime.now()
+    stale = [Job.Status == 'running', Job.LastModifyDateTime < now - lockTimeout]
+    failed = db.session.execute(
+        update(Job).where(*stale, Job.Attempts >= Job.MaxAttempts)
+        .values(Status='failed', LockedBy=None, Error='The worker running the job stopped', FinishedDateTime=now)
+        .execution_options(synchronize_session=False)).rowcount
+    requeued = db.session.execute(
+        update(Job).where(*stale).values(Status='queued', LockedBy=None, RunAfter=now)
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return requeued, failed
+
+
+def execute_job(jobId):
+    """Run the handler of a job this worker has claimed and record the outcome; returns the job"""
+    job = db.session.get(Job, jobId)
+    if job is None or job.Status != 'running':
+        return job
+    try:
+        handler = JOB_HANDLERS.get(job.Kind)
+        if handler is None:
+            raise JobFailed(f'Unknown job kind {job.Kind!r}')
+        handler(job, json.loads(job.Payload or 'null'))
+    except Exception as e:
+        db.session.rollback()
+        job.Error = str(e) or type(e).__name__
+        if isinstance(e, JobFailed) or job.Attempts >= (job.MaxAttempts or 1):
+            current_app.logger.exception('Job %s (%s) failed', jobId, job.Kind)
+            job.Status = 'failed'
+            job.FinishedDateTime = datetime.now()
+        else:
+            current_app.logger.warning('Job %s (%s) failed on attempt %s, retrying: %s', jobId, job.Kind, job.Attempts, job.Error)
+            job.Status = 'queued'
+            job.RunAfter = datetime.now() + retry_delay(job.Attempts)
+    else:
+        job.Status = 'succeeded'
+        job.Error = None
+        job.FinishedDateTime = datetime.now()
+        if job.Total is not None:
+            job.Progress = job.Total
+    job.LockedBy = None
+    job.LastModifyDateTime = datetime.now()
+    db.session.commit()
+    return job
+
+
+def run_job(jobId, workerId=None):
+    """Claim and run a queued job right here, in the current app context; returns the job"""
+    if claim_job(jobId, workerId or worker_id()):
+        return execute_job(jobId)
+    return db.session.get(Job, jobId)
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def _execute_in_app(app, jobId):
+    with app.app_context():
+        execute_job(jobId)
+
+
+def _init_process():
+    # Connections inherited from the parent must not be shared with it
+    with _processApp.app_context():
+        db.engine.dispose(close=False)
+
+
+def _execute_in_process(jobId):
+    _execute_in_app(_processApp, jobId)
+
+
+class Worker:
+    """Claims jobs from the table and runs them on a thread or process pool of the given size"""
+
+    def __init__(self, app, concurrency=JOB_WORKERS, pool='thread', pollInterval=JOB_POLL_INTERVAL,
+                 lockTimeout=JOB_LOCK_TIMEOUT, maxPollInterval=JOB_MAX_POLL_INTERVAL):
+        global _processApp
+        self.app = app
+        self.id = worker_id()
+        self.concurrency = concurrency
+        self.pollInterval = pollInterval
+        self.maxPollInterval = max(maxPollInterval, pollInterval)
+        self.lockTimeout = lockTimeout
+        self.recoveredAt = None
+        self.running = {}
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        if pool == 'process':
+            # Forked processes inherit the app, its handlers and its config
+            _processApp = app
+            self.executor = ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('fork'),
+                                                initializer=_init_process)
+            self.submit = lambda jobId: self.executor.submit(_execute_in_process, jobId)
+        else:
+            self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix='job')
+            self.submit = lambda jobId: self.executor.submit(_execute_in_app, app, jobId)
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def _reap(self):
+        for jobId, future in list(self.running.items()):
+            if future.done():
+                del self.running[jobId]
+                if future.exception() is not None:
+                    # Not a handler error (execute_job records those) but a dead process or lost connection;
+                    # the job stops heartbeating and recover_stale_jobs puts it back in the queue
+                    self.app.logger.error('Worker lost job %s: %r', jobId, future.exception())
+
+    def poll_delay(self, idlePolls):
+        """Seconds to wait after idlePolls polls in a row found nothing to do"""
+        return min(self.pollInterval * 2 ** min(max(idlePolls - 1, 0), 16), self.maxPollInterval)
+
+    def poll(self):
+        """One round: recover stale jobs when due, heartbeat, claim what fits in the pool; returns how many were claimed"""
+        self._reap()
+        now = time.monotonic()
+        recover = self.recoveredAt is None or now - self.recoveredAt >= self.lockTimeout.total_seconds() / 2
+        with self.app.app_context():
+            if recover:
+                recover_stale_jobs(self.lockTimeout)
+                self.recoveredAt = now
+            heartbeat(self.id, self.running)
+            free = self.concurrency - len(self.running)
+            jobIds = claim_jobs(self.id, free) if free > 0 else []
+        for jobId in jobIds:
+            future = self.submit(jobId)
+            self.running[jobId] = future
+            future.add_done_callback(lambda _: self.wakeup.set())
+        return len(jobIds)
+
+    def run(self, untilIdle=False):
+        """Poll until stopped, or with untilIdle until no job is due and none is running"""
+        idlePolls = 0
+        try:
+            while not self.stopping.is_set():
+                claimed = self.poll()
+                idle = not claimed and not self.running
+                if untilIdle and idle:
+                    break
+                idlePolls = idlePolls + 1 if idle else 0
+                # Poll again straight away only while there are due jobs and room for them
+                if not claimed or len(self.running) >= self.concurrency:
+                    if self.wakeup.wait(self.poll_delay(idlePolls)):
+                        idlePolls = 0
+                    self.wakeup.clear()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+def start_job(jobId=None):
+    """Get jobs a request has committed running without waiting for the next poll.
+
+    Wakes this process's worker thread, which is started on first use when
+    JOB_WORKERS is set; otherwise dedicated `flask run-worker` processes pick
+    the job up.
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('JOB_WORKERS'):
+        return
+    with _workerLock:
+        worker = app.extensions.get('jobs')
+        if worker is None:
+            worker = app.extensions['jobs'] = Worker(app, app.config['JOB_WORKERS'])
+            threading.Thread(target=worker.run, name='job-worker', daemon=True).start()
+    worker.wake()
+
+
+def job_response(job):
+    """Commit a job queued by a request, start it and answer 202 Accepted with it"""
+    db.session.commit()
+    start_job(job.Id)
+    return job.serialize(), 202, {'Location': f'/Job/{job.Id}'}
+
+
+def init_app(app):
+    @app.cli.command('run-worker')
+    @click.option('--concurrency', default=JOB_WORKERS, help='Jobs to run at the same time')
+    @click.option('--pool', type=click.Choice(['thread', 'process']), default='thread',
+                  help='Run handlers on threads, or on forked processes for CPU-bound work')
+    @click.option('--poll-interval', default=JOB_POLL_INTERVAL, help='Seconds between polls while jobs are coming in')
+    @click.option('--max-poll-interval', default=JOB_MAX_POLL_INTERVAL, help='Seconds between polls of an idle queue')
+    @click.option('--until-idle', is_flag=True, help='Exit once no job is due, e.g. when run from cron')
+    def run_worker_command(concurrency, pool, poll_interval, max_poll_interval, until_idle):
+        """Run background jobs from the jobs table"""
+        worker = Worker(app, concurrency, pool, poll_interval, maxPollInterval=max_poll_interval)
+        click.echo(f'Worker {worker.id} running up to {concurrency} jobs on a {pool} pool')
+        try:
+            worker.run(untilIdle=until_idle)
+        except KeyboardInterrupt:
+            worker.stop()
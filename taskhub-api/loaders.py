@@ -0,0 +1,98 @@
+from database import db
+from models import Vault, Event, UserEvents, Task, Card, TextBox, Image, Url, Folder, Workspace, File, Page, Collaboration, FavoriteTasks, PinnedTasks, User
+
+# Loader profiles: for every model, the relationships its serialize() reads,
+# keyed by the serialized field (or fields) that need them. List endpoints apply the
+# profile so that serializing N rows costs a fixed number of queries instead
+# of one lazy load per row and relationship.
+LOADER_PROFILES = {
+    Vault: {
+        'createdByName': db.joinedload(Vault.CreatedByUser),
+    },
+    Event: {
+        'createdByUser': db.joinedload(Event.CreatedByUser),
+        # Attendee rows and their users arrive in one extra batched SELECT
+        'userEvents': db.selectinload(Event.EventUsers).joinedload(UserEvents.User),
+    },
+    Task: {
+        'assignedToName': db.joinedload(Task.AssignedUser),
+        'createdByName': db.joinedload(Task.CreatedByUser),
+        'pageName': db.joinedload(Task.Page),
+    },
+    Card: {
+        'assignedToName': db.joinedload(Card.AssignedUser),
+        'createdByUser': db.joinedload(Card.CreatedByUser),
+        'workspaceId': db.selectinload(Card.GeneratedWorkspace),
+    },
+    TextBox: {
+        'pageName': db.joinedload(TextBox.Page),
+        'createdByUser': db.joinedload(TextBox.CreatedByUser),
+    },
+    Image: {
+        'pageName': db.joinedload(Image.Page),
+        'createdByUser': db.joinedload(Image.CreatedByUser),
+    },
+    Url: {
+        'createdByUser': db.joinedload(Url.CreatedByUser),
+    },
+    Folder: {
+        'createdByUser': db.joinedload(Folder.CreatedByUser),
+        'parentName': db.joinedload(Folder.ParentFolder),
+    },
+    Workspace: {
+        'createdByUser': db.joinedload(Workspace.CreatedByUser),
+        ('folderName', 'vaultId'): db.joinedload(Workspace.Folder),
+    },
+    File: {
+        'createdByUser': db.joinedload(File.CreatedByUser),
+    },
+    Page: {
+        'createdByUser': db.joinedload(Page.CreatedByUser),
+        # serialize() walks Workspace -> Folder for the vault id; join the
+        # whole chain into the page statement.
+        'vaultId': db.joinedload(Page.Workspace).joinedload(Workspace.Folder),
+    },
+    Collaboration: {
+        'userFullName': db.joinedload(Collaboration.User),
+    },
+    FavoriteTasks: {
+        'user': db.joinedload(FavoriteTasks.User),
+    },
+    PinnedTasks: {
+        'user': db.joinedload(PinnedTasks.User),
+    },
+    User: {
+        'company': db.joinedload(User.Company),
+    },
+}
+
+
+# Columns heavy enough to leave out of the SELECT when a sparse fieldset
+# (?fields=) does not ask for them. serialize() reads them via unless_deferred().
+DEFERRABLE_COLUMNS = {
+    Task: {'description': Task.Description},
+    Card: {'description': Card.Description},
+    TextBox: {'text': TextBox.Text},
+}
+
+
+def _needed(profileFields, fields):
+    if isinstance(profileFields, str):
+        profileFields = (profileFields,)
+    return any(field in fields for field in profileFields)
+
+
+def serialize_loaders(model, fields=None):
+    """Return the loader options needed to serialize rows of the given model.
+
+    With a set of requested fields only the relationships and heavy columns
+    those fields need are loaded; every other relationship resolves to None
+    instead of lazy loading.
+    """
+    profile = LOADER_PROFILES.get(model, {})
+    if fields is None:
+        return tuple(profile.values())
+    options = [option for profileFields, option in profile.items() if _needed(profileFields, fields)]
+    options += [db.defer(column) for field, column in DEFERRABLE_COLUMNS.get(model, {}).items() if field not in fields]
+    options.append(db.noload('*'))
+    return tuple(options)
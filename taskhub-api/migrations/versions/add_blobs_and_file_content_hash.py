@@ -0,0 +1,53 @@
+"""Add blobs table with reference counts and content hash columns on files
+
+Revision ID: add_blobs_and_file_content_hash
+Revises: add_upload_sessions
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_blobs_and_file_content_hash'
+down_revision = 'add_upload_sessions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    blobs = op.create_table('blobs',
+    sa.Column('ContentHash', sa.String(length=64), nullable=False),
+    sa.Column('Size', sa.BigInteger(), nullable=True),
+    sa.Column('RefCount', sa.Integer(), nullable=True),
+    sa.Column('CreatedDateTime', sa.DateTime(), nullable=True),
+    sa.Column('LastModifyDateTime', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('ContentHash')
+    )
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ContentHash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('Size', sa.BigInteger(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_files_ContentHash'), ['ContentHash'], unique=False)
+
+    # Images already live in the blob store; count their references
+    images = sa.table('images', sa.column('ContentHash', sa.String), sa.column('ContentSize', sa.Integer))
+    now = datetime.now()
+    op.execute(blobs.insert().from_select(
+        ['ContentHash', 'Size', 'RefCount', 'CreatedDateTime', 'LastModifyDateTime'],
+        sa.select(
+            images.c.ContentHash, sa.func.max(images.c.ContentSize), sa.func.count(),
+            sa.literal(now, sa.DateTime), sa.literal(now, sa.DateTime)
+        ).where(images.c.ContentHash.isnot(None)).group_by(images.c.ContentHash)
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_files_ContentHash'))
+        batch_op.drop_column('Size')
+        batch_op.drop_column('ContentHash')
+
+    op.drop_table('blobs')
@@ -0,0 +1,41 @@
+"""Add the changes table behind the /Sync/changes delta-sync feed
+
+Revision ID: add_change_feed
+Revises: add_tombstones
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_change_feed'
+down_revision = 'add_tombstones'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('changes',
+    sa.Column('Id', sa.BigInteger(), nullable=False),
+    sa.Column('Seq', sa.BigInteger(), nullable=True),
+    sa.Column('Entity', sa.String(), nullable=False),
+    sa.Column('EntityId', sa.Integer(), nullable=False),
+    sa.Column('VaultId', sa.Integer(), nullable=True),
+    sa.Column('CompanyId', sa.Integer(), nullable=True),
+    sa.Column('ChangedDateTime', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('Id')
+    )
+    op.create_index('ix_changes_Seq', 'changes', ['Seq'], unique=True)
+    op.create_index('ix_changes_VaultId_Seq', 'changes', ['VaultId', 'Seq'])
+    op.create_index('ix_changes_CompanyId_Seq', 'changes', ['CompanyId', 'Seq'])
+    op.create_index('ix_changes_ChangedDateTime', 'changes', ['ChangedDateTime'])
+
+
+def downgrade():
+    op.drop_index('ix_changes_ChangedDateTime', table_name='changes')
+    op.drop_index('ix_changes_CompanyId_Seq', table_name='changes')
+    op.drop_index('ix_changes_VaultId_Seq', table_name='changes')
+    op.drop_index('ix_changes_Seq', table_name='changes')
+    op.drop_table('changes')
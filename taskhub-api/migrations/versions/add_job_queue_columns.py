@@ -0,0 +1,37 @@
+"""Add priority, retry and locking columns to jobs for the durable job queue
+
+Revision ID: add_job_queue_columns
+Revises: add_jobs_and_deleted_at
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_job_queue_columns'
+down_revision = 'add_jobs_and_deleted_at'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('Priority', sa.Integer(), nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('Attempts', sa.Integer(), nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('MaxAttempts', sa.Integer(), nullable=True, server_default='3'))
+        batch_op.add_column(sa.Column('RunAfter', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('LockedBy', sa.String(), nullable=True))
+    op.create_index('ix_jobs_queued', 'jobs', [sa.text('"Priority" DESC'), 'Id'],
+                    postgresql_where=sa.text('"Status" = \'queued\''))
+
+
+def downgrade():
+    op.drop_index('ix_jobs_queued', table_name='jobs')
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_column('LockedBy')
+        batch_op.drop_column('RunAfter')
+        batch_op.drop_column('MaxAttempts')
+        batch_op.drop_column('Attempts')
+        batch_op.drop_column('Priority')
@@ -0,0 +1,47 @@
+"""Add jobs table and DeletedAt on vaults, folders and workspaces for background deletes
+
+Revision ID: add_jobs_and_deleted_at
+Revises: add_vault_delete_cascades
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_jobs_and_deleted_at'
+down_revision = 'add_vault_delete_cascades'
+branch_labels = None
+depends_on = None
+
+TOMBSTONED_TABLES = ['vaults', 'folders', 'workspaces']
+
+
+def upgrade():
+    op.create_table('jobs',
+    sa.Column('Id', sa.Integer(), nullable=False),
+    sa.Column('Kind', sa.String(), nullable=True),
+    sa.Column('Payload', sa.Text(), nullable=True),
+    sa.Column('Status', sa.String(), nullable=True),
+    sa.Column('Progress', sa.Integer(), nullable=True),
+    sa.Column('Total', sa.Integer(), nullable=True),
+    sa.Column('Error', sa.Text(), nullable=True),
+    sa.Column('CreatedBy', sa.Integer(), nullable=True),
+    sa.Column('CreatedDateTime', sa.DateTime(), nullable=True),
+    sa.Column('StartedDateTime', sa.DateTime(), nullable=True),
+    sa.Column('FinishedDateTime', sa.DateTime(), nullable=True),
+    sa.Column('LastModifyDateTime', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['CreatedBy'], ['users.Id'], ),
+    sa.PrimaryKeyConstraint('Id')
+    )
+    for table in TOMBSTONED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('DeletedAt', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    for table in TOMBSTONED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('DeletedAt')
+    op.drop_table('jobs')
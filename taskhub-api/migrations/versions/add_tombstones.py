@@ -0,0 +1,51 @@
+"""Add DeletedAt tombstones on the page contents, pages, files and urls, with partial indexes
+
+Revision ID: add_tombstones
+Revises: add_tree_delete_cascades
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_tombstones'
+down_revision = 'add_tree_delete_cascades'
+branch_labels = None
+depends_on = None
+
+NEW_TOMBSTONED_TABLES = ['tasks', 'cards', 'textbox', 'images', 'pages', 'files', 'urls']
+# Columns the live rows of each tombstoned table are looked up by (models.tombstone_indexes)
+LIVE_INDEXES = {
+    'vaults': [],
+    'folders': ['VaultId', 'ParentId'],
+    'workspaces': ['FolderId'],
+    'pages': ['WorkspaceId'],
+    'tasks': ['PageId', 'ParentId'],
+    'cards': ['PageId'],
+    'textbox': ['PageId'],
+    'images': ['PageId'],
+    'files': ['FolderId', 'WorkspaceId', 'PageId'],
+    'urls': ['FolderId'],
+}
+
+
+def upgrade():
+    for table in NEW_TOMBSTONED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('DeletedAt', sa.DateTime(), nullable=True))
+    for table, columns in LIVE_INDEXES.items():
+        for column in columns:
+            op.create_index(f'ix_{table}_{column}_live', table, [column], postgresql_where=sa.text('"DeletedAt" IS NULL'))
+        op.create_index(f'ix_{table}_deleted', table, ['DeletedAt'], postgresql_where=sa.text('"DeletedAt" IS NOT NULL'))
+
+
+def downgrade():
+    for table, columns in LIVE_INDEXES.items():
+        op.drop_index(f'ix_{table}_deleted', table_name=table)
+        for column in columns:
+            op.drop_index(f'ix_{table}_{column}_live', table_name=table)
+    for table in NEW_TOMBSTONED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('DeletedAt')
@@ -0,0 +1,52 @@
+"""Cascade deletes down the folder, workspace and page trees in the database
+
+Revision ID: add_tree_delete_cascades
+Revises: add_job_queue_columns
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_tree_delete_cascades'
+down_revision = 'add_job_queue_columns'
+branch_labels = None
+depends_on = None
+
+# (table, column, referenced table) for every reference from a row to the
+# folder, workspace, page or task it belongs to; all become ON DELETE CASCADE
+CASCADES = [
+    ('folders', 'ParentId', 'folders'),
+    ('workspaces', 'FolderId', 'folders'),
+    ('urls', 'FolderId', 'folders'),
+    ('files', 'FolderId', 'folders'),
+    ('files', 'WorkspaceId', 'workspaces'),
+    ('files', 'PageId', 'pages'),
+    ('upload_sessions', 'FolderId', 'folders'),
+    ('upload_sessions', 'WorkspaceId', 'workspaces'),
+    ('upload_sessions', 'PageId', 'pages'),
+    ('pages', 'WorkspaceId', 'workspaces'),
+    ('tasks', 'PageId', 'pages'),
+    ('tasks', 'ParentId', 'tasks'),
+    ('textbox', 'PageId', 'pages'),
+    ('cards', 'PageId', 'pages'),
+    ('images', 'PageId', 'pages'),
+]
+
+
+def _replace_foreign_keys(ondelete):
+    for table, column, referenced in CASCADES:
+        # Postgres' default constraint name, which the earlier migrations relied on
+        name = f'{table}_{column}_fkey'
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referenced, [column], ['Id'], ondelete='CASCADE' if ondelete else None)
+
+
+def upgrade():
+    _replace_foreign_keys(ondelete=True)
+
+
+def downgrade():
+    _replace_foreign_keys(ondelete=False)
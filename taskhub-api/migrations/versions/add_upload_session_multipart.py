@@ -0,0 +1,28 @@
+"""Add the multipart upload of chunked uploads on remote storage to upload_sessions
+
+Revision ID: add_upload_session_multipart
+Revises: add_change_feed
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_upload_session_multipart'
+down_revision = 'add_change_feed'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('upload_sessions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('MultipartUploadId', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('Parts', sa.Integer(), nullable=True, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('upload_sessions', schema=None) as batch_op:
+        batch_op.drop_column('Parts')
+        batch_op.drop_column('MultipartUploadId')
@@ -0,0 +1,41 @@
+"""Add upload_sessions table for resumable uploads
+
+Revision ID: add_upload_sessions
+Revises: move_image_data_to_blobs
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_upload_sessions'
+down_revision = 'move_image_data_to_blobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_sessions',
+    sa.Column('Id', sa.String(length=32), nullable=False),
+    sa.Column('Name', sa.String(), nullable=True),
+    sa.Column('Size', sa.BigInteger(), nullable=True),
+    sa.Column('Received', sa.BigInteger(), nullable=True),
+    sa.Column('Checksum', sa.String(length=64), nullable=True),
+    sa.Column('FolderId', sa.Integer(), nullable=True),
+    sa.Column('PageId', sa.Integer(), nullable=True),
+    sa.Column('WorkspaceId', sa.Integer(), nullable=True),
+    sa.Column('CreatedBy', sa.Integer(), nullable=True),
+    sa.Column('CreatedDateTime', sa.DateTime(), nullable=True),
+    sa.Column('LastModifyDateTime', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['CreatedBy'], ['users.Id'], ),
+    sa.ForeignKeyConstraint(['FolderId'], ['folders.Id'], ),
+    sa.ForeignKeyConstraint(['PageId'], ['pages.Id'], ),
+    sa.ForeignKeyConstraint(['WorkspaceId'], ['workspaces.Id'], ),
+    sa.PrimaryKeyConstraint('Id')
+    )
+
+
+def downgrade():
+    op.drop_table('upload_sessions')
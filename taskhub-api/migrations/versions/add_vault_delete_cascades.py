@@ -0,0 +1,48 @@
+"""Cascade vault deletes in the database
+
+Revision ID: add_vault_delete_cascades
+Revises: add_blobs_and_file_content_hash
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_vault_delete_cascades'
+down_revision = 'add_blobs_and_file_content_hash'
+branch_labels = None
+depends_on = None
+
+# (table, column, referenced table, ON DELETE action) for the references that
+# used to block deleting a vault until the application had cleared them
+CASCADES = [
+    ('folders', 'VaultId', 'vaults', 'CASCADE'),
+    ('collaborations', 'VaultId', 'vaults', 'CASCADE'),
+    ('collaborations', 'FolderId', 'folders', 'CASCADE'),
+    ('collaborations', 'WorkspaceId', 'workspaces', 'CASCADE'),
+    ('collaborations', 'FileId', 'files', 'CASCADE'),
+    ('favoritetasks', 'TaskId', 'tasks', 'CASCADE'),
+    ('pinnedtasks', 'TaskId', 'tasks', 'CASCADE'),
+    ('card_connections', 'FromCardId', 'cards', 'CASCADE'),
+    ('card_connections', 'ToCardId', 'cards', 'CASCADE'),
+    ('workspaces', 'CreatedFromTaskId', 'tasks', 'SET NULL'),
+    ('workspaces', 'CreatedFromCardId', 'cards', 'SET NULL'),
+]
+
+
+def _replace_foreign_keys(ondelete):
+    for table, column, referenced, action in CASCADES:
+        # Postgres' default constraint name, which the earlier migrations relied on
+        name = f'{table}_{column}_fkey'
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referenced, [column], ['Id'], ondelete=action if ondelete else None)
+
+
+def upgrade():
+    _replace_foreign_keys(ondelete=True)
+
+
+def downgrade():
+    _replace_foreign_keys(ondelete=False)
@@ -0,0 +1,161 @@
+"""Move image bytes out of the images table into the blob store
+
+Revision ID: move_image_data_to_blobs
+Revises: add_workspace_id_to_files
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import tempfile
+
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'move_image_data_to_blobs'
+down_revision = 'add_workspace_id_to_files'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 200
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+# The blob store as it was at this revision, frozen here so the migration does
+# not change with blobStore.py: blobs sit directly in BLOB_FOLDER under their
+# SHA-256 hex digest. `flask migrate-upload-layout` later moves them into the
+# fanned-out layout, or into the bucket of a remote storage backend.
+DEFAULT_BLOB_FOLDER = os.path.join('uploads', 'blobs')
+DEFAULT_BLOB_FANOUT = (2, 2)
+MIME_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+images = sa.table(
+    'images',
+    sa.column('Id', sa.Integer),
+    sa.column('Base64Data', sa.Text),
+    sa.column('ContentHash', sa.String),
+    sa.column('ContentSize', sa.Integer),
+    sa.column('MimeType', sa.String),
+)
+
+
+def blob_folder():
+    return current_app.config.get('BLOB_FOLDER', DEFAULT_BLOB_FOLDER)
+
+
+def guess_mime_type(data):
+    for signature, mimeType in MIME_SIGNATURES:
+        if data.startswith(signature):
+            return mimeType
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def put_blob(data):
+    """Write data under its content hash, through a temporary file, and return the hash"""
+    contentHash = hashlib.sha256(data).hexdigest()
+    path = os.path.join(blob_folder(), contentHash)
+    if not os.path.exists(path):
+        os.makedirs(blob_folder(), exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=blob_folder(), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            os.replace(tmpPath, path)
+        except BaseException:
+            os.unlink(tmpPath)
+            raise
+    return contentHash
+
+
+def read_blob(contentHash):
+    """Bytes of a local blob, in the flat layout or the default fanned-out one"""
+    fanned = [contentHash[:DEFAULT_BLOB_FANOUT[0]], contentHash[DEFAULT_BLOB_FANOUT[0]:sum(DEFAULT_BLOB_FANOUT)]]
+    for path in (os.path.join(blob_folder(), contentHash), os.path.join(blob_folder(), *fanned, contentHash)):
+        if os.path.isfile(path):
+            with open(path, 'rb') as blob:
+                return blob.read()
+    raise FileNotFoundError(f'Blob {contentHash} is not in {blob_folder()}')
+
+
+def upgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ContentHash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('ContentSize', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('MimeType', sa.String(), nullable=True))
+
+    # Copy the bytes out a batch at a time so a large table never has to fit in memory
+    connection = op.get_bind()
+    lastId = 0
+    while True:
+        rows = connection.execute(
+            sa.select(images.c.Id, images.c.Base64Data)
+            .where(images.c.Id > lastId, images.c.Base64Data.isnot(None))
+            .order_by(images.c.Id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            encoded = row.Base64Data
+            if encoded.startswith('data:') and ',' in encoded:
+                encoded = encoded.split(',', 1)[1]
+            try:
+                data = base64.b64decode(encoded, validate=True)
+            except (binascii.Error, ValueError):
+                # Keep the raw text rather than lose it when the column is dropped
+                logger.warning('Image %s: Base64Data is not valid base64, storing it as is', row.Id)
+                data = row.Base64Data.encode()
+            connection.execute(
+                images.update().where(images.c.Id == row.Id).values(
+                    ContentHash=put_blob(data),
+                    ContentSize=len(data),
+                    MimeType=guess_mime_type(data),
+                )
+            )
+        lastId = rows[-1].Id
+
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.drop_column('Base64Data')
+
+
+def downgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('Base64Data', sa.Text(), nullable=True))
+
+    connection = op.get_bind()
+    lastId = 0
+    while True:
+        rows = connection.execute(
+            sa.select(images.c.Id, images.c.ContentHash)
+            .where(images.c.Id > lastId, images.c.ContentHash.isnot(None))
+            .order_by(images.c.Id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            connection.execute(
+                images.update().where(images.c.Id == row.Id).values(
+                    Base64Data=base64.b64encode(read_blob(row.ContentHash)).decode()
+                )
+            )
+        lastId = rows[-1].Id
+
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.drop_column('MimeType')
+        batch_op.drop_column('ContentSize')
+        batch_op.drop_column('ContentHash')
@@ -1,9 +1,39 @@
 from database import db
-from sqlalchemy import Column, Integer, String, Date, DateTime, Text, ForeignKey, Boolean, Float
-from sqlalchemy.orm import relationship
+from nameCache import display_name
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, Text, ForeignKey, Boolean, Float, Index, select, func, text
+from sqlalchemy import inspect
+from sqlalchemy.orm import relationship, backref, column_property, mapped_column
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
+
+def fullname(firstName, lastName):
+    if firstName is None and lastName is None:
+        return ""
+    elif firstName is None:
+        return lastName
+    elif lastName is None:
+        return firstName
+    else:
+        return f"{firstName} {lastName}"
+
+def unless_deferred(obj, attr):
+    """Value of a column, or None when the query deferred it (e.g. dropped by ?fields=)"""
+    state = inspect(obj)
+    if attr in state.unloaded and attr not in state.expired_attributes:
+        return None
+    return getattr(obj, attr)
+
+def tombstone_indexes(table, *columns):
+    """Partial indexes of a table with DeletedAt tombstones (tombstones.py).
+
+    The lookup columns are indexed over the live rows only, which is all the
+    default queries read, and DeletedAt over the tombstones for the purge.
+    """
+    return tuple(Index(f'ix_{table}_{column}_live', column, postgresql_where=text('"DeletedAt" IS NULL'))
+                 for column in columns) + (
+        Index(f'ix_{table}_deleted', 'DeletedAt', postgresql_where=text('"DeletedAt" IS NOT NULL')),)
+
 class Vault(db.Model):
     __tablename__ = 'vaults'
     Id = Column(Integer, primary_key=True)
@@ -11,25 +41,24 @@ class Vault(db.Model):
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     LastModifyDateTime = Column(DateTime)
+    # Set when the vault is deleted, until it is purged; tombstones.py hides such rows from queries
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('vaults')
     
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy], back_populates='VaultsCreated', overlaps="VaultsCreated")
-    Collaborations = relationship('Collaboration', back_populates='Vault', cascade='all, delete-orphan', overlaps="Collaborations")
-    Folders = relationship('Folder', backref='Vault', cascade='all, delete-orphan', foreign_keys='Folder.VaultId')
+    # The database cascades vault deletes (ON DELETE CASCADE), so the ORM does not load the rows to delete them
+    Collaborations = relationship('Collaboration', back_populates='Vault', cascade='all, delete-orphan', passive_deletes=True, overlaps="Collaborations")
+    Folders = relationship('Folder', backref='Vault', cascade='all, delete-orphan', passive_deletes=True, foreign_keys='Folder.VaultId')
 
     def serialize(self):
-        if self.Collaborations:
-            distinct_user_ids = {c.UserId for c in self.Collaborations}
-            num_users = len(distinct_user_ids)
-        else:
-            num_users = 0
         return {
             'id': self.Id,
             'name': self.Name,
             'createdBy': self.CreatedBy,
-            'createdByName': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByName': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None,
-            'numOfUsers': num_users
+            'numOfUsers': self.NumOfUsers or 0
         }
 class Event(db.Model):
     __tablename__ = 'events'
@@ -49,7 +78,7 @@ class Event(db.Model):
             'id': self.Id,
             'title': self.Title,
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'dateTimeFrom': self.DateTimeFrom.isoformat() if self.DateTimeFrom else None,
             'dateTimeTo': self.DateTimeTo.isoformat() if self.DateTimeTo else None,
@@ -71,7 +100,7 @@ class UserEvents(db.Model):
             'id': self.Id,
             'eventId': self.EventId,
             'userId': self.UserId,
-            'user': self.User.getfullname() if self.User else ""
+            'user': display_name(self.UserId, lambda: self.User)
         }    
 class Task(db.Model):
     __tablename__ = 'tasks'
@@ -86,17 +115,19 @@ class Task(db.Model):
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     LastModifyDateTime = Column(DateTime)
-    ParentId = Column(Integer, ForeignKey('tasks.Id'), nullable=True)
-    PageId = Column(Integer, ForeignKey('pages.Id'))
+    ParentId = Column(Integer, ForeignKey('tasks.Id', ondelete='CASCADE'), nullable=True)
+    PageId = Column(Integer, ForeignKey('pages.Id', ondelete='CASCADE'))
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('tasks', 'PageId', 'ParentId')
    
 
 
     AssignedUser = relationship('User', foreign_keys=[AssignedTo], back_populates='TasksAssigned', overlaps="TasksAssigned")
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy], back_populates='TasksCreated', overlaps="TasksCreated")
     ParentTask = relationship('Task', remote_side=[Id], back_populates='ChildTasks')
-    ChildTasks = relationship('Task', back_populates='ParentTask', cascade='all, delete-orphan')
+    ChildTasks = relationship('Task', back_populates='ParentTask', cascade='all, delete-orphan', passive_deletes=True)
     Page = relationship('Page', back_populates='Tasks')
-    GeneratedWorkspace = relationship('Workspace', foreign_keys='Workspace.CreatedFromTaskId', backref='GeneratedFromTask', uselist=False)
+    GeneratedWorkspace = relationship('Workspace', foreign_keys='Workspace.CreatedFromTaskId', backref='GeneratedFromTask', uselist=False, passive_deletes=True)
 
     def serialize(self):
         return {
@@ -106,15 +137,15 @@ class Task(db.Model):
             'status': self.Status,
             'priority': self.Priority,
             'assignedTo': 0 if self.AssignedTo is None else self.AssignedTo,
-            'assignedToName': self.AssignedUser.getfullname() if self.AssignedUser else "",
+            'assignedToName': display_name(self.AssignedTo, lambda: self.AssignedUser),
             'createdBy': self.CreatedBy,
-            'createdByName': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByName': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None,
             'parentId': self.ParentId,
             'pageId': self.PageId,
             'pageName': self.Page.Name if self.Page else None,
-            'description': self.Description,
+            'description': unless_deferred(self, 'Description'),
             'industry': self.Industry
         }
 class Workspace(db.Model):
@@ -124,23 +155,25 @@ class Workspace(db.Model):
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     LastModifyDateTime = Column(DateTime)
-    FolderId = Column(Integer, ForeignKey('folders.Id'))
+    FolderId = Column(Integer, ForeignKey('folders.Id', ondelete='CASCADE'))
     CreatedFromTask = Column(Boolean, default=False)
-    CreatedFromTaskId = Column(Integer, ForeignKey('tasks.Id'), nullable=True)
-    CreatedFromCardId = Column(Integer, ForeignKey('cards.Id'), nullable=True)
+    CreatedFromTaskId = Column(Integer, ForeignKey('tasks.Id', ondelete='SET NULL'), nullable=True)
+    CreatedFromCardId = Column(Integer, ForeignKey('cards.Id', ondelete='SET NULL'), nullable=True)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('workspaces', 'FolderId')
 
     CreatedFromCardRef = relationship('Card', foreign_keys=[CreatedFromCardId])
     CreatedFromTaskRef = relationship('Task', foreign_keys=[CreatedFromTaskId])
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy], overlaps='CreatedByUser')
     Folder = relationship('Folder', back_populates='Workspaces')
-    Pages = relationship('Page', back_populates='Workspace', cascade='all, delete-orphan')
+    Pages = relationship('Page', back_populates='Workspace', cascade='all, delete-orphan', passive_deletes=True)
 
     def serialize(self):
         return {
             'id': self.Id,
             'name': self.Name,
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None,
             'folderId': self.FolderId,
@@ -156,22 +189,25 @@ class Folder(db.Model):
     Name = Column(String)
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
-    ParentId = Column(Integer, ForeignKey('folders.Id'), nullable=True)
-    VaultId = Column(Integer, ForeignKey('vaults.Id'), nullable=True)
+    ParentId = Column(Integer, ForeignKey('folders.Id', ondelete='CASCADE'), nullable=True)
+    VaultId = Column(Integer, ForeignKey('vaults.Id', ondelete='CASCADE'), nullable=True)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('folders', 'VaultId', 'ParentId')
 
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy])
-    Files = relationship('File', back_populates='Folder', cascade='all, delete-orphan')  
+    # The database cascades deletes down the tree (ON DELETE CASCADE); treeDeletes.py keeps the blob counts right
+    Files = relationship('File', back_populates='Folder', cascade='all, delete-orphan', passive_deletes=True)
     ParentFolder = relationship('Folder', remote_side=[Id], back_populates='ChildFolders')
-    ChildFolders = relationship('Folder', back_populates='ParentFolder', cascade='all, delete-orphan') 
-    Workspaces = relationship('Workspace', back_populates='Folder', cascade='all, delete-orphan')  
-    Urls = relationship('Url', back_populates='Folder', cascade='all, delete-orphan')
+    ChildFolders = relationship('Folder', back_populates='ParentFolder', cascade='all, delete-orphan', passive_deletes=True)
+    Workspaces = relationship('Workspace', back_populates='Folder', cascade='all, delete-orphan', passive_deletes=True)
+    Urls = relationship('Url', back_populates='Folder', cascade='all, delete-orphan', passive_deletes=True)
 
     def serialize(self):
         return {
             'id': self.Id,
             'name': self.Name,
             'createdBy': self.CreatedBy,
-            'createdByUser' : self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser' : display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'parentId' : 0 if self.ParentId is None else self.ParentId,
             'parentName' : None if self.ParentFolder is None else self.ParentFolder.Name,
@@ -184,8 +220,10 @@ class TextBox(db.Model):
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     LastModifyDateTime = Column(DateTime)
-    PageId = Column(Integer, ForeignKey('pages.Id'))
+    PageId = Column(Integer, ForeignKey('pages.Id', ondelete='CASCADE'))
     OrderIndex = Column(Integer)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('textbox', 'PageId')
 
     Page = relationship('Page', back_populates='TextBoxes')
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy], back_populates='TextBoxesCreated', overlaps="TextBoxesCreated")
@@ -193,11 +231,11 @@ class TextBox(db.Model):
     def serialize(self):
         return {
             'id': self.Id,
-            'text': self.Text,
+            'text': unless_deferred(self, 'Text'),
             'pageId': self.PageId,
             'pageName': self.Page.Name if self.Page else None,
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None,
             'orderIndex' : self.OrderIndex
@@ -207,12 +245,17 @@ class File(db.Model):
     Id = Column(Integer, primary_key=True)
     Name = Column(String)
     Path = Column(String)
-    FolderId = Column(Integer, ForeignKey('folders.Id'), nullable=True)
-    PageId = Column(Integer, ForeignKey('pages.Id'), nullable=True)
-    WorkspaceId = Column(Integer, ForeignKey('workspaces.Id'), nullable=True)
+    FolderId = Column(Integer, ForeignKey('folders.Id', ondelete='CASCADE'), nullable=True)
+    PageId = Column(Integer, ForeignKey('pages.Id', ondelete='CASCADE'), nullable=True)
+    WorkspaceId = Column(Integer, ForeignKey('workspaces.Id', ondelete='CASCADE'), nullable=True)
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     Iso365File = Column(Boolean)
+    # active_history keeps the replaced hash around for the blob reference counts
+    ContentHash = mapped_column(String(64), nullable=True, index=True, active_history=True)
+    Size = Column(BigInteger, nullable=True)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('files', 'FolderId', 'WorkspaceId', 'PageId')
     Folder = relationship('Folder', back_populates='Files')
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy], back_populates='FilesCreated', overlaps="FilesCreated")
 
@@ -225,12 +268,128 @@ class File(db.Model):
             'pageId': self.PageId,
             'workspaceId': self.WorkspaceId,
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
-            'iso365File': self.Iso365File
+            'iso365File': self.Iso365File,
+            'contentHash': self.ContentHash,
+            'size': self.Size
         }
 
 
+class Blob(db.Model):
+    __tablename__ = 'blobs'
+    ContentHash = Column(String(64), primary_key=True)
+    Size = Column(BigInteger)
+    # Number of File and Image rows pointing at this blob, kept by blobStore's flush hooks
+    RefCount = Column(Integer, default=0)
+    CreatedDateTime = Column(DateTime)
+    LastModifyDateTime = Column(DateTime)
+
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    Id = Column(String(32), primary_key=True)
+    Name = Column(String)
+    Size = Column(BigInteger)
+    Received = Column(BigInteger, default=0)
+    Checksum = Column(String(64), nullable=True)
+    FolderId = Column(Integer, ForeignKey('folders.Id', ondelete='CASCADE'), nullable=True)
+    PageId = Column(Integer, ForeignKey('pages.Id', ondelete='CASCADE'), nullable=True)
+    WorkspaceId = Column(Integer, ForeignKey('workspaces.Id', ondelete='CASCADE'), nullable=True)
+    CreatedBy = Column(Integer, ForeignKey('users.Id'))
+    CreatedDateTime = Column(DateTime)
+    LastModifyDateTime = Column(DateTime)
+    # Chunked uploads to a remote storage backend: the multipart upload the chunks are parts of, and how many there are
+    MultipartUploadId = Column(String, nullable=True)
+    Parts = Column(Integer, default=0)
+
+    def serialize(self):
+        return {
+            'id': self.Id,
+            'name': self.Name,
+            'size': self.Size,
+            'offset': self.Received,
+            'checksum': self.Checksum,
+            'folderId': self.FolderId,
+            'pageId': self.PageId,
+            'workspaceId': self.WorkspaceId,
+            'createdBy': self.CreatedBy,
+            'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
+            'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None
+        }
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    Id = Column(Integer, primary_key=True)
+    Kind = Column(String)
+    # JSON arguments of the handler (jobs.py)
+    Payload = Column(Text)
+    Status = Column(String, default='queued')
+    # Higher runs first
+    Priority = Column(Integer, default=0)
+    Attempts = Column(Integer, default=0)
+    MaxAttempts = Column(Integer, default=3)
+    # Not before this time, e.g. the backoff after a failed attempt
+    RunAfter = Column(DateTime, nullable=True)
+    # The worker running the job; it heartbeats LastModifyDateTime while it does
+    LockedBy = Column(String, nullable=True)
+    Progress = Column(Integer, default=0)
+    Total = Column(Integer, nullable=True)
+    Error = Column(Text, nullable=True)
+    CreatedBy = Column(Integer, ForeignKey('users.Id'), nullable=True)
+    CreatedDateTime = Column(DateTime)
+    StartedDateTime = Column(DateTime, nullable=True)
+    FinishedDateTime = Column(DateTime, nullable=True)
+    LastModifyDateTime = Column(DateTime)
+
+    __table_args__ = (
+        # Workers only ever look for queued jobs, in this order
+        Index('ix_jobs_queued', Priority.desc(), 'Id', postgresql_where=text('"Status" = \'queued\'')),
+    )
+
+    def serialize(self):
+        return {
+            'id': self.Id,
+            'kind': self.Kind,
+            'status': self.Status,
+            'priority': self.Priority,
+            'attempts': self.Attempts,
+            'maxAttempts': self.MaxAttempts,
+            'runAfter': self.RunAfter.isoformat() if self.RunAfter else None,
+            'progress': self.Progress,
+            'total': self.Total,
+            'error': self.Error,
+            'createdBy': self.CreatedBy,
+            'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
+            'startedDateTime': self.StartedDateTime.isoformat() if self.StartedDateTime else None,
+            'finishedDateTime': self.FinishedDateTime.isoformat() if self.FinishedDateTime else None
+        }
+
+
+class Change(db.Model):
+    __tablename__ = 'changes'
+    # SQLite only autoincrements INTEGER keys
+    Id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    # The change sequence behind /Sync/changes cursors, numbered in commit order (changeFeed.py); None until committed
+    Seq = Column(BigInteger, nullable=True)
+    # Model name and id of the row that was created, updated or deleted
+    Entity = Column(String, nullable=False)
+    EntityId = Column(Integer, nullable=False)
+    # The vault the row was in, to filter the feed by user; no foreign key, the change outlives the vault
+    VaultId = Column(Integer, nullable=True)
+    # The company of the row's creator, which scopes the changes of rows outside any vault
+    CompanyId = Column(Integer, nullable=True)
+    ChangedDateTime = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_changes_Seq', 'Seq', unique=True),
+        Index('ix_changes_VaultId_Seq', 'VaultId', 'Seq'),
+        Index('ix_changes_CompanyId_Seq', 'CompanyId', 'Seq'),
+        Index('ix_changes_ChangedDateTime', 'ChangedDateTime'),
+    )
+
+
 class Url(db.Model):
     __tablename__ = 'urls'
     Id = Column(Integer, primary_key=True)
@@ -238,7 +397,9 @@ class Url(db.Model):
     Url = Column(String)
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
-    FolderId = Column(Integer, ForeignKey('folders.Id'), nullable=False)
+    FolderId = Column(Integer, ForeignKey('folders.Id', ondelete='CASCADE'), nullable=False)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('urls', 'FolderId')
 
     Folder   = relationship('Folder', back_populates='Urls')
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy])
@@ -250,22 +411,22 @@ class Url(db.Model):
             'url': self.Url,
             'folderId': self.FolderId,
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None
         }    
 class Collaboration(db.Model):
     __tablename__ = 'collaborations'
     Id = Column(Integer, primary_key=True)
-    VaultId = Column(Integer, ForeignKey('vaults.Id'), nullable=True)
+    VaultId = Column(Integer, ForeignKey('vaults.Id', ondelete='CASCADE'), nullable=True)
     UserId = Column(Integer, ForeignKey('users.Id'))
-    FolderId = Column(Integer, ForeignKey('folders.Id'), nullable=True)
-    WorkspaceId = Column(Integer, ForeignKey('workspaces.Id'), nullable=True)
-    FileId = Column(Integer, ForeignKey('files.Id'), nullable=True)
+    FolderId = Column(Integer, ForeignKey('folders.Id', ondelete='CASCADE'), nullable=True)
+    WorkspaceId = Column(Integer, ForeignKey('workspaces.Id', ondelete='CASCADE'), nullable=True)
+    FileId = Column(Integer, ForeignKey('files.Id', ondelete='CASCADE'), nullable=True)
     PermissionType = Column(String, nullable=True)
 
-    Folder = relationship('Folder', backref='Collaborations', foreign_keys=[FolderId])
-    Workspace = relationship('Workspace', backref='Collaborations', foreign_keys=[WorkspaceId])
-    File = relationship('File', backref='Collaborations', foreign_keys=[FileId])
+    Folder = relationship('Folder', backref=backref('Collaborations', passive_deletes=True), foreign_keys=[FolderId])
+    Workspace = relationship('Workspace', backref=backref('Collaborations', passive_deletes=True), foreign_keys=[WorkspaceId])
+    File = relationship('File', backref=backref('Collaborations', passive_deletes=True), foreign_keys=[FileId])
     Vault = relationship('Vault', back_populates='Collaborations')
     User = relationship('User', foreign_keys=[UserId], back_populates='Collaborations', overlaps="Collaborations")
 
@@ -278,12 +439,21 @@ class Collaboration(db.Model):
             'workspaceId': self.WorkspaceId,
             'fileId': self.FileId,
             'permissionType':self.PermissionType,
-            'userFullName': self.User.getfullname() if self.User else ""
+            'userFullName': display_name(self.UserId, lambda: self.User)
         }
+
+# Distinct collaborators per vault, computed in the same SELECT that loads the
+# vault instead of loading the whole Collaborations collection.
+Vault.NumOfUsers = column_property(
+    select(func.count(func.distinct(Collaboration.UserId)))
+    .where(Collaboration.VaultId == Vault.Id)
+    .correlate_except(Collaboration)
+    .scalar_subquery()
+)
 class FavoriteTasks(db.Model):
     __tablename__ = 'favoritetasks'
     Id = Column(Integer, primary_key=True)
-    TaskId = Column(Integer, ForeignKey('tasks.Id'), nullable=True)
+    TaskId = Column(Integer, ForeignKey('tasks.Id', ondelete='CASCADE'), nullable=True)
     UserId = Column(Integer, ForeignKey('users.Id'))
 
     Task = relationship('Task', foreign_keys=[TaskId])
@@ -294,12 +464,12 @@ class FavoriteTasks(db.Model):
             'id': self.Id,
             'taskId': self.TaskId,
             'userId': self.UserId,
-            'user': self.User.getfullname() if self.User else ""
+            'user': display_name(self.UserId, lambda: self.User)
         }
 class PinnedTasks(db.Model):
     __tablename__ = 'pinnedtasks'
     Id = Column(Integer, primary_key=True)
-    TaskId = Column(Integer, ForeignKey('tasks.Id'), nullable=True)
+    TaskId = Column(Integer, ForeignKey('tasks.Id', ondelete='CASCADE'), nullable=True)
     UserId = Column(Integer, ForeignKey('users.Id'))
 
     Task = relationship('Task', foreign_keys=[TaskId])
@@ -310,7 +480,7 @@ class PinnedTasks(db.Model):
             'id': self.Id,
             'taskId': self.TaskId,
             'userId': self.UserId,
-            'user': self.User.getfullname() if self.User else ""
+            'user': display_name(self.UserId, lambda: self.User)
         }
 class User(db.Model):
     __tablename__ = 'users'
@@ -354,14 +524,7 @@ class User(db.Model):
             'externalUsername' : self.ExternalUsername
         }
     def getfullname(self):
-        if self.FirstName is None and self.LastName is None:
-            return ""
-        elif self.FirstName is None:
-            return self.LastName
-        elif self.LastName is None:
-            return self.FirstName
-        else:
-            return f"{self.FirstName} {self.LastName}"
+        return fullname(self.FirstName, self.LastName)
 class Company(db.Model):
     __tablename__ = 'companies'
     Id = Column(Integer, primary_key=True)
@@ -384,18 +547,20 @@ class Page(db.Model):
     __tablename__ = 'pages'
     Id = Column(Integer, primary_key=True)
     Name = Column(String)
-    WorkspaceId = Column(Integer, ForeignKey('workspaces.Id'))
+    WorkspaceId = Column(Integer, ForeignKey('workspaces.Id', ondelete='CASCADE'))
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     LastModifyDateTime = Column(DateTime)
     OrderIndex = Column(Integer)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('pages', 'WorkspaceId')
 
     Workspace = relationship('Workspace', back_populates='Pages')
     CreatedByUser = relationship('User')
-    Tasks = relationship('Task', back_populates='Page', cascade='all, delete-orphan')
-    TextBoxes = relationship('TextBox', back_populates='Page', cascade='all, delete-orphan')
-    Cards = relationship('Card', back_populates='Page', cascade='all, delete-orphan')
-    Images = relationship('Image', back_populates='Page', cascade='all, delete-orphan')
+    Tasks = relationship('Task', back_populates='Page', cascade='all, delete-orphan', passive_deletes=True)
+    TextBoxes = relationship('TextBox', back_populates='Page', cascade='all, delete-orphan', passive_deletes=True)
+    Cards = relationship('Card', back_populates='Page', cascade='all, delete-orphan', passive_deletes=True)
+    Images = relationship('Image', back_populates='Page', cascade='all, delete-orphan', passive_deletes=True)
 
     def serialize(self):
         return {
@@ -403,7 +568,7 @@ class Page(db.Model):
             'name': self.Name,
             'workspaceId': self.WorkspaceId,
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None,
             'vaultId': self.Workspace.Folder.VaultId if self.Workspace and self.Workspace.Folder else None,
@@ -423,27 +588,29 @@ class Card(db.Model):
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     LastModifyDateTime = Column(DateTime)
-    PageId = Column(Integer, ForeignKey('pages.Id'))
+    PageId = Column(Integer, ForeignKey('pages.Id', ondelete='CASCADE'))
     X = Column(Float, nullable=True, default=0.0)
     Y = Column(Float, nullable=True, default=0.0)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('cards', 'PageId')
     Page = relationship('Page', back_populates='Cards')
     AssignedUser = relationship('User', foreign_keys=[AssignedTo])
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy])
-    GeneratedWorkspace = relationship('Workspace', foreign_keys='Workspace.CreatedFromCardId', backref='GeneratedFromCard', uselist=False)
+    GeneratedWorkspace = relationship('Workspace', foreign_keys='Workspace.CreatedFromCardId', backref='GeneratedFromCard', uselist=False, passive_deletes=True)
 
     def serialize(self):
         return {
             'id': self.Id,
             'name': self.Name,
-            'description': self.Description,
+            'description': unless_deferred(self, 'Description'),
             'status': self.Status,
             'priority': self.Priority,
             'category': self.Category,
             'dueDate': self.DueDate.isoformat() if self.DueDate else None,
             'assignedTo': self.AssignedTo,
-            'assignedToName': self.AssignedUser.getfullname() if self.AssignedUser else "",
+            'assignedToName': display_name(self.AssignedTo, lambda: self.AssignedUser),
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None,
             'pageId': self.PageId,
@@ -454,11 +621,11 @@ class Card(db.Model):
 class CardConnection(db.Model):
     __tablename__ = 'card_connections'
     Id = Column(Integer, primary_key=True)
-    FromCardId = Column(Integer, ForeignKey('cards.Id'), nullable=False)
-    ToCardId = Column(Integer, ForeignKey('cards.Id'), nullable=False)
+    FromCardId = Column(Integer, ForeignKey('cards.Id', ondelete='CASCADE'), nullable=False)
+    ToCardId = Column(Integer, ForeignKey('cards.Id', ondelete='CASCADE'), nullable=False)
 
-    FromCard = relationship('Card', foreign_keys=[FromCardId], backref='ConnectionsFrom')
-    ToCard = relationship('Card', foreign_keys=[ToCardId], backref='ConnectionsTo')
+    FromCard = relationship('Card', foreign_keys=[FromCardId], backref=backref('ConnectionsFrom', passive_deletes=True))
+    ToCard = relationship('Card', foreign_keys=[ToCardId], backref=backref('ConnectionsTo', passive_deletes=True))
 
     def serialize(self):
         return {
@@ -471,25 +638,39 @@ class Image(db.Model):
     __tablename__ = 'images'
     Id = Column(Integer, primary_key=True)
     Name = Column(String)
-    Base64Data = Column(Text)
-    PageId = Column(Integer, ForeignKey('pages.Id'))
+    ContentHash = mapped_column(String(64), active_history=True)
+    ContentSize = Column(Integer)
+    MimeType = Column(String)
+    PageId = Column(Integer, ForeignKey('pages.Id', ondelete='CASCADE'))
     CreatedBy = Column(Integer, ForeignKey('users.Id'))
     CreatedDateTime = Column(DateTime)
     LastModifyDateTime = Column(DateTime)
     OrderIndex = Column(Integer)
+    DeletedAt = Column(DateTime, nullable=True)
+    __table_args__ = tombstone_indexes('images', 'PageId')
 
     Page = relationship('Page', foreign_keys=[PageId])
     CreatedByUser = relationship('User', foreign_keys=[CreatedBy])
 
-    def serialize(self):
+    def content_url(self, variant=None):
+        if not self.ContentHash:
+            return None
+        url = f'/Image/{self.Id}/content'
+        return f'{url}?variant={variant}' if variant else url
+
+    def serialize(self, variant=None):
         return {
             'id': self.Id,
             'name': self.Name,
-            'base64': self.Base64Data,
+            'contentHash': self.ContentHash,
+            'size': self.ContentSize,
+            'mimeType': self.MimeType,
+            'url': self.content_url(variant),
+            'originalUrl': self.content_url(),
             'pageId': self.PageId,
             'pageName': self.Page.Name if self.Page else None,
             'createdBy': self.CreatedBy,
-            'createdByUser': self.CreatedByUser.getfullname() if self.CreatedByUser else "",
+            'createdByUser': display_name(self.CreatedBy, lambda: self.CreatedByUser),
             'createdDateTime': self.CreatedDateTime.isoformat() if self.CreatedDateTime else None,
             'lastModifyDateTime': self.LastModifyDateTime.isoformat() if self.LastModifyDateTime else None,
             'orderIndex' : self.OrderIndex
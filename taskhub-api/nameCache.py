@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from itertools import chain
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+DISPLAY_NAME_CACHE_SIZE = 10000
+
+
+class DisplayNameCache:
+    """Bounded, thread-safe LRU cache mapping user id to display name"""
+
+    def __init__(self, maxSize=DISPLAY_NAME_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, userId, loadUser):
+        """Return the display name of userId, calling loadUser() to fetch the User on a miss"""
+        if userId is None:
+            return ""
+        with self._lock:
+            if userId in self._names:
+                self._names.move_to_end(userId)
+                self.hits += 1
+                return self._names[userId]
+            self.misses += 1
+        user = loadUser()
+        if user is None:
+            return ""
+        name = user.getfullname()
+        with self._lock:
+            self._names[userId] = name
+            self._names.move_to_end(userId)
+            while len(self._names) > self.maxSize:
+                self._names.popitem(last=False)
+        return name
+
+    def invalidate(self, userId):
+        with self._lock:
+            self._names.pop(userId, None)
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._names),
+                'maxSize': self.maxSize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+displayNames = DisplayNameCache()
+
+
+def display_name(userId, loadUser):
+    """Display name used by the serializers; loadUser is only called on a cache miss"""
+    return displayNames.get(userId, loadUser)
+
+
+# Invalidate on commit for any User row that was updated or deleted through the
+# ORM. Ids are collected at flush time and only dropped once the transaction
+# commits; a rollback leaves the cached names untouched.
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flushContext):
+    from models import User
+    changed = {obj.Id for obj in chain(session.dirty, session.deleted) if isinstance(obj, User)}
+    if changed:
+        session.info.setdefault('changedUserIds', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for userId in session.info.pop('changedUserIds', ()):
+        displayNames.invalidate(userId)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop('changedUserIds', None)
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from flask import request
+from flask_restx import abort
+from flask_restx.reqparse import RequestParser
+from sqlalchemy import tuple_
+
+# Keyset pagination for list endpoints. A request with ?limit=N gets at most N
+# rows ordered by the endpoint's key columns and, if more rows follow, an
+# opaque cursor in the X-Next-Cursor response header to pass back as
+# ?cursor=. Requests without ?limit= keep the legacy unpaginated behaviour
+# until the desktop client migrates, in the same key order.
+
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+pageParams = RequestParser()
+pageParams.add_argument('limit', type=int, required=False, help=f'Page size (at most {MAX_PAGE_SIZE}); omit for the full list')
+pageParams.add_argument('cursor', type=str, required=False, help=f'The {NEXT_CURSOR_HEADER} value of the previous page')
+
+
+def add_page_arguments(parser):
+    """Add the limit/cursor arguments to an endpoint's filter parser"""
+    for arg in pageParams.args:
+        parser.add_argument(arg)
+    return parser
+
+
+def _encode_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _decode_value(column, value):
+    """A cursor value as the column's Python type; ValueError when it is not one"""
+    if value is None:
+        return value
+    pythonType = column.type.python_type
+    if pythonType in (date, datetime):
+        if not isinstance(value, str):
+            raise ValueError(f'{column.key} must be an ISO date')
+        return pythonType.fromisoformat(value)
+    # JSON has no separate booleans for integer keys to tell apart
+    if not isinstance(value, pythonType) or (isinstance(value, bool) and pythonType is not bool):
+        raise ValueError(f'{column.key} must be {pythonType.__name__}')
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, keyColumns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(keyColumns):
+            raise ValueError('cursor does not match the endpoint keys')
+        return [_decode_value(column, value) for column, value in zip(keyColumns, values)]
+    except (binascii.Error, ValueError, TypeError):
+        abort(400, 'Invalid cursor')
+
+
+def paginate(query, *keyColumns, execute=None):
+    """Return (rows, headers) for query ordered by keyColumns, paginated on them when ?limit= is given.
+
+    keyColumns must be unique together (end with the primary key). query can be
+    an ORM Query or a select() statement; execute runs it and defaults to .all().
+    """
+    execute = execute or (lambda q: q.all())
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        return execute(query.order_by(*keyColumns)), {}
+    if limit < 1:
+        abort(400, 'limit must be positive')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        values = decode_cursor(cursor, keyColumns)
+        if len(keyColumns) == 1:
+            query = query.filter(keyColumns[0] > values[0])
+        else:
+            query = query.filter(tuple_(*keyColumns) > tuple_(*values))
+
+    # One extra row tells whether another page follows
+    rows = execute(query.order_by(*keyColumns).limit(limit + 1))
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(rows[-1], column.key) for column in keyColumns])
+    return rows, headers
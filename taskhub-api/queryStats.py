@@ -0,0 +1,67 @@
+import time
+from functools import wraps
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request SQL instrumentation. Every statement executed while handling a
+# request is counted and timed; the totals are reported in the X-Query-Count
+# and X-DB-Time-Ms response headers, and resources can declare a query budget
+# with @query_budget(n) so N+1 regressions show up immediately.
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def _tracking():
+    return has_app_context() and 'queryCount' in g
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _tracking():
+        g.queryCount += 1
+        conn.info.setdefault('queryStartTimes', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    startTimes = conn.info.get('queryStartTimes')
+    if _tracking() and startTimes:
+        g.dbTime += time.perf_counter() - startTimes.pop()
+
+
+def init_app(app):
+    @app.before_request
+    def start_query_stats():
+        g.queryCount = 0
+        g.dbTime = 0.0
+
+    @app.after_request
+    def report_query_stats(response):
+        if 'queryCount' in g:
+            response.headers['X-Query-Count'] = str(g.queryCount)
+            response.headers['X-DB-Time-Ms'] = f'{g.dbTime * 1000:.2f}'
+        return response
+
+
+def query_budget(limit):
+    """Declare the maximum number of statements a resource method may issue.
+
+    Exceeding the budget fails the request when the app runs with TESTING and
+    logs a warning otherwise. Apply it as the innermost decorator.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            result = fn(*args, **kwargs)
+            used = g.get('queryCount', 0)
+            if used > limit:
+                message = f'{request.method} {request.path} issued {used} queries, budget is {limit}'
+                if current_app.config.get('TESTING'):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return result
+        return wrapper
+    return decorator
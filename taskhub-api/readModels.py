@@ -0,0 +1,136 @@
+from flask import current_app, request
+from database import db
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
+from models import Task, Card, File, Page, User, Workspace, fullname
+
+# Column-projection read path. Instead of hydrating ORM instances (and their
+# identity-map entries) for rows that are serialized once and thrown away,
+# these statements select only the columns a response needs, join in the
+# resolved names and build the dicts straight from the result tuples. Every
+# serialize_*_row() returns exactly what the model's serialize() would.
+
+
+def use_projection(endpoint):
+    """Whether the given endpoint should read through the projection path.
+
+    `?readPath=orm|projection` overrides the per-endpoint default configured
+    in PROJECTION_READ_ENDPOINTS, so both paths can be benchmarked side by side.
+    """
+    readPath = request.args.get('readPath')
+    if readPath:
+        return readPath == 'projection'
+    return endpoint in current_app.config.get('PROJECTION_READ_ENDPOINTS', ())
+
+
+def fetch_rows(statement):
+    return db.session.execute(statement).all()
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def select_tasks_by_company(companyId):
+    creator = aliased(User)
+    assignee = aliased(User)
+    return select(
+        Task.Id, Task.Title, Task.DueDate, Task.Status, Task.Priority,
+        Task.AssignedTo, assignee.FirstName.label('AssignedFirstName'), assignee.LastName.label('AssignedLastName'),
+        Task.CreatedBy, creator.FirstName.label('CreatedFirstName'), creator.LastName.label('CreatedLastName'),
+        Task.CreatedDateTime, Task.LastModifyDateTime, Task.ParentId, Task.PageId,
+        Page.Name.label('PageName'), Task.Description, Task.Industry
+    ).join(creator, Task.CreatedBy == creator.Id) \
+     .outerjoin(assignee, Task.AssignedTo == assignee.Id) \
+     .outerjoin(Page, Task.PageId == Page.Id) \
+     .where(creator.CompanyId == companyId)
+
+
+def serialize_task_row(row):
+    return {
+        'id': row.Id,
+        'title': row.Title,
+        'dueDate': _isoformat(row.DueDate),
+        'status': row.Status,
+        'priority': row.Priority,
+        'assignedTo': 0 if row.AssignedTo is None else row.AssignedTo,
+        'assignedToName': fullname(row.AssignedFirstName, row.AssignedLastName),
+        'createdBy': row.CreatedBy,
+        'createdByName': fullname(row.CreatedFirstName, row.CreatedLastName),
+        'createdDateTime': _isoformat(row.CreatedDateTime),
+        'lastModifyDateTime': _isoformat(row.LastModifyDateTime),
+        'parentId': row.ParentId,
+        'pageId': row.PageId,
+        'pageName': row.PageName,
+        'description': row.Description,
+        'industry': row.Industry
+    }
+
+
+def select_cards_by_company(companyId):
+    creator = aliased(User)
+    assignee = aliased(User)
+    # A scalar subquery rather than a join so a card that generated several
+    # workspaces still yields a single row.
+    generatedWorkspaceId = select(func.min(Workspace.Id)) \
+        .where(Workspace.CreatedFromCardId == Card.Id) \
+        .correlate(Card) \
+        .scalar_subquery()
+    return select(
+        Card.Id, Card.Name, Card.Description, Card.Status, Card.Priority, Card.Category, Card.DueDate,
+        Card.AssignedTo, assignee.FirstName.label('AssignedFirstName'), assignee.LastName.label('AssignedLastName'),
+        Card.CreatedBy, creator.FirstName.label('CreatedFirstName'), creator.LastName.label('CreatedLastName'),
+        Card.CreatedDateTime, Card.LastModifyDateTime, Card.PageId,
+        generatedWorkspaceId.label('GeneratedWorkspaceId'), Card.X, Card.Y
+    ).join(creator, Card.CreatedBy == creator.Id) \
+     .outerjoin(assignee, Card.AssignedTo == assignee.Id) \
+     .where(creator.CompanyId == companyId)
+
+
+def serialize_card_row(row):
+    return {
+        'id': row.Id,
+        'name': row.Name,
+        'description': row.Description,
+        'status': row.Status,
+        'priority': row.Priority,
+        'category': row.Category,
+        'dueDate': _isoformat(row.DueDate),
+        'assignedTo': row.AssignedTo,
+        'assignedToName': fullname(row.AssignedFirstName, row.AssignedLastName),
+        'createdBy': row.CreatedBy,
+        'createdByUser': fullname(row.CreatedFirstName, row.CreatedLastName),
+        'createdDateTime': _isoformat(row.CreatedDateTime),
+        'lastModifyDateTime': _isoformat(row.LastModifyDateTime),
+        'pageId': row.PageId,
+        'workspaceId': row.GeneratedWorkspaceId if row.GeneratedWorkspaceId else 0,
+        'x': row.X,
+        'y': row.Y
+    }
+
+
+def select_files_by_company(companyId):
+    creator = aliased(User)
+    return select(
+        File.Id, File.Name, File.Path, File.FolderId, File.PageId, File.WorkspaceId,
+        File.CreatedBy, creator.FirstName.label('CreatedFirstName'), creator.LastName.label('CreatedLastName'),
+        File.CreatedDateTime, File.Iso365File, File.ContentHash, File.Size
+    ).join(creator, File.CreatedBy == creator.Id) \
+     .where(creator.CompanyId == companyId)
+
+
+def serialize_file_row(row):
+    return {
+        'id': row.Id,
+        'name': row.Name,
+        'path': row.Path,
+        'folderId': row.FolderId,
+        'pageId': row.PageId,
+        'workspaceId': row.WorkspaceId,
+        'createdBy': row.CreatedBy,
+        'createdByUser': fullname(row.CreatedFirstName, row.CreatedLastName),
+        'createdDateTime': _isoformat(row.CreatedDateTime),
+        'iso365File': row.Iso365File,
+        'contentHash': row.ContentHash,
+        'size': row.Size
+    }
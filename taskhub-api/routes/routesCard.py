@@ -2,7 +2,13 @@ from datetime import datetime
 from flask import request
 from flask_restx import Resource, fields
 from app import app, db, api, cardNameSpace
-from models import Card, User, CardConnection, Workspace
+from models import Card, User, CardConnection
+from loaders import serialize_loaders
+from fieldsets import requested_fields, FIELDS_HELP
+from queryStats import query_budget
+from pagination import paginate, pageParams, add_page_arguments
+from readModels import use_projection, fetch_rows, select_cards_by_company, serialize_card_row
+from tombstones import tombstone
 
 # Swagger model
 CardConnectionModel = cardNameSpace.model('CardConnection', {
@@ -38,7 +44,7 @@ CardModel = cardNameSpace.model('Card', {
 })
 
 # Query params
-cardFilterParams = cardNameSpace.parser()
+cardFilterParams = add_page_arguments(cardNameSpace.parser())
 cardFilterParams.add_argument('pageId', type=int, required=False, help='Filter by page ID')
 cardFilterParams.add_argument('assignedTo', type=int, required=False, help='Filter by assigned user ID')
 cardFilterParams.add_argument('createdBy', type=int, required=False, help='Filter by creator ID')
@@ -48,7 +54,9 @@ cardFilterParams.add_argument('status', type=str, required=False, help='Filter b
 class CardList(Resource):
     @cardNameSpace.doc('ListCards')
     @cardNameSpace.expect(cardFilterParams)
+    @cardNameSpace.param('fields', FIELDS_HELP)
     @cardNameSpace.marshal_list_with(CardModel)
+    @query_budget(2)
     def get(self):
         """List all cards with optional filters"""
         pageId = request.args.get('pageId')
@@ -56,7 +64,7 @@ class CardList(Resource):
         createdBy = request.args.get('createdBy')
         status = request.args.get('status')
 
-        query = Card.query
+        query = Card.query.options(*serialize_loaders(Card, requested_fields()))
         if pageId:
             query = query.filter_by(PageId=pageId)
         if assignedTo:
@@ -66,7 +74,8 @@ class CardList(Resource):
         if status:
             query = query.filter_by(Status=status)
 
-        return [card.serialize() for card in query.all()]
+        cards, headers = paginate(query, Card.Id)
+        return [card.serialize() for card in cards], 200, headers
 
     @cardNameSpace.doc('CreateCard')
     @cardNameSpace.expect(CardModel)
@@ -100,10 +109,11 @@ class CardList(Resource):
 @cardNameSpace.param('id', 'Card identifier')
 class CardResource(Resource):
     @cardNameSpace.doc('GetCard')
+    @cardNameSpace.param('fields', FIELDS_HELP)
     @cardNameSpace.marshal_with(CardModel)
     def get(self, id):
         """Get card by ID"""
-        card = Card.query.get_or_404(id)
+        card = Card.query.options(*serialize_loaders(Card, requested_fields())).get_or_404(id)
         return card.serialize()
 
     @cardNameSpace.doc('UpdateCard')
@@ -131,45 +141,34 @@ class CardResource(Resource):
     @cardNameSpace.response(204, 'Card deleted')
     def delete(self, id):
         """Delete a card"""
-        try:
-            card = Card.query.get_or_404(id)
-            
-            # Handle related data before deleting the card
-            # 1. Set CreatedFromCardId to NULL for any workspaces that reference this card
-            related_workspaces = Workspace.query.filter_by(CreatedFromCardId=id).all()
-            for workspace in related_workspaces:
-                workspace.CreatedFromCardId = None
-            
-            # 2. Delete any card connections that reference this card
-            related_connections = CardConnection.query.filter(
-                (CardConnection.FromCardId == id) | (CardConnection.ToCardId == id)
-            ).all()
-            for connection in related_connections:
-                db.session.delete(connection)
-            
-            # 3. Now delete the card
-            db.session.delete(card)
-            db.session.commit()
-            return '', 204
-            
-        except Exception as e:
-            db.session.rollback()
-            # Log the error for debugging
-            print(f"Error deleting card {id}: {str(e)}")
-            return {'error': f'Failed to delete card: {str(e)}'}, 500
+        # Its connections and the links of workspaces made from it go with the
+        # purge; until then the connection listing only follows live cards
+        if not tombstone(Card, Card.Id == id):
+            cardNameSpace.abort(404, 'Card not found')
+        db.session.commit()
+        return '', 204
 
 @cardNameSpace.route('/Company/<int:companyId>')
 @cardNameSpace.response(404, 'No cards found for this company')
 @cardNameSpace.param('companyId', 'The company ID')
 class CardsByCompany(Resource):
     @cardNameSpace.doc('GetCardsByCompany')
+    @cardNameSpace.param('readPath', 'Force the orm or projection read path')
+    @cardNameSpace.expect(pageParams)
+    @cardNameSpace.param('fields', FIELDS_HELP)
     @cardNameSpace.marshal_list_with(CardModel)
+    @query_budget(2)
     def get(self, companyId):
         """List all cards created by users from a specific company"""
-        cards = Card.query.join(User, Card.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        if use_projection('CardsByCompany'):
+            rows, headers = paginate(select_cards_by_company(companyId), Card.Id, execute=fetch_rows)
+            cards = [serialize_card_row(row) for row in rows]
+        else:
+            rows, headers = paginate(Card.query.options(*serialize_loaders(Card, requested_fields())).join(User, Card.CreatedBy == User.Id).filter(User.CompanyId == companyId), Card.Id)
+            cards = [card.serialize() for card in rows]
         if not cards:
             cardNameSpace.abort(404, "No cards found for this company")
-        return [card.serialize() for card in cards]
+        return cards, 200, headers
 
 @cardNameSpace.route('/connect')
 class CardConnect(Resource):
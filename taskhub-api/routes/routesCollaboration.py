@@ -2,6 +2,8 @@ from flask import request
 from flask_restx import Resource, fields
 from app import app, db, api, collaborationNameSpace
 from models import Collaboration
+from loaders import serialize_loaders
+from queryStats import query_budget
 
 # Swagger model
 CollaborationModel = collaborationNameSpace.model('Collaboration', {
@@ -28,10 +30,11 @@ class Collaborations(Resource):
     @collaborationNameSpace.doc('ListCollaboration')
     @collaborationNameSpace.expect(collaborationFilterParams)
     @collaborationNameSpace.marshal_list_with(CollaborationModel)
+    @query_budget(1)
     def get(self):
         """List collaborations with filters"""
         args = collaborationFilterParams.parse_args()
-        query = Collaboration.query
+        query = Collaboration.query.options(*serialize_loaders(Collaboration))
 
         for field in ['userId', 'vaultId', 'folderId', 'workspaceId', 'fileId']:
             value = args.get(field)
@@ -4,6 +4,9 @@ from flask_restx import Api, Resource, fields
 from sqlalchemy import or_
 from app import app, db, api, eventNameSpace
 from models import Event, User, UserEvents
+from loaders import serialize_loaders
+from queryStats import query_budget
+from pagination import paginate, pageParams
 
 UserEventModel = eventNameSpace.model('UserEvent', {
     'userId': fields.Integer(description="The ID of the user"),
@@ -31,11 +34,13 @@ EventModel = eventNameSpace.model('Event', {
 @eventNameSpace.route('/')
 class Events(Resource):
     @eventNameSpace.doc('ListEvents')
+    @eventNameSpace.expect(pageParams)
     @eventNameSpace.marshal_list_with(EventModel)
+    @query_budget(2)
     def get(self):
         """List all events"""
-        events = Event.query.all()
-        return [event.serialize() for event in events]
+        events, headers = paginate(Event.query.options(*serialize_loaders(Event)), Event.Id)
+        return [event.serialize() for event in events], 200, headers
 
     @eventNameSpace.doc('CreateEvent')
     @eventNameSpace.expect(EventModel)
@@ -77,7 +82,7 @@ class EventResource(Resource):
     @eventNameSpace.marshal_with(EventModel)
     def get(self, id):
         """Fetch a Event given its identifier"""
-        event = Event.query.get_or_404(id)
+        event = Event.query.options(*serialize_loaders(Event)).get_or_404(id)
         return event.serialize()
 
     @eventNameSpace.doc('UpdateEvent')
@@ -121,15 +126,18 @@ class EventResource(Resource):
 @eventNameSpace.response(404, 'No upcoming events found')
 class UpcomingEvents(Resource):
     @eventNameSpace.doc('GetUpcomingEvents')
+    @eventNameSpace.expect(pageParams)
     @eventNameSpace.marshal_list_with(EventModel)
+    @query_budget(2)
     def get(self):
         """List all upcoming events (events that haven't started yet or are currently active)"""
         current_time = datetime.now()
         # Get events that haven't ended yet (DateTimeTo >= current_time)
         # This includes events that haven't started yet and events currently happening
-        events = Event.query.filter(Event.DateTimeTo >= current_time).order_by(Event.DateTimeFrom.asc()).all()
+        # Paginated on the start time, with the id breaking ties
+        events, headers = paginate(Event.query.options(*serialize_loaders(Event)).filter(Event.DateTimeTo >= current_time), Event.DateTimeFrom, Event.Id)
         
-        return [event.serialize() for event in events]
+        return [event.serialize() for event in events], 200, headers
 
 @eventNameSpace.route('/User/<int:userId>')
 @eventNameSpace.response(404, 'No events found for this user')
@@ -137,9 +145,13 @@ class UpcomingEvents(Resource):
 class EventsByUser(Resource):
     @eventNameSpace.doc('GetEventsByUser')
     @eventNameSpace.marshal_list_with(EventModel)
+    @query_budget(2)
     def get(self, userId):
         """List all events filtered by user ID"""
-        events = Event.query.outerjoin(UserEvents, Event.Id == UserEvents.EventId).filter(or_(UserEvents.UserId == userId, Event.CreatedBy == userId)).all()
+        # A subquery instead of an outer join, so an event the user both created
+        # and attends is returned once.
+        attending = db.session.query(UserEvents.EventId).filter(UserEvents.UserId == userId)
+        events = Event.query.options(*serialize_loaders(Event)).filter(or_(Event.Id.in_(attending), Event.CreatedBy == userId)).all()
 
         if not events:
             eventNameSpace.abort(404, "No events found for this user")
@@ -3,9 +3,20 @@ import base64
 from datetime import datetime
 from flask import  request, jsonify
 from flask_restx import Resource, fields
+from werkzeug.datastructures import FileStorage
 from app import app, db, api, fileNameSpace
-from models import File, User
-from werkzeug.utils import secure_filename
+from models import File, User, UploadSession
+from loaders import serialize_loaders
+from fieldsets import requested_fields, FIELDS_HELP
+from queryStats import query_budget
+from pagination import paginate, pageParams, add_page_arguments
+from readModels import use_projection, fetch_rows, select_files_by_company, serialize_file_row
+from blobStore import store_spool, locate_blob, discard_spool, is_content_hash
+from tombstones import tombstone
+from uploadSessions import create_session, append_chunk, received_content_hash, complete_session, discard_session, direct_upload_target, complete_direct_upload
+from downloads import send_file_content
+from storageBackends import storage
+from batchUploads import parse_batch, parse_upload, create_files, BATCH_UPLOAD_MAX_FILES
 import json
 
 UPLOAD_FOLDER = 'uploads'
@@ -23,50 +34,95 @@ FileModel = fileNameSpace.model('File', {
     'createdBy': fields.Integer(description='The created by user identifier'),
     'createdDateTime': fields.DateTime(description='The created date time'),
     'createdByUser': fields.String(description='The user who create file'),
-    'iso365File': fields.Boolean( description='The flag for o365 files')
+    'iso365File': fields.Boolean( description='The flag for o365 files'),
+    'contentHash': fields.String(readOnly=True, description='The SHA-256 of the file content'),
+    'size': fields.Integer(readOnly=True, description='The file size in bytes')
 })
 
+UploadSessionModel = fileNameSpace.model('UploadSession', {
+    'id': fields.String(readOnly=True, description='The upload session identifier'),
+    'name': fields.String(required=True, description='The file name'),
+    'size': fields.Integer(required=True, description='The total file size in bytes'),
+    'offset': fields.Integer(readOnly=True, description='The number of bytes received so far'),
+    'checksum': fields.String(description='The SHA-256 of the whole file, hex encoded; can also be sent on finalize'),
+    'folderId': fields.Integer(description='The folder identifier'),
+    'pageId': fields.Integer(description='The page identifier'),
+    'workspaceId': fields.Integer(description='The workspace identifier'),
+    'createdBy': fields.Integer(description='The created by user identifier'),
+    'createdDateTime': fields.DateTime(readOnly=True, description='The created date time'),
+    'lastModifyDateTime': fields.DateTime(readOnly=True, description='The time the last chunk was received')
+})
+DirectUploadModel = fileNameSpace.inherit('DirectUpload', UploadSessionModel, {
+    'uploadUrl': fields.String(readOnly=True, description='Presigned URL to PUT the whole file to'),
+    'uploadHeaders': fields.Raw(readOnly=True, description='Headers the PUT must carry')
+})
+UploadFinalizeModel = fileNameSpace.model('UploadFinalize', {
+    'checksum': fields.String(description='The SHA-256 of the whole file, hex encoded')
+})
+BatchUploadResultModel = fileNameSpace.model('BatchUploadResult', {
+    'name': fields.String(description='The uploaded file name'),
+    'status': fields.Integer(description='201 when the file was created, otherwise the error status'),
+    'message': fields.String(description='Why the file was not created'),
+    'file': fields.Nested(FileModel, allow_null=True, skip_none=True, description='The created file')
+})
+batchUploadParams = fileNameSpace.parser()
+batchUploadParams.add_argument('files', type=FileStorage, location='files', action='append', required=True,
+                               help=f'The files to upload, up to {BATCH_UPLOAD_MAX_FILES}')
+batchUploadParams.add_argument('folderId', type=int, location='form', help='The folder identifier')
+batchUploadParams.add_argument('pageId', type=int, location='form', help='The page identifier')
+batchUploadParams.add_argument('workspaceId', type=int, location='form', help='The workspace identifier')
+batchUploadParams.add_argument('createdBy', type=int, location='form', help='The created by user identifier')
+chunkParams = fileNameSpace.parser()
+chunkParams.add_argument('offset', type=int, required=True, help='The byte offset of this chunk; must equal the session offset')
 
-fileFilterParams = fileNameSpace.parser()
+
+fileFilterParams = add_page_arguments(fileNameSpace.parser())
 fileFilterParams.add_argument('folderId', type=int, required=False, help='The Folder id to search for')
 @fileNameSpace.route('/')
 class Files(Resource):
     @fileNameSpace.doc('ListFiles')
     @fileNameSpace.expect(fileFilterParams)
+    @fileNameSpace.param('fields', FIELDS_HELP)
     @fileNameSpace.marshal_list_with(FileModel)
+    @query_budget(1)
     def get(self):
         """List all files"""
         folderId = request.args.get('folderId')
 
-        query = File.query.options(db.joinedload(File.CreatedByUser))
+        query = File.query.options(*serialize_loaders(File, requested_fields()))
         if folderId:
             query = query.filter_by(FolderId=folderId)
 
-        files = query.all()
-        return [file.serialize() for file in files]
+        files, headers = paginate(query, File.Id)
+        return [file.serialize() for file in files], 200, headers
     
     @fileNameSpace.doc('CreateFile')
     #@fileNameSpace.expect(FileModel)
     #@fileNameSpace.marshal_with(FileModel, code=201)
     def post(self):
         """Create a new file"""
+        # Each part is hashed while Werkzeug writes it to disk, so the bytes are read only once
+        form, files = parse_upload(request.environ, request.max_content_length)
+        file = files.get('file')
+        for _, part in files.items(multi=True):
+            if part is not file:
+                discard_spool(part.stream)
         try:
-            if 'file' not in request.files:
+            if file is None:
                 return jsonify({'message': 'No file part'}), 400
 
-            # Get file from request
-            file = request.files['file']
             if file.filename == '':
+                discard_spool(file.stream)
                 return jsonify({'message': 'No selected file'}), 400
 
             # Get other parameters from form data
-            name = request.form.get('name')
-            path = request.form.get('path')
-            folderId = request.form.get('folderId')
-            pageId = request.form.get('pageId')
-            workspaceId = request.form.get('workspaceId')
-            createdBy = request.form.get('createdBy')
-            createdByUser = request.form.get('createdByUser')
+            name = form.get('name')
+            path = form.get('path')
+            folderId = form.get('folderId')
+            pageId = form.get('pageId')
+            workspaceId = form.get('workspaceId')
+            createdBy = form.get('createdBy')
+            createdByUser = form.get('createdByUser')
             iso365File = False
             
             # Handle null values properly
@@ -90,27 +146,14 @@ class Files(Resource):
             else:
                 createdBy = None
 
-            filename = secure_filename(name)
-            
-            # Create directory based on pageId, workspaceId, or folderId
-            if pageId:
-                upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(pageId))
-            elif workspaceId:
-                upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'workspace', str(workspaceId))
-            elif folderId:
-                upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'folders', str(folderId))
-            else:
-                upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'general')
-                
-            if not os.path.exists(upload_folder):
-                os.makedirs(upload_folder)
-            
-            file_path = os.path.join(upload_folder, filename)
-            file.save(file_path)
+            # Stored once by content hash; a file uploaded before is not written again
+            contentHash, size = store_spool(file.stream)
 
             newFile = File(
                 Name=name,
-                Path=file_path,
+                Path=locate_blob(contentHash),
+                ContentHash=contentHash,
+                Size=size,
                 FolderId=folderId,
                 PageId=pageId,
                 WorkspaceId=workspaceId,
@@ -127,6 +170,8 @@ class Files(Resource):
             return jsonify(newFile.serialize()), 201
         
         except Exception as e:
+            if file is not None:
+                discard_spool(file.stream)
             print(f"Error in file upload: {str(e)}")
             import traceback
             traceback.print_exc()
@@ -137,10 +182,11 @@ class Files(Resource):
 @fileNameSpace.param('id', 'The file identifier')
 class FileResource(Resource):
     @fileNameSpace.doc('GetFile')
+    @fileNameSpace.param('fields', FIELDS_HELP)
     @fileNameSpace.marshal_with(FileModel)
     def get(self, id):
         """Fetch a file given its identifier"""
-        file = File.query.options(db.joinedload(File.CreatedByUser)).get_or_404(id)
+        file = File.query.options(*serialize_loaders(File, requested_fields())).get_or_404(id)
         return file.serialize()
 
     @fileNameSpace.doc('UpdateFile')
@@ -166,26 +212,239 @@ class FileResource(Resource):
     @fileNameSpace.response(204, 'File deleted')
     def delete(self, id):
         """Delete a file given its identifier"""
-        file = File.query.get_or_404(id)
-        db.session.delete(file)
+        if not tombstone(File, File.Id == id):
+            fileNameSpace.abort(404, 'File not found')
         db.session.commit()
         return '', 204
+@fileNameSpace.route('/<int:id>/download')
+@fileNameSpace.response(404, 'File not found')
+@fileNameSpace.param('id', 'The file identifier')
+class FileDownload(Resource):
+    @fileNameSpace.doc('DownloadFile')
+    @fileNameSpace.response(302, 'Redirect to a presigned URL of the file on remote storage')
+    def get(self, id):
+        """Download the file content"""
+        return send_file_content(File.query.get_or_404(id))
+
 @fileNameSpace.route('/Company/<int:companyId>')
 @fileNameSpace.response(404, 'No file found for this company')
 @fileNameSpace.param('companyId', 'The file identifier')
 class FilesByCompany(Resource):
     @fileNameSpace.doc('GetFilesByCompany')
+    @fileNameSpace.param('readPath', 'Force the orm or projection read path')
+    @fileNameSpace.expect(pageParams)
+    @fileNameSpace.param('fields', FIELDS_HELP)
     @fileNameSpace.marshal_list_with(FileModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all files filtered by company ID"""
-        files = File.query.join(User, File.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        if use_projection('FilesByCompany'):
+            rows, headers = paginate(select_files_by_company(companyId), File.Id, execute=fetch_rows)
+            files = [serialize_file_row(row) for row in rows]
+        else:
+            rows, headers = paginate(File.query.options(*serialize_loaders(File, requested_fields())).join(User, File.CreatedBy == User.Id).filter(User.CompanyId == companyId), File.Id)
+            files = [file.serialize() for file in rows]
         if not files:
             fileNameSpace.abort(404, "No files found for this company")
-        return [file.serialize() for file in files]
+        return files, 200, headers
     
+@fileNameSpace.route('/batch')
+class FileBatch(Resource):
+    @fileNameSpace.doc('CreateFiles')
+    @fileNameSpace.expect(batchUploadParams)
+    @fileNameSpace.response(207, 'Some of the files could not be created', [BatchUploadResultModel])
+    @fileNameSpace.marshal_list_with(BatchUploadResultModel, code=201, skip_none=True)
+    def post(self):
+        """Upload many files in one multipart request; every `files` part becomes a file"""
+        form, parts = parse_batch(request.environ, request.max_content_length)
+        if not parts:
+            fileNameSpace.abort(400, 'No file part')
+        if len(parts) > BATCH_UPLOAD_MAX_FILES:
+            for part in parts:
+                discard_spool(part.stream)
+            fileNameSpace.abort(413, f'At most {BATCH_UPLOAD_MAX_FILES} files per batch')
+        columns = {}
+        for key, column in (('folderId', 'FolderId'), ('pageId', 'PageId'), ('workspaceId', 'WorkspaceId'), ('createdBy', 'CreatedBy')):
+            value = form.get(key)
+            try:
+                columns[column] = int(value) if value not in (None, '', 'null') else None
+            except ValueError:
+                for part in parts:
+                    discard_spool(part.stream)
+                fileNameSpace.abort(400, f'{key} must be an integer')
+        results = create_files(parts, **columns)
+        return results, 201 if all(result['status'] == 201 for result in results) else 207
+
+@fileNameSpace.route('/upload')
+class UploadSessions(Resource):
+    @fileNameSpace.doc('StartUpload')
+    @fileNameSpace.expect(UploadSessionModel)
+    @fileNameSpace.marshal_with(UploadSessionModel, code=201)
+    def post(self):
+        """Start a resumable upload"""
+        data = request.json
+        size = data.get('size')
+        if not data.get('name') or not isinstance(size, int) or size < 0:
+            fileNameSpace.abort(400, 'name and a non-negative size are required')
+        session = create_session(
+            Name=data.get('name'),
+            Size=size,
+            Checksum=data.get('checksum'),
+            FolderId=data.get('folderId') or None,
+            PageId=data.get('pageId') or None,
+            WorkspaceId=data.get('workspaceId') or None,
+            CreatedBy=data.get('createdBy') or None
+        )
+        db.session.commit()
+        return session.serialize(), 201
+
+@fileNameSpace.route('/upload/<string:sessionId>')
+@fileNameSpace.response(404, 'Upload session not found')
+@fileNameSpace.param('sessionId', 'The upload session identifier')
+class UploadSessionResource(Resource):
+    @fileNameSpace.doc('GetUpload')
+    @fileNameSpace.marshal_with(UploadSessionModel)
+    def get(self, sessionId):
+        """Get the state of an upload, including the offset to resume from"""
+        return UploadSession.query.get_or_404(sessionId).serialize()
+
+    @fileNameSpace.doc('UploadChunk')
+    @fileNameSpace.expect(chunkParams)
+    @fileNameSpace.response(409, 'The offset does not match the bytes received so far')
+    def put(self, sessionId):
+        """Append a chunk of raw bytes (application/octet-stream) at the given offset"""
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            fileNameSpace.abort(400, 'offset is required')
+        # Lock the session so two chunks for the same upload can't interleave
+        session = db.session.get(UploadSession, sessionId, with_for_update=True)
+        if session is None:
+            fileNameSpace.abort(404, 'Upload session not found')
+        if offset != session.Received:
+            return {'message': f'Expected offset {session.Received}', 'offset': session.Received}, 409
+        try:
+            append_chunk(session, request.stream)
+        except ValueError as e:
+            db.session.rollback()
+            fileNameSpace.abort(400, str(e))
+        db.session.commit()
+        return session.serialize(), 200
+
+    @fileNameSpace.doc('CancelUpload')
+    @fileNameSpace.response(204, 'Upload cancelled')
+    def delete(self, sessionId):
+        """Cancel an upload and discard the bytes received so far"""
+        discard_session(UploadSession.query.get_or_404(sessionId))
+        db.session.commit()
+        return '', 204
+
+@fileNameSpace.route('/upload/<string:sessionId>/finalize')
+@fileNameSpace.response(404, 'Upload session not found')
+@fileNameSpace.param('sessionId', 'The upload session identifier')
+class UploadFinalize(Resource):
+    @fileNameSpace.doc('FinalizeUpload')
+    @fileNameSpace.expect(UploadFinalizeModel)
+    @fileNameSpace.response(409, 'Not all bytes have been received')
+    @fileNameSpace.response(422, 'The checksum does not match; the upload is discarded')
+    def post(self, sessionId):
+        """Verify the checksum of a complete upload and create the file"""
+        session = db.session.get(UploadSession, sessionId, with_for_update=True)
+        if session is None:
+            fileNameSpace.abort(404, 'Upload session not found')
+        checksum = (request.get_json(silent=True) or {}).get('checksum') or session.Checksum
+        if not checksum:
+            fileNameSpace.abort(400, 'checksum is required')
+        if session.Received != session.Size:
+            return {'message': f'Received {session.Received} of {session.Size} bytes', 'offset': session.Received}, 409
+        contentHash = received_content_hash(session)
+        if contentHash != checksum.lower():
+            discard_session(session)
+            db.session.commit()
+            fileNameSpace.abort(422, 'Checksum mismatch, the upload has been discarded')
+
+        newFile = file_from_session(session, contentHash, complete_session(session, contentHash))
+        db.session.commit()
+        return newFile.serialize(), 201
+
+@fileNameSpace.route('/direct-upload')
+class DirectUploads(Resource):
+    @fileNameSpace.doc('StartDirectUpload')
+    @fileNameSpace.expect(UploadSessionModel)
+    @fileNameSpace.response(501, 'The storage backend does not support direct uploads')
+    @fileNameSpace.marshal_with(DirectUploadModel, code=201)
+    def post(self):
+        """Start an upload that PUTs the file straight to storage through a presigned URL"""
+        if not storage().remote:
+            fileNameSpace.abort(501, 'Direct uploads need a remote storage backend; use /File/upload')
+        data = request.json
+        size = data.get('size')
+        checksum = (data.get('checksum') or '').lower()
+        if not data.get('name') or not isinstance(size, int) or size < 0 or not is_content_hash(checksum):
+            fileNameSpace.abort(400, 'name, a non-negative size and the SHA-256 checksum are required')
+        session = create_session(
+            direct=True,
+            Name=data.get('name'),
+            Size=size,
+            Checksum=checksum,
+            FolderId=data.get('folderId') or None,
+            PageId=data.get('pageId') or None,
+            WorkspaceId=data.get('workspaceId') or None,
+            CreatedBy=data.get('createdBy') or None
+        )
+        db.session.commit()
+        url, headers = direct_upload_target(session)
+        return dict(session.serialize(), uploadUrl=url, uploadHeaders=headers), 201
+
+@fileNameSpace.route('/direct-upload/<string:sessionId>/finalize')
+@fileNameSpace.response(404, 'Upload session not found')
+@fileNameSpace.param('sessionId', 'The upload session identifier')
+class DirectUploadFinalize(Resource):
+    @fileNameSpace.doc('FinalizeDirectUpload')
+    @fileNameSpace.response(409, 'The file has not been uploaded yet')
+    @fileNameSpace.response(422, 'The uploaded file does not match; the upload is discarded')
+    def post(self, sessionId):
+        """Move a direct upload into the store and create the file"""
+        session = db.session.get(UploadSession, sessionId, with_for_update=True)
+        if session is None:
+            fileNameSpace.abort(404, 'Upload session not found')
+        try:
+            completed = complete_direct_upload(session)
+        except ValueError as e:
+            discard_session(session)
+            db.session.commit()
+            fileNameSpace.abort(422, f'{e}, the upload has been discarded')
+        if completed is None:
+            return {'message': 'The file has not been uploaded yet'}, 409
+        newFile = file_from_session(session, *completed)
+        db.session.commit()
+        return newFile.serialize(), 201
+
+def file_from_session(session, contentHash, path):
+    newFile = File(
+        Name=session.Name,
+        Path=path,
+        ContentHash=contentHash,
+        Size=session.Size,
+        FolderId=session.FolderId,
+        PageId=session.PageId,
+        WorkspaceId=session.WorkspaceId,
+        CreatedBy=session.CreatedBy,
+        CreatedDateTime=datetime.now(),
+        Iso365File=False
+    )
+    db.session.add(newFile)
+    return newFile
+
 fileNameSpace.add_resource(Files, '/')
 fileNameSpace.add_resource(FileResource, '/<int:id>')
+fileNameSpace.add_resource(FileDownload, '/<int:id>/download')
 fileNameSpace.add_resource(FilesByCompany, '/Company/<int:companyId>')
+fileNameSpace.add_resource(FileBatch, '/batch')
+fileNameSpace.add_resource(UploadSessions, '/upload')
+fileNameSpace.add_resource(UploadSessionResource, '/upload/<string:sessionId>')
+fileNameSpace.add_resource(UploadFinalize, '/upload/<string:sessionId>/finalize')
+fileNameSpace.add_resource(DirectUploads, '/direct-upload')
+fileNameSpace.add_resource(DirectUploadFinalize, '/direct-upload/<string:sessionId>/finalize')
 
 api.add_namespace(fileNameSpace)
 if __name__ == '__main__':
@@ -4,6 +4,12 @@ from flask_restx import Api, Resource, fields
 from sqlalchemy import null
 from app import app, db, api, folderNameSpace
 from models import Folder, User
+from loaders import serialize_loaders
+from zipExport import zip_response, folder_export_entries
+from deletionJobs import schedule_folder_delete
+from jobs import job_response
+from queryStats import query_budget
+from pagination import paginate, pageParams
 
 
 FolderModel = folderNameSpace.model('Folder', {
@@ -25,10 +31,11 @@ class Folders(Resource):
     @folderNameSpace.doc('ListFolders')
     @folderNameSpace.expect(folderFilterParams)
     @folderNameSpace.marshal_list_with(FolderModel)
+    @query_budget(1)
     def get(self):
         """List all folders"""
         vaultId = request.args.get('vaultId')
-        query = Folder.query
+        query = Folder.query.options(*serialize_loaders(Folder))
         if vaultId:
             query = query.filter_by(VaultId=vaultId)
 
@@ -83,30 +90,42 @@ class FolderResource(Resource):
         return folder.serialize()
 
     @folderNameSpace.doc('DeleteFolder')
-    @folderNameSpace.response(204, 'Folder deleted')
+    @folderNameSpace.response(202, 'Folder hidden and queued for deletion; poll the returned job')
     def delete(self, id):
-        """Delete a folder given its identifier"""
-        folder = Folder.query.get_or_404(id)
-        db.session.delete(folder)
-        db.session.commit()
-        return '', 204
+        """Hide a folder at once and delete it with its subfolders and workspaces in a background job"""
+        Folder.query.get_or_404(id)
+        return job_response(schedule_folder_delete(id))
 @folderNameSpace.route('/Company/<int:companyId>')
 @folderNameSpace.response(404, 'No folders found for this company')
 @folderNameSpace.param('companyId', 'The company identifier')
 class FoldersByCompany(Resource):
     @folderNameSpace.doc('GetFoldersByCompany')
+    @folderNameSpace.expect(pageParams)
     @folderNameSpace.marshal_list_with(FolderModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all folders filtered by company ID"""
-        folders = Folder.query.join(User, Folder.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        folders, headers = paginate(Folder.query.options(*serialize_loaders(Folder)).join(User, Folder.CreatedBy == User.Id).filter(User.CompanyId == companyId), Folder.Id)
         if not folders:
             folderNameSpace.abort(404, "No folders found for this company")
-        return [folder.serialize() for folder in folders]
+        return [folder.serialize() for folder in folders], 200, headers
+
+@folderNameSpace.route('/<int:id>/export')
+@folderNameSpace.response(404, 'Folder not found')
+@folderNameSpace.param('id', 'The folder identifier')
+class FolderExport(Resource):
+    @folderNameSpace.doc('ExportFolder')
+    @folderNameSpace.produces(['application/zip'])
+    def get(self, id):
+        """Download all files in the folder as a zip archive, streamed as it is built"""
+        folder = Folder.query.get_or_404(id)
+        return zip_response(folder_export_entries(folder), folder.Name)
 
 # Add resources to namespace
 folderNameSpace.add_resource(Folders, '/')
 folderNameSpace.add_resource(FolderResource, '/<int:id>')
 folderNameSpace.add_resource(FoldersByCompany, '/Company/<int:companyId>')
+folderNameSpace.add_resource(FolderExport, '/<int:id>/export')
 api.add_namespace(folderNameSpace)
 if __name__ == '__main__':
     app.run(debug=True)
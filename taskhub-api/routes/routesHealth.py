@@ -1,5 +1,6 @@
 from flask_restx import  Resource
 from app import app, api, healthNameSpace
+from nameCache import displayNames
 
 @healthNameSpace.route('/')
 class Health(Resource):
@@ -7,7 +8,15 @@ class Health(Resource):
     def get(self):
         return "OK", 200
 
+@healthNameSpace.route('/cache')
+class CacheStats(Resource):
+    @healthNameSpace.doc('CacheStats')
+    def get(self):
+        """Hit and miss counters of the user display-name cache"""
+        return {'displayNames': displayNames.stats()}, 200
+
 healthNameSpace.add_resource(Health, '/')
+healthNameSpace.add_resource(CacheStats, '/cache')
 
 api.add_namespace(healthNameSpace)
 if __name__ == '__main__':
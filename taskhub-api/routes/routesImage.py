@@ -1,14 +1,28 @@
+import base64
+import binascii
 from datetime import datetime
 from flask import request
 from flask_restx import Resource, fields
 from app import app, db, api, imageNameSpace
 from models import Image
+from loaders import serialize_loaders
+from fieldsets import requested_fields, FIELDS_HELP
+from queryStats import query_budget
+from blobStore import put_blob, read_blob, locate_blob, blob_key, guess_mime_type
+from imageVariants import IMAGE_VARIANTS, VARIANT_MIME_TYPE, ensure_variant, generate_variants, variant_key, flat_variant_key
+from downloads import send_stored
+from tombstones import tombstone
 
 # Swagger model
 ImageModel = imageNameSpace.model('Image', {
     'id': fields.Integer(readOnly=True, description='Image ID'),
     'name': fields.String(description='Image name'),
-    'base64': fields.String(description='Base64 image content'),
+    'base64': fields.String(description='Base64 image content; accepted on create/update and only returned by GET /Image/<id>'),
+    'contentHash': fields.String(readOnly=True, description='SHA-256 of the image bytes'),
+    'size': fields.Integer(readOnly=True, description='Image size in bytes'),
+    'mimeType': fields.String(readOnly=True, description='Image mime type'),
+    'url': fields.String(readOnly=True, description='URL of the image bytes; listings point at the thumbnail by default'),
+    'originalUrl': fields.String(readOnly=True, description='URL of the original image bytes'),
     'pageId': fields.Integer(description='Page ID'),
     'pageName': fields.String(description='Page name'),
     'createdBy': fields.Integer(description='Created by user ID'),
@@ -24,18 +38,51 @@ ImageOrderModel = imageNameSpace.model('ImageOrder', {
 # Query param filter
 imageFilterParams = imageNameSpace.parser()
 imageFilterParams.add_argument('pageId', type=int, required=False, help='Filter by Page ID')
+imageFilterParams.add_argument('variant', type=str, required=False, help='Variant the url points at (default thumbnail)',
+                               choices=['original', *IMAGE_VARIANTS])
+
+variantParams = imageNameSpace.parser()
+variantParams.add_argument('variant', type=str, required=False, help='Image variant (default original)',
+                           choices=['original', *IMAGE_VARIANTS])
+
+
+def requested_variant(default):
+    variant = request.args.get('variant', default)
+    if variant != 'original' and variant not in IMAGE_VARIANTS:
+        imageNameSpace.abort(400, f'Unknown image variant {variant}')
+    return None if variant == 'original' else variant
+
+
+def store_image_content(image, encoded):
+    """Decode the base64 payload sent by the client and point the image at its blob"""
+    # Tolerate data URLs as well as the bare base64 the desktop client sends
+    if encoded.startswith('data:') and ',' in encoded:
+        encoded = encoded.split(',', 1)[1]
+    try:
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        imageNameSpace.abort(400, 'base64 is not valid base64 data')
+    image.ContentHash = put_blob(data)
+    image.ContentSize = len(data)
+    image.MimeType = guess_mime_type(data)
+    # Variants are keyed by content hash, so only new bytes get rendered
+    if image.MimeType.startswith('image/'):
+        generate_variants(image.ContentHash)
 
 @imageNameSpace.route('/')
 class ImageList(Resource):
     @imageNameSpace.expect(imageFilterParams)
+    @imageNameSpace.param('fields', FIELDS_HELP)
     @imageNameSpace.marshal_list_with(ImageModel)
+    @query_budget(1)
     def get(self):
         """List all images with optional pageId filter"""
         page_id = request.args.get('pageId')
-        query = Image.query
+        variant = requested_variant('thumbnail')
+        query = Image.query.options(*serialize_loaders(Image, requested_fields()))
         if page_id:
             query = query.filter_by(PageId=page_id)
-        return [img.serialize() for img in query.all()]
+        return [img.serialize(variant) for img in query.all()]
 
     @imageNameSpace.expect(ImageModel)
     @imageNameSpace.marshal_with(ImageModel, code=201)
@@ -46,12 +93,13 @@ class ImageList(Resource):
 
         image = Image(
             Name=data.get('name'),
-            Base64Data=data.get('base64'),
             PageId=data.get('pageId'),
             CreatedBy=data.get('createdBy'),
             CreatedDateTime=now,
             LastModifyDateTime=now
         )
+        if data.get('base64'):
+            store_image_content(image, data['base64'])
         db.session.add(image)
         db.session.commit()
         return image.serialize(), 201
@@ -60,11 +108,17 @@ class ImageList(Resource):
 @imageNameSpace.response(404, 'Image not found')
 @imageNameSpace.param('id', 'Image ID')
 class ImageResource(Resource):
+    @imageNameSpace.param('fields', FIELDS_HELP)
     @imageNameSpace.marshal_with(ImageModel)
     def get(self, id):
         """Get image by ID"""
-        image = Image.query.get_or_404(id)
-        return image.serialize()
+        fields = requested_fields()
+        image = Image.query.options(*serialize_loaders(Image, fields)).get_or_404(id)
+        result = image.serialize()
+        # Single image reads still inline the bytes for clients that predate the content URL
+        if image.ContentHash and (fields is None or 'base64' in fields):
+            result['base64'] = base64.b64encode(read_blob(image.ContentHash)).decode()
+        return result
 
     @imageNameSpace.expect(ImageModel)
     @imageNameSpace.marshal_with(ImageModel)
@@ -74,7 +128,8 @@ class ImageResource(Resource):
         data = request.json
 
         image.Name = data.get('name', image.Name)
-        image.Base64Data = data.get('base64', image.Base64Data)
+        if data.get('base64'):
+            store_image_content(image, data['base64'])
         image.PageId = data.get('pageId', image.PageId)
         image.CreatedBy = data.get('createdBy', image.CreatedBy)
         image.LastModifyDateTime = datetime.utcnow()
@@ -85,11 +140,32 @@ class ImageResource(Resource):
     @imageNameSpace.response(204, 'Image deleted')
     def delete(self, id):
         """Delete image"""
-        image = Image.query.get_or_404(id)
-        db.session.delete(image)
+        if not tombstone(Image, Image.Id == id):
+            imageNameSpace.abort(404, 'Image not found')
         db.session.commit()
         return '', 204
     
+@imageNameSpace.route('/<int:id>/content')
+@imageNameSpace.response(404, 'Image not found')
+@imageNameSpace.param('id', 'Image ID')
+class ImageContent(Resource):
+    @imageNameSpace.doc('GetImageContent')
+    @imageNameSpace.expect(variantParams)
+    @imageNameSpace.produces(['image/png', 'image/jpeg', 'image/gif', 'image/webp'])
+    def get(self, id):
+        """Download the image bytes, or one of its resized variants"""
+        variant = requested_variant('original')
+        image = Image.query.get_or_404(id)
+        if not image.ContentHash or locate_blob(image.ContentHash) is None:
+            imageNameSpace.abort(404, 'Image has no content')
+        if variant:
+            # Images stored before variants existed get theirs rendered here;
+            # content that cannot be decoded falls back to the original
+            if ensure_variant(image.ContentHash, variant):
+                return send_stored(variant_key(image.ContentHash, variant), flat_variant_key(image.ContentHash, variant),
+                                   mimetype=VARIANT_MIME_TYPE)
+        return send_stored(blob_key(image.ContentHash), image.ContentHash, mimetype=image.MimeType)
+
 @imageNameSpace.route('/order')
 class ImageOrder(Resource):
     @imageNameSpace.doc('ImageOrder')
@@ -107,6 +183,7 @@ class ImageOrder(Resource):
     
 imageNameSpace.add_resource(ImageList, '/')
 imageNameSpace.add_resource(ImageResource, '/<int:id>')
+imageNameSpace.add_resource(ImageContent, '/<int:id>/content')
 imageNameSpace.add_resource(ImageOrder, '/order')
 
 # Register namespace
@@ -0,0 +1,38 @@
+from flask_restx import Resource, fields
+from app import app, db, api, jobNameSpace
+from models import Job
+
+
+JobModel = jobNameSpace.model('Job', {
+    'id': fields.Integer(readOnly=True, description='The job unique identifier'),
+    'kind': fields.String(description='What the job does, e.g. delete-vault'),
+    'status': fields.String(description='queued, running, succeeded or failed'),
+    'priority': fields.Integer(description='Jobs with a higher priority run first'),
+    'attempts': fields.Integer(description='Times the job has been started'),
+    'maxAttempts': fields.Integer(description='Attempts before a failing job is given up'),
+    'runAfter': fields.DateTime(description='When a queued job is due, e.g. after a failed attempt'),
+    'progress': fields.Integer(description='Units of work done so far'),
+    'total': fields.Integer(description='Units of work in the job, once known'),
+    'error': fields.String(description='Why the job failed'),
+    'createdBy': fields.Integer(description='The user that started the job'),
+    'createdDateTime': fields.DateTime(description='When the job was queued'),
+    'startedDateTime': fields.DateTime(description='When the job started running'),
+    'finishedDateTime': fields.DateTime(description='When the job succeeded or failed'),
+})
+
+@jobNameSpace.route('/<int:id>')
+@jobNameSpace.response(404, 'Job not found')
+@jobNameSpace.param('id', 'The job identifier')
+class JobResource(Resource):
+    @jobNameSpace.doc('GetJob')
+    @jobNameSpace.marshal_with(JobModel)
+    def get(self, id):
+        """Fetch the status and progress of a background job"""
+        job = Job.query.get_or_404(id)
+        return job.serialize()
+
+jobNameSpace.add_resource(JobResource, '/<int:id>')
+
+api.add_namespace(jobNameSpace)
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -3,6 +3,10 @@ from flask import request
 from flask_restx import Resource, fields
 from app import app, db, api, pageNameSpace
 from models import Page, User
+from loaders import serialize_loaders
+from queryStats import query_budget
+from pagination import paginate, pageParams
+from tombstones import tombstone_pages
 
 # Swagger model
 PageModel = pageNameSpace.model('Page', {
@@ -34,10 +38,11 @@ class PageList(Resource):
     @pageNameSpace.doc('ListPages')
     @pageNameSpace.expect(pageFilterParams)
     @pageNameSpace.marshal_list_with(PageModel)
+    @query_budget(1)
     def get(self):
         """List all pages, optionally filtered by workspace ID"""
         workspace_id = request.args.get('workspaceId')
-        query = Page.query
+        query = Page.query.options(*serialize_loaders(Page))
         if workspace_id:
             query = query.filter_by(WorkspaceId=workspace_id)
         pages = query.all()
@@ -68,7 +73,7 @@ class PageResource(Resource):
     @pageNameSpace.marshal_with(PageModel)
     def get(self, id):
         """Fetch a page by ID"""
-        page = Page.query.get_or_404(id)
+        page = Page.query.options(*serialize_loaders(Page)).get_or_404(id)
         return page.serialize()
 
     @pageNameSpace.doc('UpdatePage')
@@ -88,9 +93,9 @@ class PageResource(Resource):
     @pageNameSpace.doc('DeletePage')
     @pageNameSpace.response(204, 'Page deleted')
     def delete(self, id):
-        """Delete a page"""
-        page = Page.query.get_or_404(id)
-        db.session.delete(page)
+        """Delete a page with everything on it"""
+        if not tombstone_pages(Page.Id == id):
+            pageNameSpace.abort(404, 'Page not found')
         db.session.commit()
         return '', 204
 
@@ -99,13 +104,15 @@ class PageResource(Resource):
 @pageNameSpace.param('companyId', 'The company ID')
 class PagesByCompany(Resource):
     @pageNameSpace.doc('GetPagesByCompany')
+    @pageNameSpace.expect(pageParams)
     @pageNameSpace.marshal_list_with(PageModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all pages filtered by company ID"""
-        pages = Page.query.join(User, Page.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        pages, headers = paginate(Page.query.options(*serialize_loaders(Page)).join(User, Page.CreatedBy == User.Id).filter(User.CompanyId == companyId), Page.Id)
         if not pages:
             pageNameSpace.abort(404, "No pages found for this company")
-        return [page.serialize() for page in pages]
+        return [page.serialize() for page in pages], 200, headers
 @pageNameSpace.route('/rename/<int:pageId>')
 @pageNameSpace.response(404, 'No pages found ')
 @pageNameSpace.param('pageId', 'The page ID')
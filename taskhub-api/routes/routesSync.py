@@ -3,6 +3,7 @@ from flask import Flask, request, jsonify
 from flask_restx import Api, Resource, fields
 from app import app, db, api, syncNameSpace
 from models import Task
+from changeFeed import read_changes, cursor_before, SYNC_PAGE_SIZE, SYNC_MAX_PAGE_SIZE
 
 
 # Define a model for a Task
@@ -52,8 +53,50 @@ class SyncResource(Resource):
         db.session.commit()
         return task
 
+ChangeModel = syncNameSpace.model('Change', {
+    'type': fields.String(description='The kind of row: Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, File or Url'),
+    'id': fields.Integer(description='The row identifier'),
+    'deleted': fields.Boolean(description='The row was deleted; drop it'),
+    'data': fields.Raw(description='The row as its own endpoints return it, unless deleted'),
+})
+
+ChangePageModel = syncNameSpace.model('ChangePage', {
+    'changes': fields.List(fields.Nested(ChangeModel), description='Rows created, updated or deleted after the cursor, once each'),
+    'cursor': fields.Integer(description='Pass back as since for the changes after this page'),
+    'hasMore': fields.Boolean(description='More changes follow right away'),
+    'reset': fields.Boolean(description='The feed cannot cover the gap: reload everything, then continue from cursor'),
+})
+
+changeParams = syncNameSpace.parser()
+changeParams.add_argument('since', type=int, required=False, help='The cursor of the previous page; omit for the first sync')
+changeParams.add_argument('modifiedSince', type=str, required=False,
+                          help='Instead of since: the newest lastModifyDateTime the client holds (ISO 8601)')
+changeParams.add_argument('limit', type=int, required=False, help=f'Changes per page (default {SYNC_PAGE_SIZE}, at most {SYNC_MAX_PAGE_SIZE})')
+changeParams.add_argument('userId', type=int, required=False, help="Only changes in the vaults of this user, or outside any vault within the user's company")
+
+
+@syncNameSpace.route('/changes')
+class SyncChanges(Resource):
+    @syncNameSpace.doc('GetChanges')
+    @syncNameSpace.expect(changeParams)
+    @syncNameSpace.marshal_with(ChangePageModel)
+    def get(self):
+        '''Everything created, updated or deleted since a cursor, one bounded page at a time'''
+        since = request.args.get('since', type=int)
+        modifiedSince = request.args.get('modifiedSince')
+        if since is None and modifiedSince:
+            try:
+                since = cursor_before(datetime.fromisoformat(modifiedSince))
+            except ValueError:
+                syncNameSpace.abort(400, 'modifiedSince must be an ISO 8601 date and time')
+        limit = request.args.get('limit', SYNC_PAGE_SIZE, type=int)
+        if limit < 1:
+            syncNameSpace.abort(400, 'limit must be positive')
+        return read_changes(since, min(limit, SYNC_MAX_PAGE_SIZE), request.args.get('userId', type=int))
+
 # Register TaskList and TaskResource resources with the API
 syncNameSpace.add_resource(SyncResource, '/<int:id>')
+syncNameSpace.add_resource(SyncChanges, '/changes')
 api.add_namespace(syncNameSpace)
 if __name__ == '__main__':
     app.run(debug=True)
@@ -3,6 +3,12 @@ from flask import Flask, request, jsonify
 from flask_restx import Api, Resource, fields
 from app import app, db, api, taskNameSpace
 from models import Task, User, FavoriteTasks, PinnedTasks
+from loaders import serialize_loaders
+from fieldsets import requested_fields, FIELDS_HELP
+from queryStats import query_budget
+from pagination import paginate, pageParams, add_page_arguments
+from readModels import use_projection, fetch_rows, select_tasks_by_company, serialize_task_row
+from tombstones import tombstone_tasks
 
 
 # Define a model for a Task
@@ -32,7 +38,7 @@ TaskUserModel = taskNameSpace.model('TaskUser', {
 })
 
 # Resource for managing tasks
-taskFilterParams = taskNameSpace.parser()
+taskFilterParams = add_page_arguments(taskNameSpace.parser())
 taskFilterParams.add_argument('title', type=str, required=False, help='The task title to search for')
 taskFilterParams.add_argument('description', type=str, required=False, help='The task description to search for')
 taskFilterParams.add_argument('status', type=str, required=False, help='The task status to filter by')
@@ -47,7 +53,9 @@ taskFilterParams.add_argument('parentId', type=str, required=False, help='The ID
 class TaskList(Resource):
     @taskNameSpace.doc('ListTasks')
     @taskNameSpace.expect(taskFilterParams)
+    @taskNameSpace.param('fields', FIELDS_HELP)
     @taskNameSpace.marshal_list_with(TaskModel)
+    @query_budget(1)
     def get(self):
         '''List all tasks'''
         title = request.args.get('title')
@@ -59,7 +67,7 @@ class TaskList(Resource):
         parentId = request.args.get('parentId')
 
         # Build the query
-        query = Task.query
+        query = Task.query.options(*serialize_loaders(Task, requested_fields()))
         
         if title:
             query = query.filter(Task.Title.ilike(f'%{title}%'))
@@ -80,9 +88,9 @@ class TaskList(Resource):
                 query = query.filter_by(ParentId=parentId)
 
         # Execute the query and get results
-        tasks = query.all()
+        tasks, headers = paginate(query, Task.Id)
         
-        return [task.serialize() for task in tasks]
+        return [task.serialize() for task in tasks], 200, headers
 
 
     @taskNameSpace.doc('CreateTask')
@@ -144,10 +152,11 @@ class TaskList(Resource):
 @taskNameSpace.route('/<int:id>')
 class TaskResource(Resource):
     @taskNameSpace.doc('GetTask')
+    @taskNameSpace.param('fields', FIELDS_HELP)
     @taskNameSpace.marshal_with(TaskModel)
     def get(self, id):
         '''Get task by ID'''
-        task = Task.query.get_or_404(id)
+        task = Task.query.options(*serialize_loaders(Task, requested_fields())).get_or_404(id)
         return task.serialize()
 
     @taskNameSpace.doc('UpdateTask')
@@ -182,9 +191,9 @@ class TaskResource(Resource):
     @taskNameSpace.doc('DeleteTask')
     @taskNameSpace.response(204, 'Task deleted')
     def delete(self, id):
-        '''Delete task by ID'''
-        task = Task.query.get_or_404(id)
-        db.session.delete(task)
+        '''Delete task by ID, with its subtasks'''
+        if not tombstone_tasks(Task.Id == id):
+            taskNameSpace.abort(404, 'Task not found')
         db.session.commit()
         return '', 204
 @taskNameSpace.route('/Company/<int:companyId>')
@@ -192,18 +201,27 @@ class TaskResource(Resource):
 @taskNameSpace.param('companyId', 'The company identifier')
 class TasksByCompany(Resource):
     @taskNameSpace.doc('GetTasksByCompany')
+    @taskNameSpace.param('readPath', 'Force the orm or projection read path')
+    @taskNameSpace.expect(pageParams)
+    @taskNameSpace.param('fields', FIELDS_HELP)
     @taskNameSpace.marshal_list_with(TaskModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all tasks filtered by company ID"""
-        tasks = Task.query.join(User, Task.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
-        return [task.serialize() for task in tasks]
+        if use_projection('TasksByCompany'):
+            rows, headers = paginate(select_tasks_by_company(companyId), Task.Id, execute=fetch_rows)
+            return [serialize_task_row(row) for row in rows], 200, headers
+        tasks, headers = paginate(Task.query.options(*serialize_loaders(Task, requested_fields())).join(User, Task.CreatedBy == User.Id).filter(User.CompanyId == companyId), Task.Id)
+        return [task.serialize() for task in tasks], 200, headers
 
 @taskNameSpace.route('/Workspace/<int:workspaceId>')
 @taskNameSpace.response(404, 'No task found for this workspace')
 @taskNameSpace.param('workspaceId', 'The workspace identifier')
 class TasksByWorkspace(Resource):
     @taskNameSpace.doc('GetTasksByWorkspace')
+    @taskNameSpace.param('fields', FIELDS_HELP)
     @taskNameSpace.marshal_list_with(TaskModel)
+    @query_budget(2)
     def get(self, workspaceId):
         """List all tasks filtered by workspace ID"""
         from models import Page
@@ -214,7 +232,7 @@ class TasksByWorkspace(Resource):
         if not page_ids:
             return [], 200  # Return empty list if no pages in workspace
             
-        tasks = Task.query.filter(Task.PageId.in_(page_ids)).all()
+        tasks = Task.query.options(*serialize_loaders(Task, requested_fields())).filter(Task.PageId.in_(page_ids)).all()
         return [task.serialize() for task in tasks]
 @taskNameSpace.route('/Favourite')
 class TasksFavourite(Resource):
@@ -240,12 +258,14 @@ class TasksFavourite(Resource):
     @taskNameSpace.doc('GetFavouriteTasksForUser')
     @taskNameSpace.param('userId', 'User ID to fetch favourite tasks')
     @taskNameSpace.param('taskId', 'Task ID to fetch a specific favourite task (optional)')
+    @query_budget(1)
     def get(self):
         '''Retrieve favourite tasks for a specific user and optionally a specific task'''
         user_id = request.args.get('userId', type=int)
         task_id = request.args.get('taskId', type=int)
 
-        query = FavoriteTasks.query
+        # Through the task, which leaves out deleted ones
+        query = FavoriteTasks.query.options(*serialize_loaders(FavoriteTasks, requested_fields())).join(Task, FavoriteTasks.TaskId == Task.Id)
         if user_id:
             query = query.filter_by(UserId=user_id)
 
@@ -302,12 +322,13 @@ class TasksPinned(Resource):
     @taskNameSpace.doc('GetPinnedTasksForUser')
     @taskNameSpace.param('userId', 'User ID to fetch pinned tasks')
     @taskNameSpace.param('taskId', 'Task ID to fetch a specific pinned task (optional)')
+    @query_budget(1)
     def get(self):
         '''Retrieve pinned tasks for a specific user and optionally a specific task'''
         user_id = request.args.get('userId', type=int)
         task_id = request.args.get('taskId', type=int)
 
-        query = PinnedTasks.query
+        query = PinnedTasks.query.options(*serialize_loaders(PinnedTasks, requested_fields())).join(Task, PinnedTasks.TaskId == Task.Id)
         if user_id:
             query = query.filter_by(UserId=user_id)
 
@@ -344,10 +365,11 @@ class TasksPinned(Resource):
 @taskNameSpace.route('/<int:task_id>/workspaces')
 class WorkspacesForTask(Resource):
     @taskNameSpace.doc('GetWorkspacesForTask')
+    @query_budget(1)
     def get(self, task_id):
         """Get all workspaces that were created from this task"""
         from models import Workspace
-        workspaces = Workspace.query.filter_by(CreatedFromTaskId=task_id).all()
+        workspaces = Workspace.query.options(*serialize_loaders(Workspace, requested_fields())).filter_by(CreatedFromTaskId=task_id).all()
         return [ws.serialize() for ws in workspaces], 200
 
     @taskNameSpace.doc('CreateWorkspaceFromTask')
@@ -382,13 +404,15 @@ class WorkspacesForTask(Resource):
 @taskNameSpace.route('/today')
 class TasksToday(Resource):
     @taskNameSpace.doc('GetTasksForToday')
+    @taskNameSpace.param('fields', FIELDS_HELP)
     @taskNameSpace.marshal_list_with(TaskModel)
+    @query_budget(1)
     def get(self):
         '''List all tasks for the current date'''
         today = date.today()
         
         # Query tasks where DueDate equals today's date
-        tasks = Task.query.filter(Task.DueDate == today).all()
+        tasks = Task.query.options(*serialize_loaders(Task, requested_fields())).filter(Task.DueDate == today).all()
         
         return [task.serialize() for task in tasks]
 
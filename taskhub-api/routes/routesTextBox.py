@@ -3,6 +3,11 @@ from flask import  request
 from flask_restx import Resource, fields
 from app import app, db, api, textBoxNameSpace
 from models import TextBox, User
+from loaders import serialize_loaders
+from fieldsets import requested_fields, FIELDS_HELP
+from queryStats import query_budget
+from pagination import paginate, pageParams
+from tombstones import tombstone
 TextBoxModel = textBoxNameSpace.model('Note', {
     'id': fields.Integer(readOnly=True, description='The note unique identifier'),
     'text': fields.String(required=True, description='The note text'),
@@ -24,11 +29,13 @@ textBoxFilterParams.add_argument('pageId', type=int, required=False, help='The p
 class TextBoxes(Resource):
     @textBoxNameSpace.doc('ListTextBoxes')
     @textBoxNameSpace.expect(textBoxFilterParams)
+    @textBoxNameSpace.param('fields', FIELDS_HELP)
     @textBoxNameSpace.marshal_list_with(TextBoxModel)
+    @query_budget(1)
     def get(self):
         """List all  text boxes"""
         pageId = request.args.get('pageId')
-        query = TextBox.query
+        query = TextBox.query.options(*serialize_loaders(TextBox, requested_fields()))
         if pageId:
             query = query.filter_by(PageId=pageId)
         notes = query.all()
@@ -57,10 +64,11 @@ class TextBoxes(Resource):
 @textBoxNameSpace.param('id', 'The textbox identifier')
 class TextBoxResource(Resource):
     @textBoxNameSpace.doc('get_textox')
+    @textBoxNameSpace.param('fields', FIELDS_HELP)
     @textBoxNameSpace.marshal_with(TextBoxModel)
     def get(self, id):
         """Fetch a textboxes given its identifier"""
-        note = TextBox.query.get_or_404(id)
+        note = TextBox.query.options(*serialize_loaders(TextBox, requested_fields())).get_or_404(id)
         return note.serialize()
 
     @textBoxNameSpace.doc('update_textbox')
@@ -81,8 +89,8 @@ class TextBoxResource(Resource):
     @textBoxNameSpace.response(204, 'TextBox deleted')
     def delete(self, id):
         """Delete a textbox given its identifier"""
-        textbox = TextBox.query.get_or_404(id)
-        db.session.delete(textbox)
+        if not tombstone(TextBox, TextBox.Id == id):
+            textBoxNameSpace.abort(404, 'Textbox not found')
         db.session.commit()
         return '', 204
 @textBoxNameSpace.route('/Company/<int:companyId>')
@@ -90,13 +98,16 @@ class TextBoxResource(Resource):
 @textBoxNameSpace.param('companyId', 'The note identifier')
 class TextBoxByCompany(Resource):
     @textBoxNameSpace.doc('GetTextBoxByCompany')
+    @textBoxNameSpace.expect(pageParams)
+    @textBoxNameSpace.param('fields', FIELDS_HELP)
     @textBoxNameSpace.marshal_list_with(TextBoxModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all textboxes filtered by company ID"""
-        textboxes = TextBox.query.join(User, TextBox.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        textboxes, headers = paginate(TextBox.query.options(*serialize_loaders(TextBox, requested_fields())).join(User, TextBox.CreatedBy == User.Id).filter(User.CompanyId == companyId), TextBox.Id)
         if not textboxes:
             textBoxNameSpace.abort(404, "No notes found for this company")
-        return [note.serialize() for note in textboxes]
+        return [note.serialize() for note in textboxes], 200, headers
 @textBoxNameSpace.route('/order')
 class TextBoxOrder(Resource):
     @textBoxNameSpace.doc('TextBoxOrder')
@@ -4,6 +4,10 @@ from flask_restx import Api, Resource, fields
 from sqlalchemy import null
 from app import app, db, api, urlNameSpace
 from models import Url, User
+from loaders import serialize_loaders
+from queryStats import query_budget
+from pagination import paginate, pageParams
+from tombstones import tombstone
 
 
 UrlModel = urlNameSpace.model('Url', {
@@ -20,11 +24,13 @@ UrlModel = urlNameSpace.model('Url', {
 @urlNameSpace.route('/')
 class Urls(Resource):
     @urlNameSpace.doc('ListUrls')
+    @urlNameSpace.expect(pageParams)
     @urlNameSpace.marshal_list_with(UrlModel)
+    @query_budget(1)
     def get(self):
         """List all urls"""
-        urls = Url.query.all()
-        return [url.serialize() for url in urls]
+        urls, headers = paginate(Url.query.options(*serialize_loaders(Url)), Url.Id)
+        return [url.serialize() for url in urls], 200, headers
 
     @urlNameSpace.doc('CreateUrl')
     @urlNameSpace.expect(UrlModel)
@@ -72,8 +78,8 @@ class UrlResource(Resource):
     @urlNameSpace.response(204, 'Url deleted')
     def delete(self, id):
         """Delete a url given its identifier"""
-        url = Url.query.get_or_404(id)
-        db.session.delete(url)
+        if not tombstone(Url, Url.Id == id):
+            urlNameSpace.abort(404, 'Url not found')
         db.session.commit()
         return '', 204
 @urlNameSpace.route('/Company/<int:companyId>')
@@ -81,12 +87,14 @@ class UrlResource(Resource):
 @urlNameSpace.param('companyId', 'The company identifier')
 class UrlsByCompany(Resource):
     @urlNameSpace.doc('GetUrlsByCompany')
+    @urlNameSpace.expect(pageParams)
     @urlNameSpace.marshal_list_with(UrlModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all urls filtered by company ID"""
-        urls = Url.query.join(User, Url.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        urls, headers = paginate(Url.query.options(*serialize_loaders(Url)).join(User, Url.CreatedBy == User.Id).filter(User.CompanyId == companyId), Url.Id)
     
-        return [url.serialize() for url in urls]
+        return [url.serialize() for url in urls], 200, headers
 
 @urlNameSpace.route('/Folder/<int:folderId>')
 @urlNameSpace.response(404, 'No urls found for this folder')
@@ -94,9 +102,10 @@ class UrlsByCompany(Resource):
 class UrlsByFolder(Resource):
     @urlNameSpace.doc('GetUrlsByFolder')
     @urlNameSpace.marshal_list_with(UrlModel)
+    @query_budget(1)
     def get(self, folderId):
         """List all urls filtered by folder ID"""
-        urls = Url.query.filter(Url.FolderId == folderId).all()
+        urls = Url.query.options(*serialize_loaders(Url)).filter(Url.FolderId == folderId).all()
         return [url.serialize() for url in urls]
     
 # Add resources to namespace
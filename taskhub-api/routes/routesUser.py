@@ -4,6 +4,9 @@ from flask import Flask, request, jsonify
 from flask_restx import Api, Resource, fields
 from app import app, db, api, userNameSpace
 from models import User
+from loaders import serialize_loaders
+from queryStats import query_budget
+from nameCache import displayNames
 from werkzeug.security import generate_password_hash
 
 import stripe
@@ -35,9 +38,10 @@ class Users(Resource):
     @userNameSpace.doc('ListUsers')
     @userNameSpace.expect(userFilterParams)
     @userNameSpace.marshal_list_with(UserDtoModel)
+    @query_budget(1)
     def get(self):
         """List all users"""
-        query = User.query
+        query = User.query.options(*serialize_loaders(User))
 
         searchQuery = request.args.get('searchQuery')
         companyId = request.args.get('companyId')
@@ -116,6 +120,7 @@ class UserResource(Resource):
         user.CompanyId = data.get('companyId', user.CompanyId)
         user.ExternalUsername = data.get('externalUsername', user.ExternalUsername)
         db.session.commit()
+        displayNames.invalidate(id)
         return user.serialize()
 
     @userNameSpace.doc('DeleteUser')
@@ -125,6 +130,7 @@ class UserResource(Resource):
         user = User.query.get_or_404(id)
         db.session.delete(user)
         db.session.commit()
+        displayNames.invalidate(id)
         return '', 204
 @userNameSpace.route('/username/<string:username>')
 @userNameSpace.response(404, 'User not found')
@@ -5,6 +5,12 @@ from sqlalchemy import null, or_
 from app import app, db, api, vaultNameSpace
 from models import Vault, User, Folder, Collaboration, File, Url, Workspace, Page, Task, TextBox, Card, CardConnection, Image, FavoriteTasks, PinnedTasks
 from sqlalchemy import and_
+from loaders import serialize_loaders
+from zipExport import zip_response, vault_export_entries
+from deletionJobs import schedule_vault_delete
+from jobs import job_response
+from queryStats import query_budget
+from pagination import paginate, pageParams
 
 
 VaultModel = vaultNameSpace.model('Vault', {
@@ -26,9 +32,10 @@ vaultFilterParams.add_argument('userId', type=int, required=False, help='user Id
 class Vaults(Resource):
     @vaultNameSpace.doc('ListVaults')
     @vaultNameSpace.marshal_list_with(VaultModel)
+    @query_budget(1)
     def get(self):
         """List all vaults"""
-        query = Vault.query
+        query = Vault.query.options(*serialize_loaders(Vault))
         userId = request.args.get('userId')
         if userId is not None:
             subq = db.session.query(Collaboration.VaultId).filter_by(UserId=userId)
@@ -88,98 +95,26 @@ class VaultResource(Resource):
         return vault.serialize()
 
     @vaultNameSpace.doc('DeleteVault')
-    @vaultNameSpace.response(204, 'Vault deleted successfully')
+    @vaultNameSpace.response(202, 'Vault hidden and queued for deletion; poll the returned job')
     @vaultNameSpace.response(404, 'Vault not found')
-    @vaultNameSpace.response(500, 'Internal server error during deletion')
     def delete(self, id):
-        """Delete a vault and all its related data"""
-        try:
-            # Get the vault
-            vault = Vault.query.get(id)
-            if not vault:
-                return {'message': 'Vault not found'}, 404
-
-            # Clear CreatedFromTaskId and CreatedFromCardId references in Workspaces
-            # to prevent foreign key constraint violations
-            workspaces_in_vault = db.session.query(Workspace).join(Folder).filter(Folder.VaultId == id).all()
-            for workspace in workspaces_in_vault:
-                workspace.CreatedFromTaskId = None
-                workspace.CreatedFromCardId = None
-
-            # Delete FavoriteTasks and PinnedTasks associated with tasks in this vault
-            tasks_in_vault = db.session.query(Task).join(Page).join(Workspace).join(Folder).filter(Folder.VaultId == id).all()
-            for task in tasks_in_vault:
-                # Delete FavoriteTasks
-                FavoriteTasks.query.filter_by(TaskId=task.Id).delete()
-                # Delete PinnedTasks
-                PinnedTasks.query.filter_by(TaskId=task.Id).delete()
-
-            # Delete CardConnections associated with cards in this vault
-            cards_in_vault = db.session.query(Card).join(Page).join(Workspace).join(Folder).filter(Folder.VaultId == id).all()
-            for card in cards_in_vault:
-                # Delete connections where this card is the source or target
-                CardConnection.query.filter(
-                    (CardConnection.FromCardId == card.Id) | 
-                    (CardConnection.ToCardId == card.Id)
-                ).delete(synchronize_session=False)
-
-            # Delete files that reference pages in this vault
-            # First get all page IDs in this vault
-            page_ids = [page.Id for page in db.session.query(Page).join(Workspace).join(Folder).filter(Folder.VaultId == id).all()]
-            app.logger.info(f"Found {len(page_ids)} pages in vault {id}: {page_ids}")
-            
-            # Delete all files that reference any of these pages - delete individually to ensure proper removal
-            if page_ids:
-                files_to_delete = File.query.filter(File.PageId.in_(page_ids)).all()
-                app.logger.info(f"Found {len(files_to_delete)} files to delete referencing pages")
-                for file in files_to_delete:
-                    app.logger.info(f"Deleting file {file.Id} ({file.Name}) referencing PageId {file.PageId}")
-                    db.session.delete(file)
-            
-            # Also delete files that have WorkspaceId in this vault
-            workspace_ids = [ws.Id for ws in db.session.query(Workspace).join(Folder).filter(Folder.VaultId == id).all()]
-            if workspace_ids:
-                workspace_files_to_delete = File.query.filter(File.WorkspaceId.in_(workspace_ids)).all()
-                app.logger.info(f"Found {len(workspace_files_to_delete)} files to delete referencing workspaces")
-                for file in workspace_files_to_delete:
-                    app.logger.info(f"Deleting file {file.Id} ({file.Name}) referencing WorkspaceId {file.WorkspaceId}")
-                    db.session.delete(file)
-            
-            # Commit file deletions to ensure foreign key constraints are satisfied
-            db.session.commit()
-            app.logger.info(f"Committed file deletions for vault {id}")
-            
-            # Verify all files are deleted before proceeding
-            remaining_files = File.query.filter(File.PageId.in_(page_ids) if page_ids else False).count()
-            if remaining_files > 0:
-                app.logger.error(f"Still {remaining_files} files referencing pages after deletion attempt")
-                raise Exception(f"Failed to delete all files: {remaining_files} files still reference pages in vault")
-
-            # Flush changes before deleting the vault to ensure foreign key references are cleared
-            db.session.flush()
-            
-            # Delete the vault - SQLAlchemy cascade will handle all related entities
-            db.session.delete(vault)
-            db.session.commit()
-            
-            return {'message': 'Vault and all related data deleted successfully'}, 200
-            
-        except Exception as e:
-            db.session.rollback()
-            app.logger.error(f"Error deleting vault {id}: {str(e)}")
-            return {'message': f'Error deleting vault: {str(e)}'}, 500
+        """Hide a vault at once and delete it with all its related data in a background job"""
+        Vault.query.get_or_404(id)
+        return job_response(schedule_vault_delete(id))
 @vaultNameSpace.route('/Company/<int:companyId>')
 @vaultNameSpace.response(404, 'No vaults found for this company')
 @vaultNameSpace.param('companyId', 'The company identifier')
 class VaultsByCompany(Resource):
     @vaultNameSpace.doc('GetVaultsByCompany')
+    @vaultNameSpace.expect(pageParams)
     @vaultNameSpace.marshal_list_with(VaultModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all vaults filtered by company ID"""
-        vaults = Vault.query.join(User, Vault.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        vaults, headers = paginate(Vault.query.options(*serialize_loaders(Vault)).join(User, Vault.CreatedBy == User.Id).filter(User.CompanyId == companyId), Vault.Id)
         if not vaults:
             vaultNameSpace.abort(404, "No vaults found for this company")
-        return [vault.serialize() for vault in vaults]
+        return [vault.serialize() for vault in vaults], 200, headers
 
 @vaultNameSpace.route('/<int:id>/test-tasks')
 @vaultNameSpace.param('id', 'The vault identifier')
@@ -220,6 +155,17 @@ class VaultTaskTest(Resource):
                 'status': 'error'
             }, 500
 
+@vaultNameSpace.route('/<int:id>/export')
+@vaultNameSpace.response(404, 'Vault not found')
+@vaultNameSpace.param('id', 'The vault identifier')
+class VaultExport(Resource):
+    @vaultNameSpace.doc('ExportVault')
+    @vaultNameSpace.produces(['application/zip'])
+    def get(self, id):
+        """Download all files in the vault as a zip archive, streamed as it is built"""
+        vault = Vault.query.get_or_404(id)
+        return zip_response(vault_export_entries(vault), vault.Name)
+
 # Resources are automatically registered with the namespace via decorators
 # The namespace is added to the API in app.py
 if __name__ == '__main__':
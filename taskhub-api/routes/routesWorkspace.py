@@ -4,6 +4,13 @@ from flask_restx import Api, Resource, fields
 from sqlalchemy import null
 from app import app, db, api, workspaceNameSpace
 from models import Workspace, User, Page
+from loaders import serialize_loaders
+from fieldsets import requested_fields, FIELDS_HELP
+from zipExport import zip_response, workspace_export_entries
+from deletionJobs import schedule_workspace_delete
+from jobs import job_response
+from queryStats import query_budget
+from pagination import paginate, pageParams
 
 WorkspaceModel = workspaceNameSpace.model('Workspace', {
     'id': fields.Integer(readOnly=True, description='The workspace unique identifier'),
@@ -21,11 +28,14 @@ WorkspaceModel = workspaceNameSpace.model('Workspace', {
 @workspaceNameSpace.route('/')
 class Workspaces(Resource):
     @workspaceNameSpace.doc('ListWorkspaces')
+    @workspaceNameSpace.expect(pageParams)
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_list_with(WorkspaceModel)
+    @query_budget(1)
     def get(self):
         """List all workspaces"""
-        workspaces = Workspace.query.all()
-        return [workspace.serialize() for workspace in workspaces]
+        workspaces, headers = paginate(Workspace.query.options(*serialize_loaders(Workspace, requested_fields())), Workspace.Id)
+        return [workspace.serialize() for workspace in workspaces], 200, headers
 
     @workspaceNameSpace.doc('CreateWorkspace')
     @workspaceNameSpace.expect(WorkspaceModel)
@@ -76,10 +86,11 @@ class Workspaces(Resource):
 @workspaceNameSpace.param('id', 'The workspace identifier')
 class WorkspaceResource(Resource):
     @workspaceNameSpace.doc('GetWorkspace')
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_with(WorkspaceModel)
     def get(self, id):
         """Fetch a workspace given its identifier"""
-        workspace = Workspace.query.get_or_404(id)
+        workspace = Workspace.query.options(*serialize_loaders(Workspace, requested_fields())).get_or_404(id)
         return workspace.serialize()
 
     @workspaceNameSpace.doc('UpdateWorkspace')
@@ -102,40 +113,44 @@ class WorkspaceResource(Resource):
         return workspace.serialize()
 
     @workspaceNameSpace.doc('DeleteWorkspace')
-    @workspaceNameSpace.response(204, 'Workspace deleted')
+    @workspaceNameSpace.response(202, 'Workspace hidden and queued for deletion; poll the returned job')
     def delete(self, id):
-        """Delete a workspace given its identifier"""
-        workspace = Workspace.query.get_or_404(id)
-        db.session.delete(workspace)
-        db.session.commit()
-        return '', 204
+        """Hide a workspace at once and delete it with its pages in a background job"""
+        Workspace.query.get_or_404(id)
+        return job_response(schedule_workspace_delete(id))
 
 @workspaceNameSpace.route('/Company/<int:companyId>')
 @workspaceNameSpace.response(404, 'No workspaces found for this company')
 @workspaceNameSpace.param('companyId', 'The company identifier')
 class WorkspacesByCompany(Resource):
     @workspaceNameSpace.doc('GetWorkspacesByCompany')
+    @workspaceNameSpace.expect(pageParams)
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_list_with(WorkspaceModel)
+    @query_budget(1)
     def get(self, companyId):
         """List all workspaces filtered by company ID"""
-        workspaces = Workspace.query.join(User, Workspace.CreatedBy == User.Id).filter(User.CompanyId == companyId).all()
+        workspaces, headers = paginate(Workspace.query.options(*serialize_loaders(Workspace, requested_fields())).join(User, Workspace.CreatedBy == User.Id).filter(User.CompanyId == companyId), Workspace.Id)
         if not workspaces:
             workspaceNameSpace.abort(404, "No workspaces found for this company")
-        return [workspace.serialize() for workspace in workspaces]
+        return [workspace.serialize() for workspace in workspaces], 200, headers
 
 @workspaceNameSpace.route('/NotFromTask')
 class WorkspacesNotFromTask(Resource):
     @workspaceNameSpace.doc('GetWorkspacesNotCreatedFromTask')
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_list_with(WorkspaceModel)
+    @query_budget(1)
     def get(self):
         """Get all workspaces NOT created from a task"""
-        workspaces = Workspace.query.filter(Workspace.CreatedFromTask.is_(False)).all()
+        workspaces = Workspace.query.options(*serialize_loaders(Workspace, requested_fields())).filter(Workspace.CreatedFromTask.is_(False)).all()
         return [ws.serialize() for ws in workspaces]
 @workspaceNameSpace.route('/FromTask/<int:task_id>')
 @workspaceNameSpace.response(404, 'No workspaces found for this task')
 @workspaceNameSpace.param('task_id', 'The task ID')
 class WorkspacesFromTask(Resource):
     @workspaceNameSpace.doc('GetWorkspacesCreatedFromSpecificTask')
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_with(WorkspaceModel)
     def get(self, task_id):
         """Get all workspaces that were created from a specific task"""
@@ -151,6 +166,7 @@ class WorkspacesFromTask(Resource):
 @workspaceNameSpace.param('card_id', 'The card ID')
 class WorkspacesFromCard(Resource):
     @workspaceNameSpace.doc('GetWorkspacesCreatedFromSpecificCard')
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_with(WorkspaceModel)
     def get(self, card_id):
         """Get all workspaces that were created from a specific card"""
@@ -166,7 +182,9 @@ class WorkspacesFromCard(Resource):
 @workspaceNameSpace.param('vault_id', 'The vault identifier')
 class WorkspacesByVault(Resource):
     @workspaceNameSpace.doc('GetWorkspacesByVault')
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_list_with(WorkspaceModel)
+    @query_budget(2)
     def get(self, vault_id):
         """Get all workspaces that belong to a specific vault"""
         # Get all folders in the vault
@@ -175,7 +193,7 @@ class WorkspacesByVault(Resource):
         folder_ids = [folder.Id for folder in folders]
         
         # Get all workspaces in those folders
-        workspaces = Workspace.query.filter(Workspace.FolderId.in_(folder_ids)).all()
+        workspaces = Workspace.query.options(*serialize_loaders(Workspace, requested_fields())).filter(Workspace.FolderId.in_(folder_ids)).all()
         
         return [workspace.serialize() for workspace in workspaces]
 
@@ -184,7 +202,9 @@ class WorkspacesByVault(Resource):
 @workspaceNameSpace.param('vault_id', 'The vault identifier')
 class WorkspacesByVaultFromTask(Resource):
     @workspaceNameSpace.doc('GetWorkspacesByVaultCreatedFromTask')
+    @workspaceNameSpace.param('fields', FIELDS_HELP)
     @workspaceNameSpace.marshal_list_with(WorkspaceModel)
+    @query_budget(2)
     def get(self, vault_id):
         """Get all workspaces that belong to a specific vault and were created from a task"""
         # Get all folders in the vault
@@ -193,12 +213,24 @@ class WorkspacesByVaultFromTask(Resource):
         folder_ids = [folder.Id for folder in folders]
         
         # Get all workspaces in those folders that were created from a task
-        workspaces = Workspace.query.filter(
+        workspaces = Workspace.query.options(*serialize_loaders(Workspace, requested_fields())).filter(
             Workspace.FolderId.in_(folder_ids),
             Workspace.CreatedFromTask == True
         ).all()
         
         return [workspace.serialize() for workspace in workspaces]
+
+@workspaceNameSpace.route('/<int:id>/export')
+@workspaceNameSpace.response(404, 'Workspace not found')
+@workspaceNameSpace.param('id', 'The workspace identifier')
+class WorkspaceExport(Resource):
+    @workspaceNameSpace.doc('ExportWorkspace')
+    @workspaceNameSpace.produces(['application/zip'])
+    def get(self, id):
+        """Download all files in the workspace as a zip archive, streamed as it is built"""
+        workspace = Workspace.query.get_or_404(id)
+        return zip_response(workspace_export_entries(workspace), workspace.Name)
+
 # Register resources
 workspaceNameSpace.add_resource(Workspaces, '/')
 workspaceNameSpace.add_resource(WorkspaceResource, '/<int:id>')
@@ -208,6 +240,7 @@ workspaceNameSpace.add_resource(WorkspacesFromTask, '/FromTask/<int:task_id>')
 workspaceNameSpace.add_resource(WorkspacesFromCard, '/FromCard/<int:card_id>')
 workspaceNameSpace.add_resource(WorkspacesByVault, '/Vault/<int:vault_id>')
 workspaceNameSpace.add_resource(WorkspacesByVaultFromTask, '/Vault/<int:vault_id>/FromTask')
+workspaceNameSpace.add_resource(WorkspaceExport, '/<int:id>/export')
 
 api.add_namespace(workspaceNameSpace)
 
@@ -0,0 +1,255 @@
+import base64
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from flask import current_app
+
+# Where uploaded bytes are kept. The blob store (blobStore.py), image variants
+# and direct uploads address objects by key, a '/'-separated path relative to
+# the store root such as 'ab/cd/<sha256>' or 'variants/web/ab/cd/<sha256>.webp',
+# and go through storage() for every read, write and delete. STORAGE_BACKEND
+# picks the backend:
+#   'local'  files under BLOB_FOLDER on this node's disk (the default)
+#   's3'     an S3-compatible bucket (AWS, MinIO, ...) named by S3_BUCKET, with
+#            optional S3_PREFIX, S3_ENDPOINT_URL and S3_REGION; credentials come
+#            from the usual AWS environment variables or config files
+# Remote backends hand out presigned URLs, so downloads and direct uploads move
+# the bytes between client and bucket without passing through a worker.
+
+DEFAULT_BLOB_FOLDER = os.path.join('uploads', 'blobs')
+PRESIGNED_URL_EXPIRY = 3600
+COPY_READ_SIZE = 64 * 1024
+# S3 rejects multipart uploads whose parts, except the last, are smaller than this
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def blob_folder():
+    return current_app.config.get('BLOB_FOLDER', DEFAULT_BLOB_FOLDER)
+
+
+def write_atomically(path, data):
+    """Write data (bytes or a binary stream) to path through a temporary file so a reader never sees a partial file"""
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            if hasattr(data, 'read'):
+                shutil.copyfileobj(data, tmp, COPY_READ_SIZE)
+            else:
+                tmp.write(data)
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
+class LocalStorage:
+    """Objects as files under BLOB_FOLDER.
+
+    Lookups accept a legacyKey, where the object may still sit in a layout the
+    upload tooling has not migrated yet (see uploadLayout.py).
+    """
+    remote = False
+
+    def path(self, key):
+        return os.path.join(blob_folder(), *key.split('/'))
+
+    def locate(self, key, legacyKey=None):
+        """Path of a stored object, or None when it is not stored"""
+        for candidate in (key, legacyKey):
+            if candidate and os.path.isfile(self.path(candidate)):
+                return self.path(candidate)
+        return None
+
+    def location(self, key):
+        return self.path(key)
+
+    def stat(self, key, legacyKey=None):
+        """(size, modified time) of a stored object, or None"""
+        path = self.locate(key, legacyKey)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return stat.st_size, datetime.fromtimestamp(stat.st_mtime)
+
+    def checksum(self, key):
+        # Local files carry no recorded checksum; callers hash the content
+        return None
+
+    def touch(self, key, legacyKey=None):
+        """Refresh an object's modified time; False when it is not stored"""
+        path = self.locate(key, legacyKey)
+        if path is None:
+            return False
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def open(self, key, legacyKey=None):
+        path = self.locate(key, legacyKey)
+        if path is None:
+            raise FileNotFoundError(self.path(key))
+        return open(path, 'rb')
+
+    def put_stream(self, key, stream):
+        write_atomically(self.path(key), stream)
+
+    def put_file(self, key, path):
+        """Move a local file into the store"""
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+
+    def copy(self, sourceKey, key):
+        with self.open(sourceKey) as source:
+            self.put_stream(key, source)
+
+    def delete(self, key, legacyKey=None):
+        for candidate in (key, legacyKey):
+            if candidate:
+                try:
+                    os.remove(self.path(candidate))
+                except FileNotFoundError:
+                    pass
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket, under S3_PREFIX"""
+    remote = True
+
+    def __init__(self, bucket, prefix='', client=None, **clientOptions):
+        if client is None:
+            import boto3
+            client = boto3.client('s3', **clientOptions)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def object_key(self, key):
+        return self.prefix + key
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key), ChecksumMode='ENABLED')
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def locate(self, key, legacyKey=None):
+        return self.location(key) if self._head(key) is not None else None
+
+    def location(self, key):
+        return f's3://{self.bucket}/{self.object_key(key)}'
+
+    def stat(self, key, legacyKey=None):
+        head = self._head(key)
+        if head is None:
+            return None
+        return head['ContentLength'], head['LastModified'].astimezone().replace(tzinfo=None)
+
+    def checksum(self, key):
+        """Hex SHA-256 the bucket verified on upload, or None when the object was stored without one"""
+        head = self._head(key)
+        checksum = head and head.get('ChecksumSHA256')
+        # Multipart uploads report a checksum of the part checksums ('...-<parts>'), not of the content
+        if not checksum or '-' in checksum:
+            return None
+        return base64.b64decode(checksum).hex()
+
+    def touch(self, key, legacyKey=None):
+        """Whether the object is stored; its LastModified is left alone.
+
+        S3 only refreshes it by copying the object onto itself, a full copy
+        that fails past 5 GB. The sweeper of a remote store goes by the blobs
+        row instead, which blobStore refreshes on reuse.
+        """
+        return self._head(key) is not None
+
+    def open(self, key, legacyKey=None):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))['Body']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(self.location(key)) from e
+            raise
+
+    def put_stream(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self.object_key(key))
+
+    def put_file(self, key, path):
+        """Upload a local file into the store and remove it"""
+        self.client.upload_file(path, self.bucket, self.object_key(key))
+        os.remove(path)
+
+    def copy(self, sourceKey, key):
+        self.client.copy({'Bucket': self.bucket, 'Key': self.object_key(sourceKey)}, self.bucket, self.object_key(key))
+
+    def delete(self, key, legacyKey=None):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def start_multipart(self, key):
+        """Open a multipart upload of the object and return its upload id"""
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=self.object_key(key))['UploadId']
+
+    def upload_part(self, key, uploadId, partNumber, stream, size):
+        self.client.upload_part(Bucket=self.bucket, Key=self.object_key(key), UploadId=uploadId,
+                                PartNumber=partNumber, Body=stream, ContentLength=size)
+
+    def complete_multipart(self, key, uploadId):
+        """Join the uploaded parts into the object"""
+        parts = []
+        for page in self.client.get_paginator('list_parts').paginate(Bucket=self.bucket, Key=self.object_key(key), UploadId=uploadId):
+            parts += [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in page.get('Parts', [])]
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.object_key(key), UploadId=uploadId,
+                                              MultipartUpload={'Parts': parts})
+
+    def abort_multipart(self, key, uploadId):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.object_key(key), UploadId=uploadId)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+    def presigned_download(self, key, mimetype=None, downloadName=None, expiresIn=PRESIGNED_URL_EXPIRY):
+        params = {'Bucket': self.bucket, 'Key': self.object_key(key)}
+        if mimetype:
+            params['ResponseContentType'] = mimetype
+        if downloadName:
+            params['ResponseContentDisposition'] = f'inline; filename="{downloadName}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expiresIn)
+
+    def presigned_upload(self, key, checksum, size, expiresIn=PRESIGNED_URL_EXPIRY):
+        """(url, headers) for a PUT of the object; the bucket rejects bytes that do not match the SHA-256 checksum"""
+        checksumHeader = base64.b64encode(bytes.fromhex(checksum)).decode()
+        url = self.client.generate_presigned_url('put_object', ExpiresIn=expiresIn, Params={
+            'Bucket': self.bucket, 'Key': self.object_key(key), 'ContentLength': size,
+            'ChecksumSHA256': checksumHeader,
+        })
+        return url, {'Content-Length': str(size), 'x-amz-checksum-sha256': checksumHeader}
+
+
+def create_storage(config):
+    backend = config.get('STORAGE_BACKEND') or 'local'
+    if backend == 'local':
+        return LocalStorage()
+    if backend == 's3':
+        clientOptions = {'endpoint_url': config.get('S3_ENDPOINT_URL'), 'region_name': config.get('S3_REGION')}
+        return S3Storage(config['S3_BUCKET'], config.get('S3_PREFIX', ''),
+                         **{name: value for name, value in clientOptions.items() if value})
+    raise ValueError(f'Unknown STORAGE_BACKEND {backend!r}')
+
+
+def storage():
+    """The storage backend of the current app"""
+    extensions = current_app.extensions
+    if 'storage' not in extensions:
+        extensions['storage'] = create_storage(current_app.config)
+    return extensions['storage']
@@ -0,0 +1,61 @@
+import os
+from io import BytesIO
+
+from flask import request
+
+from database import db
+from models import Blob, File, Page
+from blobStore import blob_path, content_hash, store_spool
+from batchUploads import parse_batch, parse_upload, create_files
+
+
+def upload(app, files, **form):
+    data = dict(form, files=[(BytesIO(content), name) for name, content in files])
+    with app.test_request_context('/File/batch', method='POST', data=data, content_type='multipart/form-data'):
+        form, parts = parse_batch(request.environ)
+        return create_files(parts, PageId=int(form['pageId']))
+
+
+def test_batch_creates_all_files_in_one_insert(app, blobs, count_queries):
+    page = Page(Name='Docs')
+    db.session.add(page)
+    db.session.commit()
+    pageId = page.Id
+    files = [(f'doc-{i}.pdf', f'document {i}'.encode()) for i in range(20)] + [('copy.pdf', b'document 0')]
+
+    queries, results = count_queries(lambda: upload(app, files, pageId=str(pageId)))
+    # One INSERT for the files, one upsert per distinct blob, one INSERT into the change feed and its numbering
+    assert queries == 1 + 20 + 1 + 1
+    assert [result['status'] for result in results] == [201] * 21
+    assert [result['file']['name'] for result in results] == [name for name, _ in files]
+    assert File.query.count() == 21 and {file.PageId for file in File.query} == {pageId}
+
+    first = content_hash(b'document 0')
+    assert results[0]['file']['path'] == results[-1]['file']['path'] == blob_path(first)
+    assert db.session.get(Blob, first).RefCount == 2
+    with open(blob_path(first), 'rb') as stored:
+        assert stored.read() == b'document 0'
+    # Nothing is left behind in the spool files
+    assert not [name for name in os.listdir(blobs) if name.startswith('.upload-')]
+
+
+def test_batch_reports_each_file(app, blobs):
+    results = upload(app, [('notes.txt', b'notes'), ('', b'unnamed')], pageId='1')
+    assert results[0]['status'] == 201 and results[0]['file']['size'] == 5
+    assert results[1] == {'name': None, 'status': 400, 'message': 'No selected file'}
+    assert File.query.count() == 1
+    assert not [name for name in os.listdir(blobs) if name.startswith('.upload-')]
+
+
+def test_single_upload_is_hashed_while_it_is_received(app, blobs):
+    data = {'file': (BytesIO(b'quarterly report'), 'report.pdf'), 'name': 'report.pdf'}
+    with app.test_request_context('/File/', method='POST', data=data, content_type='multipart/form-data'):
+        form, files = parse_upload(request.environ)
+        spool = files['file'].stream
+        # Hashed as Werkzeug wrote it, then moved into place without reading it again
+        assert spool.hexdigest() == content_hash(b'quarterly report')
+        assert store_spool(spool) == (content_hash(b'quarterly report'), 16)
+    assert form['name'] == 'report.pdf'
+    with open(blob_path(content_hash(b'quarterly report')), 'rb') as stored:
+        assert stored.read() == b'quarterly report'
+    assert not [name for name in os.listdir(blobs) if name.startswith('.upload-')]
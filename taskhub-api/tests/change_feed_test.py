@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, func
+
+from database import db
+from models import Vault, Folder, Workspace, Page, Task, Card, User, Company, Collaboration, Change
+from changeFeed import read_changes, cursor_before, record_changes
+from tombstones import tombstone, purge_tombstones
+from treeDeletes import delete_vault
+
+
+def build_vault(name, createdBy=None):
+    page = Page(Name=f'{name}-page', Workspace=Workspace(Name=f'{name}-ws', Folder=Folder(Name=name, Vault=Vault(Name=name, CreatedBy=createdBy))))
+    db.session.add_all([Task(Title=f'{name}-task', Page=page), Card(Name=f'{name}-card', Page=page)])
+    db.session.commit()
+    return page
+
+
+def test_feed_has_every_change_once_per_row(app):
+    first = read_changes(None)
+    assert first['reset'] and first['changes'] == [] and first['cursor'] == 0
+
+    page = build_vault('vault')
+    cursor = first['cursor']
+    task = Task.query.one()
+    task.Title = 'renamed'
+    db.session.commit()
+    tombstone(Card, Card.Id == Card.query.one().Id)
+    db.session.commit()
+
+    result = read_changes(cursor)
+    assert not result['reset'] and not result['hasMore']
+    changes = {(change['type'], change['id']): change for change in result['changes']}
+    assert len(changes) == len(result['changes']) == 6
+    assert changes['Task', task.Id]['data']['title'] == 'renamed'
+    assert changes['Page', page.Id]['data']['vaultId'] == page.Workspace.Folder.VaultId
+    assert [change['type'] for change in result['changes'] if change['deleted']] == ['Card']
+    # Rows come where they last changed: the renamed task and the deleted card come last
+    assert [change['type'] for change in result['changes'][-2:]] == ['Task', 'Card']
+    assert read_changes(result['cursor']) == {'changes': [], 'cursor': result['cursor'], 'hasMore': False, 'reset': False}
+
+    # The same changes in bounded pages
+    seen = set()
+    while True:
+        result = read_changes(cursor, limit=3)
+        assert len(result['changes']) <= 3
+        seen.update((change['type'], change['id']) for change in result['changes'])
+        cursor = result['cursor']
+        if not result['hasMore']:
+            break
+    assert seen == set(changes)
+
+
+def test_feed_follows_the_vaults_of_a_user(app):
+    company = Company(Name='acme')
+    user = User(Username='owner', Company=company)
+    colleague = User(Username='colleague', Company=company)
+    other = User(Username='other', Company=Company(Name='globex'))
+    db.session.add_all([user, colleague, other])
+    db.session.commit()
+    cursor = read_changes(None)['cursor']
+    build_vault('mine', createdBy=user.Id)
+    shared = build_vault('shared', createdBy=other.Id)
+    build_vault('theirs', createdBy=other.Id)
+    db.session.add_all([Collaboration(VaultId=shared.Workspace.Folder.VaultId, UserId=user.Id),
+                        Task(Title='loose', CreatedBy=colleague.Id), Task(Title='elsewhere', CreatedBy=other.Id),
+                        Task(Title='nobody')])
+    db.session.commit()
+
+    titles = {change['data']['title'] for change in read_changes(cursor, userId=user.Id)['changes']
+              if change['type'] == 'Task'}
+    # Rows outside any vault only from the user's own company
+    assert titles == {'mine-task', 'shared-task', 'loose'}
+    assert len([change for change in read_changes(cursor)['changes'] if change['type'] == 'Task']) == 6
+
+
+def test_bulk_updates_outside_a_deleted_tree_are_in_the_feed(app):
+    page = build_vault('doomed')
+    vaultId = page.Workspace.Folder.VaultId
+    spinOff = Workspace(Name='spin-off', CreatedFromTaskId=Task.query.one().Id)
+    db.session.add(spinOff)
+    db.session.commit()
+    cursor = read_changes(None)['cursor']
+
+    delete_vault(vaultId)
+    db.session.commit()
+    changes = read_changes(cursor)['changes']
+    assert [(change['type'], change['id']) for change in changes] == [('Workspace', spinOff.Id)]
+    assert changes[0]['data']['createdFromTaskId'] is None
+
+
+def test_changes_are_numbered_when_they_commit(app):
+    page = build_vault('vault')
+    cursor = read_changes(None)['cursor']
+    db.session.add(Task(Title='pending', Page=page))
+    db.session.flush()
+    # Recorded at the flush, but without a number until the commit, so no page passes it
+    assert Change.query.filter(Change.Seq.is_(None)).count() == 1
+    assert read_changes(cursor) == {'changes': [], 'cursor': cursor, 'hasMore': False, 'reset': False}
+    db.session.commit()
+    result = read_changes(cursor)
+    assert [change['data']['title'] for change in result['changes']] == ['pending'] and result['cursor'] == cursor + 1
+
+    # Committed last, so numbered last, although made long before the others
+    record_changes(db.session, Vault, Vault.Id == page.Workspace.Folder.VaultId, datetime.now() - timedelta(hours=1))
+    db.session.commit()
+    # The cursor for a moment stays behind every change made after it
+    assert cursor_before(datetime.now() - timedelta(minutes=30)) == 0
+    assert cursor_before(datetime.now()) == cursor + 2
+    assert cursor_before(datetime.now() - timedelta(hours=2)) is None
+
+
+def test_trimmed_feed_resets_old_cursors(app):
+    build_vault('vault')
+    tombstone(Task, Task.Title == 'vault-task')
+    db.session.commit()
+    newest = db.session.query(func.max(Change.Seq)).scalar()
+    db.session.execute(update(Change).values(ChangedDateTime=datetime.now() - timedelta(days=30)))
+    db.session.execute(update(Task).values(DeletedAt=datetime.now() - timedelta(days=30))
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+
+    counts = purge_tombstones()
+    # The newest change stays, so the sequence can be told apart from an empty one
+    assert counts['tasks'] == 1 and counts['changes'] == newest - 1
+    assert read_changes(1) == {'changes': [], 'cursor': newest, 'hasMore': False, 'reset': True}
+    assert not read_changes(newest - 1)['reset']
+    assert cursor_before(datetime.now()) == newest
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import db  # noqa: E402
+import models  # noqa: E402,F401
+# Their session events (tombstone filter, change feed) are on in the app too
+import changeFeed  # noqa: E402,F401
+import tombstones  # noqa: E402,F401
+from nameCache import displayNames  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Bare Flask app bound to an in-memory SQLite database with all tables"""
+    testApp = Flask(__name__)
+    testApp.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    testApp.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    testApp.config['TESTING'] = True
+    # Ids restart with every database, so names cached by a previous test would be stale
+    displayNames.clear()
+    db.init_app(testApp)
+    with testApp.app_context():
+        db.create_all()
+        yield testApp
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def blobs(app, tmp_path):
+    """Local blob storage in a temporary folder, which is returned"""
+    app.config['BLOB_FOLDER'] = str(tmp_path / 'blobs')
+    return tmp_path / 'blobs'
+
+
+@pytest.fixture
+def count_queries(app):
+    """Return a callable that runs a function and reports how many statements it issued"""
+    def run(fn):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return len(statements), result
+    return run
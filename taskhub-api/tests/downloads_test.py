@@ -0,0 +1,84 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from database import db
+from models import File
+from blobStore import put_stream, blob_path
+from downloads import send_upload
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def client(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['BLOB_FOLDER'] = str(tmp_path / 'blobs')
+    os.makedirs(tmp_path / '3')
+    (tmp_path / '3' / 'report.pdf').write_bytes(CONTENT)
+
+    @app.route('/uploads/<path:pageId>/<path:filename>')
+    def download_file(pageId, filename):
+        return send_upload(os.path.join(str(tmp_path), pageId), filename, File.query.filter_by(PageId=int(pageId)))
+    return app.test_client()
+
+
+def test_strong_etag_without_reading_the_file(client, tmp_path):
+    response = client.get('/uploads/3/report.pdf')
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    # A legacy file has no hash in its name: size and modification time
+    stat = os.stat(tmp_path / '3' / 'report.pdf')
+    assert response.headers['ETag'] == f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    cached = client.get('/uploads/3/report.pdf', headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+
+
+def test_range_request(client):
+    response = client.get('/uploads/3/report.pdf', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(CONTENT)}'
+
+
+def test_missing_and_escaping_paths_are_404(client):
+    assert client.get('/uploads/3/missing.pdf').status_code == 404
+    assert client.get('/uploads/3/..%2F..%2Fsecret').status_code == 404
+
+
+def test_deduplicated_upload_is_served_from_its_blob(client):
+    contentHash, size = put_stream(BytesIO(b'shared attachment'))
+    db.session.add(File(Name='Shared notes.txt', PageId=4, Path=blob_path(contentHash), ContentHash=contentHash, Size=size))
+    db.session.commit()
+    response = client.get('/uploads/4/Shared_notes.txt')
+    assert response.status_code == 200
+    assert response.data == b'shared attachment'
+    # A blob is named after its content hash
+    assert response.headers['ETag'] == f'"{contentHash}-{size}"'
+    assert client.get('/uploads/5/Shared_notes.txt').status_code == 404
+
+
+def test_upload_lookup_matches_the_name_in_sql(client, count_queries):
+    contentHash, size = put_stream(BytesIO(b'minutes'))
+    db.session.add_all([File(Name=f'notes{i}.txt', PageId=6, Path=blob_path(contentHash), ContentHash=contentHash, Size=size)
+                        for i in range(20)])
+    db.session.commit()
+    db.session.expunge_all()
+    queries, response = count_queries(lambda: client.get('/uploads/6/notes7.txt'))
+    assert response.status_code == 200 and response.data == b'minutes'
+    # The one matching row, not every file of the page
+    assert queries == 1
+
+
+def test_accel_redirect_offload(app, client):
+    app.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+    response = client.get('/uploads/3/report.pdf')
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == '/protected-uploads/3/report.pdf'
+
+    cached = client.get('/uploads/3/report.pdf', headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+    assert 'X-Accel-Redirect' not in cached.headers
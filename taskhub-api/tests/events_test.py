@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from database import db
+from models import User, Event, UserEvents
+from loaders import serialize_loaders
+
+
+def seed(events, attendees):
+    start = datetime(2026, 1, 1, 9)
+    for i in range(events):
+        creator = User(Username=f'creator{i}', FirstName='Creator', LastName=str(i))
+        event = Event(Title=f'event{i}', CreatedByUser=creator, DateTimeFrom=start, DateTimeTo=start + timedelta(hours=1))
+        event.EventUsers = [UserEvents(User=User(Username=f'guest{i}-{j}', FirstName='Guest', LastName=f'{i}-{j}'))
+                            for j in range(attendees)]
+        db.session.add(event)
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def list_events():
+    return [event.serialize() for event in Event.query.options(*serialize_loaders(Event)).all()]
+
+
+def events_by_user(userId):
+    # As GET /Event/User/<userId> queries them
+    attending = db.session.query(UserEvents.EventId).filter(UserEvents.UserId == userId)
+    return Event.query.options(*serialize_loaders(Event)).filter(or_(Event.Id.in_(attending), Event.CreatedBy == userId)).all()
+
+
+def test_event_listing_batches_attendees(app, count_queries):
+    seed(2, 2)
+    few, _ = count_queries(list_events)
+    db.session.expunge_all()
+
+    seed(15, 6)
+    many, events = count_queries(list_events)
+    assert few == many == 2
+    event = next(event for event in events if event['title'] == 'event3')
+    assert sorted(userEvent['user'] for userEvent in event['userEvents']) == [f'Guest 3-{j}' for j in range(6)]
+
+
+def test_events_by_user_lists_an_event_once_for_its_creator_and_attendee(app):
+    user = User(Username='host', FirstName='Host', LastName='User')
+    start = datetime(2026, 1, 1, 9)
+    event = Event(Title='own', CreatedByUser=user, DateTimeFrom=start, DateTimeTo=start + timedelta(hours=1))
+    event.EventUsers = [UserEvents(User=user), UserEvents(User=User(Username='guest', FirstName='Guest', LastName='User'))]
+    other = Event(Title='invited', CreatedByUser=User(Username='other'), DateTimeFrom=start, DateTimeTo=start)
+    other.EventUsers = [UserEvents(User=user)]
+    db.session.add_all([event, other])
+    db.session.commit()
+
+    assert sorted(event.Title for event in events_by_user(user.Id)) == ['invited', 'own']
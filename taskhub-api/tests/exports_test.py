@@ -0,0 +1,99 @@
+import contextvars
+import io
+import os
+import tracemalloc
+import zipfile
+
+import pytest
+
+from database import db
+from models import Vault, Folder, Workspace, Page, File
+from blobStore import put_stream, locate_blob
+from zipExport import folder_export_entries, workspace_export_entries, vault_export_entries, stream_zip, zip_response
+
+
+@pytest.fixture
+def tree(app, tmp_path):
+    def stored(name, content):
+        path = tmp_path / name
+        path.write_bytes(content)
+        return str(path)
+
+    vault = Vault(Name='Clients')
+    root = Folder(Name='Acme', Vault=vault)
+    child = Folder(Name='Contracts', ParentFolder=root, Vault=vault)
+    grandchild = Folder(Name='2026', ParentFolder=child)
+    workspace = Workspace(Name='Launch', Folder=child)
+    page = Page(Name='Plan', Workspace=workspace)
+    db.session.add_all([
+        File(Name='logo.png', Path=stored('a', b'logo'), Folder=root),
+        File(Name='nda.pdf', Path=stored('b', b'nda'), Folder=child),
+        File(Name='nda.pdf', Path=stored('c', b'second nda'), Folder=child),
+        File(Name='q1.pdf', Path=stored('d', b'q1'), Folder=grandchild),
+        File(Name='brief.txt', Path=stored('e', b'brief'), WorkspaceId=None),
+        File(Name='gone.txt', Path=str(tmp_path / 'missing'), Folder=root),
+    ])
+    db.session.flush()
+    db.session.add_all([
+        File(Name='notes.txt', Path=stored('f', b'notes'), WorkspaceId=workspace.Id),
+        File(Name='plan.txt', Path=stored('g', b'plan'), PageId=page.Id),
+    ])
+    db.session.commit()
+    return vault, root, workspace
+
+
+def unzip(entries):
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(entries))))
+    return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_folder_export_recurses_into_children_and_workspaces(tree):
+    vault, root, workspace = tree
+    assert unzip(folder_export_entries(root)) == {
+        'Acme/logo.png': b'logo',
+        'Acme/Contracts/nda.pdf': b'nda',
+        'Acme/Contracts/nda (2).pdf': b'second nda',
+        'Acme/Contracts/2026/q1.pdf': b'q1',
+        'Acme/Contracts/Launch/notes.txt': b'notes',
+        'Acme/Contracts/Launch/Plan/plan.txt': b'plan',
+    }
+    assert unzip(vault_export_entries(vault)) == unzip(folder_export_entries(root))
+
+
+def test_workspace_export(tree):
+    vault, root, workspace = tree
+    assert unzip(workspace_export_entries(workspace)) == {'Launch/notes.txt': b'notes', 'Launch/Plan/plan.txt': b'plan'}
+
+
+def test_export_route_streams_blobs_after_the_view_returned(app, blobs):
+    contentHash, size = put_stream(io.BytesIO(b'signed contract'))
+    folder = Folder(Name='Legal')
+    db.session.add(File(Name='contract.pdf', Path=locate_blob(contentHash), ContentHash=contentHash, Size=size, Folder=folder))
+    db.session.commit()
+    url = f'/Folder/{folder.Id}/export'
+
+    @app.route('/Folder/<int:id>/export')
+    def export_folder(id):
+        folder = Folder.query.get_or_404(id)
+        return zip_response(folder_export_entries(folder), folder.Name)
+
+    # As under a WSGI server: no app context but the request's, and the body is sent after it
+    def download():
+        response = app.test_client().get(url)
+        return response.status_code, response.data
+    status, data = contextvars.Context().run(download)
+    assert status == 200
+    assert zipfile.ZipFile(io.BytesIO(data)).read('Legal/contract.pdf') == b'signed contract'
+
+
+def test_stream_memory_does_not_grow_with_file_size(tmp_path):
+    big = tmp_path / 'big.bin'
+    with open(big, 'wb') as out:
+        out.write(os.urandom(1024 * 1024) * 32)
+
+    tracemalloc.start()
+    size = sum(len(chunk) for chunk in stream_zip([('big.bin', str(big), None)]))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert size > 32 * 1024 * 1024
+    assert peak < 4 * 1024 * 1024
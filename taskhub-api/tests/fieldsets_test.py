@@ -0,0 +1,62 @@
+import pytest
+from flask_restx import Api, Resource, fields
+
+import fieldsets
+from database import db
+from models import User, TextBox, Task
+from loaders import serialize_loaders
+from fieldsets import requested_fields
+
+
+@pytest.fixture
+def client(app):
+    fieldsets.init_app(app)
+    api = Api(app)
+    for name in ('Task', 'Vault'):
+        ns = api.namespace(name)
+        model = ns.model(f'{name}Item', {'id': fields.Integer, 'title': fields.String})
+
+        class ItemList(Resource):
+            @ns.marshal_list_with(model)
+            def get(self):
+                return [{'id': 1, 'title': 'first'}]
+        ns.add_resource(ItemList, '/')
+    return app.test_client()
+
+
+def test_fields_trims_sparse_namespaces(client):
+    assert client.get('/Task/?fields=id').json == [{'id': 1}]
+    assert client.get('/Task/').json == [{'id': 1, 'title': 'first'}]
+    # An explicit mask header still wins over the query string
+    assert client.get('/Task/?fields=id', headers={'X-Fields': 'title'}).json == [{'title': 'first'}]
+
+
+def test_fields_ignored_outside_sparse_namespaces(client):
+    assert client.get('/Vault/?fields=id').json == [{'id': 1, 'title': 'first'}]
+
+
+def test_requested_fields(app):
+    with app.test_request_context('/Task/?fields=id, title,'):
+        assert requested_fields() == {'id', 'title'}
+    with app.test_request_context('/Task/'):
+        assert requested_fields() is None
+
+
+def test_sparse_loaders_skip_joins_and_heavy_columns(app, count_queries):
+    creator = User(Username='creator', FirstName='Creator', LastName='Zero')
+    db.session.add_all([
+        TextBox(Text='a very long note', CreatedByUser=creator),
+        Task(Title='task', Description='long description', CreatedByUser=creator),
+    ])
+    db.session.commit()
+    db.session.expunge_all()
+
+    query = TextBox.query.options(*serialize_loaders(TextBox, {'id', 'pageId'}))
+    assert 'JOIN' not in str(query) and 'Text' not in str(query)
+    queries, notes = count_queries(lambda: [note.serialize() for note in query.all()])
+    assert queries == 1
+    assert notes[0]['id'] and notes[0]['text'] is None
+
+    queries, tasks = count_queries(lambda: [task.serialize() for task in Task.query.options(*serialize_loaders(Task, {'title', 'createdByName'})).all()])
+    assert queries == 1
+    assert tasks[0]['createdByName'] == 'Creator Zero' and tasks[0]['description'] is None
@@ -0,0 +1,62 @@
+from io import BytesIO
+
+from database import db
+from models import Blob, File, Folder, Image
+from blobStore import put_stream, blob_path, content_hash
+from storageBackends import LocalStorage
+
+CONTENT = b'%PDF-1.4 quarterly report' * 100
+
+
+def refcount(contentHash):
+    blob = db.session.get(Blob, contentHash, populate_existing=True)
+    return blob.RefCount if blob else None
+
+
+def test_identical_upload_is_not_written_again(blobs, monkeypatch):
+    contentHash, size = put_stream(BytesIO(CONTENT))
+    assert (contentHash, size) == (content_hash(CONTENT), len(CONTENT))
+
+    def fail(self, key, stream):
+        raise AssertionError('blob written twice')
+    monkeypatch.setattr(LocalStorage, 'put_stream', fail)
+    assert put_stream(BytesIO(CONTENT)) == (contentHash, size)
+
+
+def test_file_references_are_counted(blobs):
+    contentHash, size = put_stream(BytesIO(CONTENT))
+    folder = Folder(Name='Attachments')
+    files = [File(Name=f'report{i}.pdf', Path=blob_path(contentHash), ContentHash=contentHash, Size=size, Folder=folder)
+             for i in range(3)]
+    db.session.add_all(files)
+    db.session.commit()
+    assert refcount(contentHash) == 3
+
+    db.session.delete(files[0])
+    db.session.commit()
+    assert refcount(contentHash) == 2
+
+    # Rows removed by ORM cascades are released as well
+    folder.Files.clear()
+    db.session.commit()
+    assert refcount(contentHash) == 0
+
+
+def test_replaced_image_content_moves_the_reference(blobs):
+    first, second = put_stream(BytesIO(b'first'))[0], put_stream(BytesIO(b'second'))[0]
+    image = Image(Name='logo', ContentHash=first, ContentSize=5)
+    db.session.add(image)
+    db.session.commit()
+    assert refcount(first) == 1
+
+    image.ContentHash = second
+    db.session.commit()
+    assert (refcount(first), refcount(second)) == (0, 1)
+
+
+def test_rollback_leaves_counts_untouched(blobs):
+    contentHash, size = put_stream(BytesIO(CONTENT))
+    db.session.add(File(Name='report.pdf', ContentHash=contentHash, Size=size))
+    db.session.flush()
+    db.session.rollback()
+    assert refcount(contentHash) is None
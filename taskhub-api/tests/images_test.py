@@ -0,0 +1,71 @@
+import os
+from io import BytesIO
+
+from PIL import Image as PILImage
+
+from database import db
+from models import Image
+from blobStore import put_blob, read_blob, blob_path, content_hash, guess_mime_type
+import imageVariants
+from imageVariants import IMAGE_VARIANTS, ensure_variant, generate_variants, variant_path
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+def test_blobs_are_content_addressed(blobs):
+    contentHash = put_blob(PNG)
+    assert contentHash == content_hash(PNG)
+    assert blob_path(contentHash) == os.path.join(str(blobs), contentHash[:2], contentHash[2:4], contentHash)
+    assert read_blob(contentHash) == PNG
+    # Storing the same bytes again reuses the file
+    assert put_blob(PNG) == contentHash
+    assert os.listdir(blobs / contentHash[:2] / contentHash[2:4]) == [contentHash]
+
+
+def test_guess_mime_type():
+    assert guess_mime_type(PNG) == 'image/png'
+    assert guess_mime_type(b'\xff\xd8\xff\xe0rest') == 'image/jpeg'
+    assert guess_mime_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+    assert guess_mime_type(b'plain text') == 'application/octet-stream'
+
+
+def test_image_serialize_returns_metadata_and_url(blobs):
+    image = Image(Name='logo', ContentHash=put_blob(PNG), ContentSize=len(PNG), MimeType='image/png')
+    db.session.add(image)
+    db.session.commit()
+
+    serialized = image.serialize()
+    assert 'base64' not in serialized
+    assert serialized['url'] == serialized['originalUrl'] == f'/Image/{image.Id}/content'
+    assert image.serialize('thumbnail')['url'] == f'/Image/{image.Id}/content?variant=thumbnail'
+    assert (serialized['contentHash'], serialized['size'], serialized['mimeType']) == (content_hash(PNG), len(PNG), 'image/png')
+
+
+def png(width, height):
+    output = BytesIO()
+    PILImage.new('RGBA', (width, height), (255, 0, 0, 128)).save(output, 'PNG')
+    return output.getvalue()
+
+
+def test_variants_fit_their_bounding_box(blobs):
+    contentHash = put_blob(png(2000, 1000))
+    generate_variants(contentHash)
+    for variant, spec in IMAGE_VARIANTS.items():
+        with PILImage.open(variant_path(contentHash, variant)) as rendered:
+            assert rendered.format == 'WEBP'
+            assert rendered.width == spec['maxSize'][0]
+            assert rendered.height == spec['maxSize'][0] // 2
+
+
+def test_variants_are_rendered_once_per_content(blobs, monkeypatch):
+    contentHash = put_blob(png(40, 40))
+    assert ensure_variant(contentHash, 'thumbnail')
+
+    def fail(data, variant):
+        raise AssertionError('variant rendered twice')
+    monkeypatch.setattr(imageVariants, 'render_variant', fail)
+    assert ensure_variant(contentHash, 'thumbnail') == variant_path(contentHash, 'thumbnail')
+
+
+def test_undecodable_content_has_no_variant(blobs):
+    assert ensure_variant(put_blob(b'not an image'), 'thumbnail') is None
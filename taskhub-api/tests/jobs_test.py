@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import tombstones  # noqa: F401
+import deletionJobs
+from database import db
+from models import Vault, Folder, Workspace, Page, Task, Card, File, Url, Job
+from loaders import serialize_loaders
+from jobs import (job_handler, enqueue_job, run_job, report_progress, claim_jobs, claim_job, execute_job, heartbeat,
+                  recover_stale_jobs, retry_delay, JobFailed, Worker, JOB_LOCK_TIMEOUT, JOB_MAX_RETRY_DELAY)
+from deletionJobs import schedule_vault_delete, schedule_folder_delete, schedule_workspace_delete
+
+
+def build_tree(pagesPerWorkspace=3):
+    vault = Vault(Name='vault')
+    root = Folder(Name='root', Vault=vault)
+    child = Folder(Name='child', ParentFolder=root)
+    db.session.add_all([vault, Url(Name='link', Url='https://example.com', Folder=child)])
+    for folder in (root, child):
+        for w in range(2):
+            workspace = Workspace(Name=f'{folder.Name}-ws{w}', Folder=folder)
+            for p in range(pagesPerWorkspace):
+                page = Page(Name=f'page{p}', Workspace=workspace)
+                db.session.add_all([Task(Title='task', Page=page), Card(Name='card', Page=page)])
+    db.session.add(File(Name='a.pdf', Path='a', Folder=child))
+    db.session.commit()
+    return vault.Id, root.Id, child.Id
+
+
+def test_deleted_vault_is_hidden_until_purged_in_batches(app, monkeypatch):
+    monkeypatch.setattr(deletionJobs, 'PURGE_BATCH_SIZE', 5)
+    keptVaultId, keptRootId, _ = build_tree()
+    vaultId, _, _ = build_tree()
+
+    job = schedule_vault_delete(vaultId)
+    db.session.commit()
+    db.session.expire_all()
+    assert job.Status == 'queued'
+    # Gone from lookups, listings and eager loads at once, still in the tables
+    assert db.session.get(Vault, vaultId) is None
+    assert [vault.Id for vault in Vault.query] == [keptVaultId]
+    assert Folder.query.count() == 2 and Workspace.query.count() == 4
+    kept = Vault.query.options(*serialize_loaders(Vault)).one()
+    assert [folder.Id for folder in kept.Folders if folder.ParentId is None] == [keptRootId]
+    assert Folder.query.execution_options(include_deleted=True).count() == 4
+
+    progress = []
+    monkeypatch.setattr(deletionJobs, 'report_progress', lambda job, done, total=None: (
+        progress.append(done), report_progress(job, done, total)))
+    job = run_job(job.Id)
+    assert job.Status == 'succeeded' and job.Error is None
+    # 12 pages in batches of 5, then the rows above them
+    assert job.Total == 13 and job.Progress == 13
+    assert progress == [0, 5, 10, 12]
+    assert job.StartedDateTime <= job.FinishedDateTime
+
+    assert Vault.query.execution_options(include_deleted=True).count() == 1
+    assert Folder.query.execution_options(include_deleted=True).count() == 2
+    assert Page.query.count() == 12 and Task.query.count() == 12 and Card.query.count() == 12
+    assert File.query.count() == 1 and Url.query.count() == 1
+
+
+def test_folder_and_workspace_deletes_purge_only_their_subtree(app):
+    vaultId, rootId, childId = build_tree(pagesPerWorkspace=1)
+    workspaceId = Workspace.query.filter_by(FolderId=rootId).first().Id
+
+    folderJob = schedule_folder_delete(childId)
+    workspaceJob = schedule_workspace_delete(workspaceId)
+    db.session.commit()
+    assert Folder.query.count() == 1 and Workspace.query.count() == 1
+    assert run_job(folderJob.Id).Status == 'succeeded'
+    assert run_job(workspaceJob.Id).Status == 'succeeded'
+
+    assert [folder.Id for folder in Folder.query.execution_options(include_deleted=True)] == [rootId]
+    assert Workspace.query.execution_options(include_deleted=True).count() == 1
+    assert Page.query.count() == 1 and Url.query.count() == 0 and File.query.count() == 0
+    assert db.session.get(Vault, vaultId) is not None
+
+
+def test_failed_job_is_retried_with_backoff_until_out_of_attempts(app):
+    calls = []
+
+    @job_handler('flaky')
+    def flaky(job, payload):
+        calls.append(job.Attempts)
+        report_progress(job, 1, 3)
+        Page.query.delete()
+        raise RuntimeError(f"could not finish {payload['what']}")
+
+    db.session.add(Page(Name='survivor'))
+    job = enqueue_job('flaky', {'what': 'the thing'}, maxAttempts=2)
+    db.session.commit()
+
+    job = run_job(job.Id)
+    assert job.Status == 'queued' and job.Error == 'could not finish the thing' and job.LockedBy is None
+    # Work committed through report_progress stays, the rest is rolled back
+    assert job.Progress == 1 and job.Total == 3 and Page.query.count() == 1
+    assert job.RunAfter >= datetime.now() + retry_delay(1) - timedelta(seconds=5)
+    assert claim_jobs('worker', 10) == []
+
+    job.RunAfter = datetime.now() - timedelta(seconds=1)
+    db.session.commit()
+    assert claim_jobs('worker', 10) == [job.Id]
+    job = execute_job(job.Id)
+    assert job.Status == 'failed' and job.Attempts == 2 and calls == [1, 2]
+    # A finished job is not run again
+    assert run_job(job.Id).Attempts == 2 and calls == [1, 2]
+    assert retry_delay(3) == 4 * retry_delay(1) and retry_delay(100) == JOB_MAX_RETRY_DELAY
+
+
+def test_unknown_kinds_and_job_failed_are_not_retried(app):
+    @job_handler('refuse')
+    def refuse(job, payload):
+        raise JobFailed('nothing to do')
+
+    refused = enqueue_job('refuse')
+    unknown = enqueue_job('no-such-kind')
+    db.session.commit()
+    assert (run_job(refused.Id).Status, refused.Error, refused.Attempts) == ('failed', 'nothing to do', 1)
+    assert (run_job(unknown.Id).Status, unknown.Error) == ('failed', "Unknown job kind 'no-such-kind'")
+
+
+def test_claims_follow_priority_and_stale_jobs_are_recovered(app):
+    low = enqueue_job('noop', priority=0)
+    high = enqueue_job('noop', priority=10)
+    later = enqueue_job('noop', priority=20, runAfter=datetime.now() + timedelta(hours=1))
+    db.session.commit()
+    assert claim_jobs('a', 1) == [high.Id]
+    assert claim_jobs('b', 5) == [low.Id]
+    assert high.LockedBy == 'a' and low.LockedBy == 'b' and later.Status == 'queued'
+
+    # Worker a keeps heartbeating, worker b went away; low has attempts left, a third job does not
+    dead = enqueue_job('noop', maxAttempts=1)
+    db.session.commit()
+    claim_job(dead.Id, 'b')
+    past = datetime.now() - JOB_LOCK_TIMEOUT - timedelta(minutes=1)
+    for job in (high, low, dead):
+        job.LastModifyDateTime = past
+    db.session.commit()
+    heartbeat('a', [high.Id])
+    assert recover_stale_jobs() == (1, 1)
+    db.session.expire_all()
+    assert high.Status == 'running'
+    assert low.Status == 'queued' and low.LockedBy is None and low.Attempts == 1
+    assert dead.Status == 'failed' and dead.Error == 'The worker running the job stopped'
+
+
+def test_worker_runs_jobs_on_its_pool(app):
+    ran = []
+
+    @job_handler('record')
+    def record(job, payload):
+        ran.append(payload)
+
+    for name, priority in (('second', 0), ('first', 5)):
+        enqueue_job('record', name, priority=priority)
+    db.session.commit()
+    worker = Worker(app, concurrency=1, pollInterval=5)
+    worker.run(untilIdle=True)
+    assert ran == ['first', 'second']
+    assert [job.Status for job in Job.query] == ['succeeded', 'succeeded']
+
+
+def test_idle_worker_backs_off_and_recovers_stale_jobs_now_and_then(app, monkeypatch):
+    recoveries = []
+    monkeypatch.setattr('jobs.recover_stale_jobs', lambda lockTimeout: recoveries.append(lockTimeout))
+    worker = Worker(app, concurrency=1, pollInterval=1, maxPollInterval=30, lockTimeout=timedelta(minutes=4))
+    assert [worker.poll_delay(idlePolls) for idlePolls in range(8)] == [1, 1, 2, 4, 8, 16, 30, 30]
+
+    clock = iter([0, 60, 119, 121])
+    monkeypatch.setattr('jobs.time.monotonic', lambda: next(clock))
+    for _ in range(4):
+        worker.poll()
+    # At most every half lock timeout
+    assert len(recoveries) == 2
+    worker.executor.shutdown()
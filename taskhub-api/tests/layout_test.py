@@ -0,0 +1,74 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from database import db
+from models import Blob, File
+from blobStore import blob_path, flat_blob_path, content_hash, locate_blob, put_stream
+from imageVariants import variant_path, flat_variant_path
+from uploadLayout import migrate_flat_blobs, migrate_flat_variants, migrate_legacy_files
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as out:
+        out.write(content)
+    return path
+
+
+@pytest.fixture
+def uploads(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['BLOB_FOLDER'] = str(tmp_path / 'uploads' / 'blobs')
+    return str(tmp_path / 'uploads')
+
+
+def test_flat_blobs_move_into_shards(uploads):
+    contentHash = content_hash(b'report')
+    flat = write(flat_blob_path(contentHash), b'report')
+    db.session.add(File(Name='report.pdf', Path=flat, ContentHash=contentHash, Size=6))
+    db.session.commit()
+    assert locate_blob(contentHash) == flat
+
+    assert migrate_flat_blobs() == 1
+    assert not os.path.exists(flat) and locate_blob(contentHash) == blob_path(contentHash)
+    assert File.query.one().Path == blob_path(contentHash)
+    assert migrate_flat_blobs() == 0
+
+
+def test_flat_variants_move_into_shards(uploads):
+    contentHash = content_hash(b'logo')
+    flat = write(flat_variant_path(contentHash, 'thumbnail'), b'webp')
+    assert migrate_flat_variants() == 1
+    assert not os.path.exists(flat) and os.path.exists(variant_path(contentHash, 'thumbnail'))
+
+
+def test_legacy_files_move_into_blob_store(uploads):
+    legacy = write(os.path.join(uploads, '3', 'notes.txt'), b'minutes')
+    missing = os.path.join(uploads, '3', 'gone.txt')
+    existingHash, _ = put_stream(BytesIO(b'shared'))
+    duplicate = write(os.path.join(uploads, 'folders', '4', 'copy.txt'), b'shared')
+    db.session.add_all([
+        File(Name='gone.txt', Path=missing),
+        File(Name='notes.txt', Path=legacy),
+        File(Name='notes.txt', Path=legacy),
+        File(Name='copy.txt', Path=duplicate),
+        File(Name='shared.txt', Path=blob_path(existingHash), ContentHash=existingHash, Size=6),
+    ])
+    db.session.commit()
+
+    moved, lastId = migrate_legacy_files(batchSize=2)
+    assert moved == 1 and lastId == 2
+    moved, lastId = migrate_legacy_files(batchSize=2, afterId=lastId)
+    assert moved == 1
+    assert migrate_legacy_files(afterId=lastId) == (0, None)
+
+    notesHash = content_hash(b'minutes')
+    assert not os.path.exists(legacy) and not os.path.exists(duplicate)
+    files = {file.Id: file for file in File.query}
+    assert files[1].Path == missing and files[1].ContentHash is None
+    assert files[2].Path == files[3].Path == blob_path(notesHash) and files[2].Size == 7
+    assert files[4].Path == blob_path(existingHash)
+    assert db.session.get(Blob, notesHash).RefCount == 2
+    assert db.session.get(Blob, existingHash).RefCount == 2
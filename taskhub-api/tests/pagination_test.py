@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from database import db
+from models import Company, User, Task, Event
+from pagination import paginate, encode_cursor, NEXT_CURSOR_HEADER
+from readModels import fetch_rows, select_tasks_by_company
+
+
+def walk(app, query, *keyColumns, limit, execute=None):
+    """Follow next cursors from the first page to the last, returning the pages"""
+    pages, cursor = [], None
+    while True:
+        url = f'/?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        with app.test_request_context(url):
+            rows, headers = paginate(query, *keyColumns, execute=execute)
+        pages.append(rows)
+        cursor = headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return pages
+
+
+def test_without_limit_returns_everything(app):
+    db.session.add_all([Task(Title=f'task{i}') for i in range(5)])
+    db.session.commit()
+    with app.test_request_context('/'):
+        rows, headers = paginate(Task.query, Task.Id)
+    assert len(rows) == 5
+    assert headers == {}
+
+
+def test_cursor_walks_every_row_once(app):
+    company = Company(Name='freelance')
+    creator = User(Username='creator', Company=company)
+    db.session.add_all([Task(Title=f'task{i}', CreatedByUser=creator) for i in range(7)])
+    db.session.commit()
+
+    pages = walk(app, Task.query, Task.Id, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [task.Title for page in pages for task in page] == [f'task{i}' for i in range(7)]
+
+    # The projection path pages over select() statements the same way
+    pages = walk(app, select_tasks_by_company(company.Id), Task.Id, limit=4, execute=fetch_rows)
+    assert [row.Title for page in pages for row in page] == [f'task{i}' for i in range(7)]
+
+
+def test_composite_sort_key_with_ties(app):
+    start = datetime(2026, 1, 1, 9)
+    # Pairs of events share a start time, so the id has to break the tie
+    db.session.add_all([Event(Title=f'event{i}', DateTimeFrom=start + timedelta(hours=i // 2)) for i in range(6)])
+    db.session.commit()
+
+    pages = walk(app, Event.query, Event.DateTimeFrom, Event.Id, limit=3)
+    assert [event.Title for page in pages for event in page] == [f'event{i}' for i in range(6)]
+
+
+def test_unpaginated_list_keeps_the_key_order(app):
+    start = datetime(2026, 1, 1, 9)
+    db.session.add_all([Event(Title=f'event{i}', DateTimeFrom=start - timedelta(hours=i)) for i in range(4)])
+    db.session.commit()
+    with app.test_request_context('/'):
+        rows, _ = paginate(Event.query, Event.DateTimeFrom, Event.Id)
+    assert [event.Title for event in rows] == ['event3', 'event2', 'event1', 'event0']
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', encode_cursor(['x']), encode_cursor([True]), encode_cursor([1.5])])
+def test_invalid_cursor_is_rejected(app, cursor):
+    with app.test_request_context(f'/?limit=2&cursor={cursor}'):
+        with pytest.raises(BadRequest):
+            paginate(Task.query, Task.Id)
+
+
+def test_cursor_values_must_match_the_key_types(app):
+    with app.test_request_context(f'/?limit=2&cursor={encode_cursor([1, 2])}'):
+        with pytest.raises(BadRequest):
+            paginate(Event.query, Event.DateTimeFrom, Event.Id)
+    with app.test_request_context(f'/?limit=2&cursor={encode_cursor(["2026-01-01T09:00:00", 2])}'):
+        assert paginate(Event.query, Event.DateTimeFrom, Event.Id) == ([], {})
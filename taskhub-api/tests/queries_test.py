@@ -0,0 +1,41 @@
+import pytest
+
+import queryStats
+from database import db
+from models import Task
+from queryStats import query_budget, QueryBudgetExceeded
+
+
+@pytest.fixture
+def client(app):
+    queryStats.init_app(app)
+
+    @app.route('/tasks/<int:budget>')
+    def list_tasks(budget):
+        @query_budget(budget)
+        def serialize_lazily():
+            return [task.serialize() for task in Task.query.all()]
+        return serialize_lazily()
+
+    db.session.add_all([Task(Title=f'task{i}') for i in range(3)])
+    db.session.commit()
+    return app.test_client()
+
+
+def test_query_count_and_time_headers(client):
+    response = client.get('/tasks/10')
+    assert response.status_code == 200
+    assert response.headers['X-Query-Count'] == '1'
+    assert float(response.headers['X-DB-Time-Ms']) >= 0
+
+
+def test_exceeding_budget_fails_in_test_mode(client):
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/tasks/0')
+
+
+def test_exceeding_budget_only_warns_in_production(app, client, caplog):
+    app.config['TESTING'] = False
+    response = client.get('/tasks/0')
+    assert response.status_code == 200
+    assert 'issued 1 queries, budget is 0' in caplog.text
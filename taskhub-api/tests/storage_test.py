@@ -0,0 +1,178 @@
+import hashlib
+import io
+import os
+import zipfile
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pytest
+
+from database import db
+from models import Blob, File, Folder, UploadSession
+from blobStore import blob_key, put_stream, put_blob, read_blob, locate_blob
+from downloads import send_file_content
+from storageBackends import storage, LocalStorage, S3Storage
+from uploadSessions import (create_session, direct_upload_target, complete_direct_upload, discard_session, incoming_key,
+                            append_chunk, received_content_hash, complete_session, part_path)
+from storageBackends import MULTIPART_MIN_PART_SIZE
+from uploadSweeper import sweep_uploads
+from zipExport import folder_export_entries, stream_zip
+from uploadLayout import migrate_flat_blobs, migrate_legacy_files
+
+moto = pytest.importorskip('moto')
+requests = pytest.importorskip('requests')
+
+BUCKET = 'taskhub-test'
+CONTENT = b'%PDF-1.4 signed contract' * 1000
+CHECKSUM = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def s3(app, tmp_path, monkeypatch):
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    app.config.update(STORAGE_BACKEND='s3', S3_BUCKET=BUCKET, S3_PREFIX='blobs', S3_REGION='us-east-1',
+                      UPLOAD_FOLDER=str(tmp_path / 'uploads'), BLOB_FOLDER=str(tmp_path / 'uploads' / 'blobs'))
+    with moto.mock_aws():
+        backend = storage()
+        backend.client.create_bucket(Bucket=BUCKET)
+        yield backend
+
+
+def objects(backend):
+    return sorted(item['Key'] for item in backend.client.list_objects_v2(Bucket=BUCKET).get('Contents', []))
+
+
+def test_local_storage_is_the_default(app):
+    assert isinstance(storage(), LocalStorage)
+
+
+def test_blobs_are_stored_in_the_bucket(s3):
+    assert isinstance(s3, S3Storage)
+    contentHash, size = put_stream(BytesIO(CONTENT))
+    assert (contentHash, size) == (CHECKSUM, len(CONTENT))
+    assert objects(s3) == [f'blobs/{blob_key(CHECKSUM)}']
+    assert locate_blob(CHECKSUM) == f's3://{BUCKET}/blobs/{blob_key(CHECKSUM)}'
+    assert read_blob(CHECKSUM) == CONTENT
+    assert put_blob(CONTENT) == CHECKSUM and len(objects(s3)) == 1
+    with pytest.raises(FileNotFoundError):
+        read_blob('0' * 64)
+
+
+def test_reused_blob_is_refreshed_in_the_database(s3, monkeypatch):
+    contentHash, size = put_stream(BytesIO(CONTENT))
+    longAgo = datetime.now() - timedelta(days=30)
+    db.session.add(Blob(ContentHash=contentHash, Size=size, RefCount=0, LastModifyDateTime=longAgo))
+    db.session.commit()
+    # No copy of the object onto itself, which fails past 5 GB
+    monkeypatch.setattr(s3.client, 'copy_object', None)
+    assert put_stream(BytesIO(CONTENT)) == (contentHash, size)
+    db.session.commit()
+    assert db.session.get(Blob, contentHash).LastModifyDateTime > longAgo
+
+
+def test_direct_upload_goes_through_a_presigned_url(app, s3):
+    session = create_session(direct=True, Name='contract.pdf', Size=len(CONTENT), Checksum=CHECKSUM, PageId=3)
+    db.session.commit()
+    assert complete_direct_upload(session) is None
+
+    url, headers = direct_upload_target(session)
+    assert requests.put(url, data=CONTENT, headers=headers).status_code == 200
+    contentHash, location = complete_direct_upload(session)
+    assert contentHash == CHECKSUM and objects(s3) == [f'blobs/{blob_key(CHECKSUM)}']
+    db.session.add(File(Name='contract.pdf', Path=location, ContentHash=contentHash, Size=len(CONTENT), PageId=3))
+    db.session.commit()
+    assert UploadSession.query.count() == 0 and db.session.get(Blob, CHECKSUM).RefCount == 1
+
+    with app.test_request_context():
+        response = send_file_content(File.query.one())
+    assert response.status_code == 302
+    download = requests.get(response.location)
+    assert download.content == CONTENT and 'contract.pdf' in download.headers['Content-Disposition']
+
+
+def test_chunked_upload_goes_to_the_bucket_in_parts(s3):
+    content = bytes(range(256)) * (MULTIPART_MIN_PART_SIZE // 256) + b'tail'
+    session = create_session(Name='scan.tiff', Size=len(content), PageId=3)
+    db.session.commit()
+    # No part file on this node's disk, so another API node can take the next chunk
+    assert session.MultipartUploadId and not os.path.exists(part_path(session))
+    with pytest.raises(ValueError):
+        append_chunk(session, BytesIO(content[:1024]))
+    append_chunk(session, BytesIO(content[:MULTIPART_MIN_PART_SIZE]))
+    append_chunk(session, BytesIO(content[MULTIPART_MIN_PART_SIZE:]))
+    assert (session.Parts, session.Received) == (2, len(content))
+
+    contentHash = received_content_hash(session)
+    assert contentHash == hashlib.sha256(content).hexdigest()
+    assert complete_session(session, contentHash) == locate_blob(contentHash)
+    db.session.commit()
+    assert objects(s3) == [f'blobs/{blob_key(contentHash)}'] and read_blob(contentHash) == content
+
+    abandoned = create_session(Name='draft.txt', Size=10)
+    db.session.commit()
+    append_chunk(abandoned, BytesIO(b'0123456789'))
+    discard_session(abandoned)
+    db.session.commit()
+    assert not s3.client.list_multipart_uploads(Bucket=BUCKET).get('Uploads')
+
+
+def test_mismatched_direct_upload_is_rejected(s3):
+    session = create_session(direct=True, Name='contract.pdf', Size=len(CONTENT) + 1, Checksum=CHECKSUM)
+    db.session.commit()
+    s3.put_stream(incoming_key(session), BytesIO(CONTENT))
+    with pytest.raises(ValueError):
+        complete_direct_upload(session)
+    discard_session(session)
+    db.session.commit()
+    assert objects(s3) == []
+
+
+def test_export_reads_from_the_bucket(s3):
+    contentHash, size = put_stream(BytesIO(CONTENT))
+    folder = Folder(Name='Legal')
+    db.session.add(File(Name='contract.pdf', Path=locate_blob(contentHash), ContentHash=contentHash, Size=size, Folder=folder))
+    db.session.commit()
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(folder_export_entries(folder)))))
+    assert archive.read('Legal/contract.pdf') == CONTENT
+
+
+def test_sweep_deletes_released_objects(s3):
+    usedHash, _ = put_stream(BytesIO(b'in use'))
+    releasedHash, _ = put_stream(BytesIO(b'released'))
+    longAgo = datetime.now() - timedelta(days=30)
+    db.session.add_all([
+        File(Name='kept.txt', Path=locate_blob(usedHash), ContentHash=usedHash, Size=6),
+        Blob(ContentHash=releasedHash, Size=8, RefCount=0, LastModifyDateTime=longAgo),
+    ])
+    abandoned = create_session(direct=True, Name='big.iso', Size=10, Checksum=CHECKSUM)
+    abandoned.LastModifyDateTime = longAgo
+    db.session.commit()
+    s3.put_stream(incoming_key(abandoned), BytesIO(b'0123456789'))
+
+    # The released object was written moments ago, so it is still within the grace period
+    sweep_uploads()
+    assert f'blobs/{blob_key(releasedHash)}' in objects(s3)
+    report = sweep_uploads(gracePeriod=timedelta(seconds=-60))
+    assert objects(s3) == [f'blobs/{blob_key(usedHash)}']
+    assert report['reclaimedBytes'] >= 8
+    assert db.session.get(Blob, releasedHash) is None and UploadSession.query.count() == 0
+
+
+def test_layout_migration_uploads_local_files(app, s3, tmp_path):
+    legacy = tmp_path / 'uploads' / '3' / 'notes.txt'
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b'minutes')
+    flat = tmp_path / 'uploads' / 'blobs' / CHECKSUM
+    flat.parent.mkdir()
+    flat.write_bytes(CONTENT)
+    db.session.add_all([File(Name='notes.txt', Path=str(legacy)),
+                        File(Name='contract.pdf', Path=str(flat), ContentHash=CHECKSUM, Size=len(CONTENT))])
+    db.session.commit()
+
+    assert migrate_flat_blobs() == 1
+    assert migrate_legacy_files()[0] == 1
+    notesHash = hashlib.sha256(b'minutes').hexdigest()
+    assert objects(s3) == sorted([f'blobs/{blob_key(CHECKSUM)}', f'blobs/{blob_key(notesHash)}'])
+    assert not flat.exists() and not legacy.exists()
+    assert {file.Path for file in File.query} == {locate_blob(CHECKSUM), locate_blob(notesHash)}
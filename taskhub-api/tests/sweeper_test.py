@@ -0,0 +1,79 @@
+import os
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pytest
+
+from database import db
+from models import Blob, File, Image
+from blobStore import put_stream, blob_path
+from imageVariants import variant_path
+from uploadSessions import create_session, part_path
+from uploadSweeper import sweep_uploads
+
+LONG_AGO = datetime.now() - timedelta(days=30)
+
+
+def age(path):
+    timestamp = time.mktime(LONG_AGO.timetuple())
+    os.utime(path, (timestamp, timestamp))
+
+
+def write(path, content=b'bytes', old=True):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as out:
+        out.write(content)
+    if old:
+        age(path)
+    return path
+
+
+@pytest.fixture
+def uploads(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['BLOB_FOLDER'] = str(tmp_path / 'uploads' / 'blobs')
+    return str(tmp_path / 'uploads')
+
+
+def test_sweep_deletes_only_unreferenced_old_files(uploads):
+    kept = write(os.path.join(uploads, '3', 'kept.pdf'))
+    orphan = write(os.path.join(uploads, 'folders', '4', 'orphan.pdf'), b'x' * 100)
+    young = write(os.path.join(uploads, 'general', 'young.pdf'), old=False)
+    db.session.add(File(Name='kept.pdf', Path=os.path.join(uploads, '3', 'kept.pdf')))
+
+    usedHash, _ = put_stream(BytesIO(b'in use'))
+    unusedHash, _ = put_stream(BytesIO(b'released'))
+    db.session.add(Image(Name='logo', ContentHash=usedHash, ContentSize=6))
+    db.session.add(Blob(ContentHash=unusedHash, Size=8, RefCount=0, LastModifyDateTime=LONG_AGO))
+    strayVariant = write(variant_path('0' * 64, 'thumbnail'))
+    unusedVariant = write(variant_path(unusedHash, 'thumbnail'))
+    abandoned = create_session(Name='big.iso', Size=10)
+    abandoned.LastModifyDateTime = LONG_AGO
+    db.session.commit()
+    for path in (blob_path(usedHash), blob_path(unusedHash), part_path(abandoned)):
+        age(path)
+
+    report = sweep_uploads()
+    assert report['complete']
+    assert os.path.exists(kept) and os.path.exists(young) and os.path.exists(blob_path(usedHash))
+    for path in (orphan, blob_path(unusedHash), unusedVariant, strayVariant, part_path(abandoned)):
+        assert not os.path.exists(path)
+    assert db.session.get(Blob, unusedHash) is None
+    assert report['deleted'] == 5
+    assert report['reclaimedBytes'] == 100 + len(b'released') + len(b'bytes') * 2
+
+
+def test_sweep_is_incremental(uploads):
+    paths = [write(os.path.join(uploads, str(page), f'file{i}.txt')) for page in range(3) for i in range(3)]
+
+    reports = []
+    while not reports or not reports[-1]['complete']:
+        reports.append(sweep_uploads(batchSize=4))
+    assert [report['scanned'] for report in reports] == [4, 4, 1]
+    assert sum(report['deleted'] for report in reports) == len(paths)
+    assert not any(os.path.exists(path) for path in paths)
+
+    # A finished pass starts over from the top
+    write(os.path.join(uploads, '0', 'late.txt'))
+    assert sweep_uploads(batchSize=4)['deleted'] == 1
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+from database import db
+from models import Company, User, Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, Url, File
+from loaders import serialize_loaders
+from readModels import (select_tasks_by_company, serialize_task_row, select_cards_by_company, serialize_card_row,
+                        select_files_by_company, serialize_file_row)
+
+
+def seed(rows):
+    """Create `rows` of every page-level entity, each pointing at distinct users, pages and folders"""
+    now = datetime.now()
+    company = Company(Name='freelance')
+    for i in range(rows):
+        creator = User(Username=f'creator{i}', FirstName='Creator', LastName=str(i), Company=company)
+        assignee = User(Username=f'assignee{i}', FirstName='Assignee', LastName=str(i))
+        vault = Vault(Name=f'vault{i}', CreatedByUser=creator)
+        folder = Folder(Name=f'folder{i}', CreatedByUser=creator, Vault=vault)
+        workspace = Workspace(Name=f'workspace{i}', CreatedByUser=creator, Folder=folder)
+        page = Page(Name=f'page{i}', CreatedByUser=creator, Workspace=workspace)
+        db.session.add_all([
+            Task(Title=f'task{i}', AssignedUser=assignee, CreatedByUser=creator, Page=page, CreatedDateTime=now),
+            Card(Name=f'card{i}', AssignedUser=assignee, CreatedByUser=creator, Page=page),
+            TextBox(Text=f'note{i}', CreatedByUser=creator, Page=page),
+            Image(Name=f'image{i}', CreatedByUser=creator, Page=page),
+            Url(Name=f'url{i}', Url='https://example.com', CreatedByUser=creator, Folder=folder),
+            Folder(Name=f'child{i}', CreatedByUser=creator, ParentFolder=folder, Vault=vault),
+            File(Name=f'file{i}', Path=f'uploads/{i}/file{i}', CreatedByUser=creator, CreatedDateTime=now),
+        ])
+        if i % 2:
+            # An unassigned task whose creator has no first name
+            db.session.add(Task(Title=f'unassigned{i}', CreatedByUser=User(Username=f'anon{i}', LastName='Anon', Company=company)))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def list_and_serialize(model):
+    return [row.serialize() for row in model.query.options(*serialize_loaders(model)).all()]
+
+
+@pytest.mark.parametrize('model', [Task, Card, TextBox, Image, Url, Folder, Workspace, Page])
+def test_list_query_count_is_constant(app, count_queries, model):
+    seed(2)
+    few, rows = count_queries(lambda: list_and_serialize(model))
+    assert rows
+
+    seed(20)
+    many, rows = count_queries(lambda: list_and_serialize(model))
+    assert few == many
+
+
+def test_task_serialize_reads_eager_loaded_names(app, count_queries):
+    seed(3)
+    queries, tasks = count_queries(lambda: list_and_serialize(Task))
+    assert queries == 1
+    task = next(task for task in tasks if task['title'] == 'task0')
+    assert task['assignedToName'] == 'Assignee 0'
+    assert task['createdByName'] == 'Creator 0'
+    assert task['pageName'] == 'page0'
+
+
+def test_page_vault_id_is_joined(app, count_queries):
+    seed(3)
+    queries, pages = count_queries(lambda: list_and_serialize(Page))
+    assert queries == 1
+    vaultIds = {vault.Name: vault.Id for vault in Vault.query.all()}
+    assert {page['name']: page['vaultId'] for page in pages} == {f'page{i}': vaultIds[f'vault{i}'] for i in range(3)}
+
+
+@pytest.mark.parametrize('model, statement, serialize_row', [
+    (Task, select_tasks_by_company, serialize_task_row),
+    (Card, select_cards_by_company, serialize_card_row),
+    (File, select_files_by_company, serialize_file_row),
+])
+def test_projection_matches_serialize(app, model, statement, serialize_row):
+    seed(4)
+    companyId = Company.query.one().Id
+    expected = {row['id']: row for row in list_and_serialize(model)}
+    db.session.expunge_all()
+    projected = {row['id']: row for row in map(serialize_row, db.session.execute(statement(companyId)))}
+    assert projected == expected
+    assert all(list(projected[id]) == list(expected[id]) for id in expected)
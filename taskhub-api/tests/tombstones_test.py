@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from sqlalchemy import update
+
+from database import db
+from models import Workspace, Page, Task, Card, TextBox, Image, File, Url, Folder, FavoriteTasks, CardConnection, Blob, User
+from blobStore import put_stream
+from tombstones import tombstone, tombstone_pages, tombstone_tasks, purge_tombstones, in_purge_hours, TOMBSTONE_RETENTION
+
+
+def build_page(name, contentHash):
+    page = Page(Name=name, Workspace=Workspace(Name=f'{name}-ws'))
+    task = Task(Title='task', Page=page, ChildTasks=[Task(Title='subtask', Page=page, ChildTasks=[Task(Title='leaf')])])
+    cards = [Card(Name='from', Page=page), Card(Name='to', Page=page)]
+    db.session.add_all([task, *cards, TextBox(Text='note', Page=page),
+                        Image(Name='logo', Page=page, ContentHash=contentHash, ContentSize=6)])
+    db.session.flush()
+    db.session.add_all([CardConnection(FromCardId=cards[0].Id, ToCardId=cards[1].Id),
+                        File(Name='a.pdf', Path='a', ContentHash=contentHash, Size=6, PageId=page.Id)])
+    db.session.commit()
+    return page.Id
+
+
+def age_tombstones(age):
+    for model in (Page, Task, Card, TextBox, Image, File, Url):
+        db.session.execute(update(model).where(model.DeletedAt.is_not(None)).values(DeletedAt=datetime.now() - age)
+                           .execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def test_page_delete_hides_the_page_and_its_contents_until_purged(app, blobs, count_queries):
+    contentHash, _ = put_stream(BytesIO(b'shared'))
+    keptPageId = build_page('kept', contentHash)
+    pageId = build_page('doomed', contentHash)
+    assert db.session.get(Blob, contentHash).RefCount == 4
+
+    queries, marked = count_queries(lambda: tombstone_pages(Page.Id == pageId))
+    db.session.commit()
+    # One UPDATE per table, however much the page holds, each with its change feed INSERT
+    assert (queries, marked) == (2 * 6, 1)
+    assert db.session.get(Page, pageId) is None
+    assert [page.Id for page in Page.query] == [keptPageId]
+    for model in (Card, TextBox, Image, File):
+        assert {row.PageId for row in model.query} == {keptPageId}
+    # The subtasks go along, even those not placed on the page themselves
+    assert Task.query.count() == 3 and Task.query.execution_options(include_deleted=True).count() == 6
+    # Deleting again finds nothing live
+    assert tombstone_pages(Page.Id == pageId) == 0
+
+    # Nothing is purged before the retention period is over
+    assert purge_tombstones() == {}
+    age_tombstones(TOMBSTONE_RETENTION + timedelta(hours=1))
+    counts = purge_tombstones()
+    assert counts['pages'] == 1 and counts['tasks'] == 3 and counts['card_connections'] == 1
+    assert Page.query.execution_options(include_deleted=True).count() == 1
+    assert Task.query.execution_options(include_deleted=True).count() == 3
+    assert db.session.get(Blob, contentHash).RefCount == 2
+    assert purge_tombstones() == {}
+
+
+def test_task_delete_takes_its_subtasks_and_drops_out_of_favorites(app):
+    user = User(Username='owner')
+    task = Task(Title='root', ChildTasks=[Task(Title='child', ChildTasks=[Task(Title='grandchild')])])
+    other = Task(Title='other')
+    db.session.add_all([FavoriteTasks(Task=task, User=user), FavoriteTasks(Task=other, User=user)])
+    db.session.commit()
+    taskId, otherId = task.Id, other.Id
+
+    assert tombstone_tasks(Task.Id == taskId) == 3
+    db.session.commit()
+    assert [task.Id for task in Task.query] == [otherId]
+    favorites = FavoriteTasks.query.join(Task, FavoriteTasks.TaskId == Task.Id).all()
+    assert [favorite.TaskId for favorite in favorites] == [otherId]
+
+
+def test_purge_runs_in_batches_of_each_kind(app):
+    folder = Folder(Name='folder')
+    db.session.add_all([Task(Title=f'task{i}') for i in range(5)] + [Url(Name=f'url{i}', Folder=folder) for i in range(3)])
+    db.session.commit()
+    tombstone(Task, Task.Title != 'task4')
+    tombstone(Url, Url.Name != 'url2')
+    db.session.commit()
+    age_tombstones(timedelta(days=1))
+
+    assert purge_tombstones(retention=timedelta(days=2)) == {}
+    batches = []
+    while True:
+        counts = purge_tombstones(batchSize=3, retention=timedelta(hours=1))
+        if not counts:
+            break
+        batches.append((counts['tasks'], counts['urls']))
+    assert batches == [(3, 2), (1, 0)]
+    assert [task.Title for task in Task.query.execution_options(include_deleted=True)] == ['task4']
+    assert [url.Name for url in Url.query.execution_options(include_deleted=True)] == ['url2']
+
+
+def test_purge_hours_window():
+    at = lambda hour: datetime(2026, 10, 18, hour, 30)
+    assert [hour for hour in range(24) if in_purge_hours('2-5', at(hour))] == [2, 3, 4]
+    assert [hour for hour in range(24) if in_purge_hours('22-2', at(hour))] == [0, 1, 22, 23]
+    assert all(in_purge_hours('0-24', at(hour)) for hour in range(24))
@@ -0,0 +1,135 @@
+from io import BytesIO
+
+import pytest
+from sqlalchemy import event, text
+
+from database import db
+from models import (Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, File, Url, Collaboration,
+                    FavoriteTasks, PinnedTasks, CardConnection, Blob, User)
+from blobStore import put_stream
+from treeDeletes import delete_vault
+
+
+def build_vault(name, size, sharedHash, user):
+    vault = Vault(Name=name)
+    root = Folder(Name='root', Vault=vault)
+    nested = Folder(Name='nested', ParentFolder=Folder(Name='child', ParentFolder=root))
+    db.session.add_all([vault, nested, Url(Name='link', Folder=nested)])
+    for i in range(size):
+        workspace = Workspace(Name=f'ws{i}', Folder=nested if i % 2 else root)
+        page = Page(Name=f'page{i}', Workspace=workspace)
+        task = Task(Title=f'task{i}', Page=page, ChildTasks=[Task(Title='subtask', Page=page)])
+        cards = [Card(Name=f'card{i}', Page=page), Card(Name='other', Page=page)]
+        db.session.add_all([
+            task, *cards, TextBox(Text='note', Page=page),
+            Image(Name='logo', Page=page, ContentHash=sharedHash, ContentSize=6),
+            FavoriteTasks(Task=task, User=user), PinnedTasks(Task=task, User=user),
+            Collaboration(Workspace=workspace, User=user),
+        ])
+        db.session.flush()
+        db.session.add_all([
+            CardConnection(FromCardId=cards[0].Id, ToCardId=cards[1].Id),
+            File(Name='a.pdf', Path='a', ContentHash=sharedHash, Size=6, PageId=page.Id),
+            File(Name='b.pdf', Path='b', ContentHash=sharedHash, Size=6, WorkspaceId=workspace.Id),
+            File(Name='c.pdf', Path='c', ContentHash=sharedHash, Size=6, Folder=nested),
+        ])
+    db.session.add(Collaboration(Vault=vault, User=user))
+    db.session.commit()
+    return vault.Id
+
+
+def test_vault_delete_is_a_fixed_set_of_statements(app, blobs, count_queries):
+    user = User(Username='owner')
+    sharedHash, _ = put_stream(BytesIO(b'shared'))
+    keptVault = build_vault('kept', 1, sharedHash, user)
+    smallVault = build_vault('small', 1, sharedHash, user)
+    bigVault = build_vault('big', 10, sharedHash, user)
+    # A workspace outside the vault, generated from a task inside it
+    keptWorkspace = Workspace(Name='spin-off', Folder=Folder.query.filter_by(VaultId=keptVault).first(),
+                              CreatedFromTaskId=Task.query.join(Page).join(Workspace).join(Folder)
+                              .filter(Folder.VaultId == bigVault).first().Id)
+    db.session.add(keptWorkspace)
+    db.session.commit()
+    keptWorkspaceId = keptWorkspace.Id
+    assert db.session.get(Blob, sharedHash).RefCount == 4 * 12
+
+    parameters = []
+    collect = lambda conn, cursor, statement, params, context, executemany: parameters.append(len(params))
+    event.listen(db.engine, 'before_cursor_execute', collect)
+    smallQueries, counts = count_queries(lambda: delete_vault(smallVault))
+    db.session.commit()
+    assert counts['vaults'] == 1 and counts['tasks'] == 2 and counts['files'] == 3
+    smallParameters, parameters[:] = list(parameters), []
+    bigQueries, counts = count_queries(lambda: delete_vault(bigVault))
+    db.session.commit()
+    event.remove(db.engine, 'before_cursor_execute', collect)
+    assert bigQueries == smallQueries
+    # The folder tree is a subquery, not a list of bound ids
+    assert parameters == smallParameters
+    assert counts['folders'] == 3 and counts['workspaces'] == 10 and counts['cards'] == 20 and counts['files'] == 30
+
+    # Only the kept vault is left, with the references into the deleted one cleared
+    assert [vault.Id for vault in Vault.query] == [keptVault]
+    assert Folder.query.count() == 3 and Workspace.query.count() == 2 and Page.query.count() == 1
+    assert Task.query.count() == 2 and Card.query.count() == 2 and TextBox.query.count() == 1
+    assert Image.query.count() == 1 and File.query.count() == 3 and Url.query.count() == 1
+    assert FavoriteTasks.query.count() == PinnedTasks.query.count() == CardConnection.query.count() == 1
+    assert Collaboration.query.count() == 2
+    assert db.session.get(Workspace, keptWorkspaceId).CreatedFromTaskId is None
+    assert db.session.get(Blob, sharedHash).RefCount == 4
+
+
+@pytest.fixture
+def foreign_keys(app):
+    """Enforce foreign keys, and with them ON DELETE CASCADE, which SQLite leaves off by default"""
+    db.session.commit()
+    db.session.execute(text('PRAGMA foreign_keys=ON'))
+    yield
+    db.session.rollback()
+    db.session.execute(text('PRAGMA foreign_keys=OFF'))
+
+
+def build_page(workspace, size, sharedHash, user):
+    page = Page(Name=f'page{size}', Workspace=workspace)
+    for i in range(size):
+        task = Task(Title=f'task{i}', Page=page, ChildTasks=[Task(Title='subtask', Page=page)])
+        cards = [Card(Name=f'card{i}', Page=page), Card(Name='other', Page=page)]
+        db.session.add_all([task, *cards, TextBox(Text='note', Page=page),
+                            Image(Name='logo', Page=page, ContentHash=sharedHash, ContentSize=6),
+                            FavoriteTasks(Task=task, User=user)])
+        db.session.flush()
+        db.session.add_all([CardConnection(FromCardId=cards[0].Id, ToCardId=cards[1].Id),
+                            File(Name='a.pdf', Path='a', ContentHash=sharedHash, Size=6, PageId=page.Id)])
+    db.session.commit()
+    return page.Id
+
+
+def test_orm_deletes_cascade_in_the_database(app, blobs, foreign_keys, count_queries):
+    user = User(Username='owner')
+    sharedHash, _ = put_stream(BytesIO(b'shared'))
+    folder = Folder(Name='root', ChildFolders=[Folder(Name='child')])
+    workspace = Workspace(Name='ws', Folder=folder)
+    db.session.add_all([folder, Url(Name='link', Folder=folder), Collaboration(Workspace=workspace, User=user),
+                        File(Name='f.pdf', Path='f', ContentHash=sharedHash, Size=6, Folder=folder)])
+    smallPage = build_page(workspace, 1, sharedHash, user)
+    bigPage = build_page(workspace, 10, sharedHash, user)
+    build_page(workspace, 1, sharedHash, user)
+    assert db.session.get(Blob, sharedHash).RefCount == 2 * 12 + 1
+
+    def delete(model, id):
+        db.session.delete(db.session.get(model, id))
+        db.session.commit()
+
+    # Loading the page is the only query besides the change feed INSERT and numbering, the blob UPDATE and the one DELETE
+    smallQueries, _ = count_queries(lambda: delete(Page, smallPage))
+    bigQueries, _ = count_queries(lambda: delete(Page, bigPage))
+    assert smallQueries == bigQueries == 5
+    assert Task.query.count() == 2 and Card.query.count() == 2 and TextBox.query.count() == 1
+    assert CardConnection.query.count() == FavoriteTasks.query.count() == Image.query.count() == 1
+    assert File.query.count() == 2
+    assert db.session.get(Blob, sharedHash).RefCount == 3
+
+    delete(Folder, folder.Id)
+    for model in (Folder, Workspace, Page, Task, Card, TextBox, Image, File, Url, Collaboration, FavoriteTasks):
+        assert model.query.count() == 0, model
+    assert db.session.get(Blob, sharedHash).RefCount == 0
@@ -0,0 +1,61 @@
+import hashlib
+import os
+from io import BytesIO
+
+import pytest
+
+from database import db
+from models import UploadSession
+from blobStore import file_content_hash
+from blobStore import blob_path
+from uploadSessions import create_session, append_chunk, part_path, complete_session, discard_session
+
+CONTENT = os.urandom(200 * 1024)
+
+
+@pytest.fixture
+def session(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['BLOB_FOLDER'] = str(tmp_path / 'blobs')
+    session = create_session(Name='report.pdf', Size=len(CONTENT), PageId=7)
+    db.session.commit()
+    return session
+
+
+def test_chunks_are_appended_and_verified(session):
+    append_chunk(session, BytesIO(CONTENT[:100000]))
+    assert session.Received == 100000
+    append_chunk(session, BytesIO(CONTENT[100000:]))
+    assert session.Received == len(CONTENT)
+    assert file_content_hash(part_path(session)) == hashlib.sha256(CONTENT).hexdigest()
+
+    contentHash = hashlib.sha256(CONTENT).hexdigest()
+    complete_session(session, contentHash)
+    db.session.commit()
+    with open(blob_path(contentHash), 'rb') as stored:
+        assert stored.read() == CONTENT
+    assert UploadSession.query.count() == 0
+
+
+def test_cut_off_chunk_is_overwritten_on_resume(session):
+    append_chunk(session, BytesIO(CONTENT[:1000]))
+    # A chunk that died mid-transfer left bytes on disk without advancing the offset
+    with open(part_path(session), 'ab') as part:
+        part.write(b'garbage')
+    append_chunk(session, BytesIO(CONTENT[1000:]))
+    assert file_content_hash(part_path(session)) == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_chunk_past_declared_size_is_rejected(session):
+    with pytest.raises(ValueError):
+        append_chunk(session, BytesIO(CONTENT + b'extra'))
+    assert session.Received == 0
+
+
+def test_discard_removes_part_file(session):
+    path = part_path(session)
+    assert os.path.exists(path)
+    discard_session(session)
+    db.session.commit()
+    assert not os.path.exists(path)
+    assert UploadSession.query.count() == 0
@@ -0,0 +1,45 @@
+from database import db
+from models import User, Task
+from nameCache import DisplayNameCache, displayNames
+
+
+def test_cache_evicts_least_recently_used():
+    cache = DisplayNameCache(maxSize=2)
+    users = {i: User(Id=i, FirstName='User', LastName=str(i)) for i in range(3)}
+    assert cache.get(0, lambda: users[0]) == 'User 0'
+    assert cache.get(1, lambda: users[1]) == 'User 1'
+    assert cache.get(0, lambda: None) == 'User 0'
+    cache.get(2, lambda: users[2])
+    # 1 was least recently used and got evicted
+    assert cache.get(1, lambda: None) == ''
+    assert cache.stats() == {'size': 2, 'maxSize': 2, 'hits': 1, 'misses': 4}
+
+
+def test_serialize_hits_cache_without_loading_users(app, count_queries):
+    user = User(Username='jane', FirstName='Jane', LastName='Doe')
+    db.session.add_all([Task(Title=f'task{i}', CreatedByUser=user, AssignedUser=user) for i in range(5)])
+    db.session.commit()
+    db.session.expunge_all()
+
+    queries, tasks = count_queries(lambda: [task.serialize() for task in Task.query.all()])
+    # One query for the tasks and one lazy load of the user on the first miss
+    assert queries == 2
+    assert {task['createdByName'] for task in tasks} == {'Jane Doe'}
+    assert displayNames.stats()['misses'] == 1
+
+
+def test_commit_invalidates_changed_user(app):
+    user = User(Username='jane', FirstName='Jane', LastName='Doe')
+    task = Task(Title='task', CreatedByUser=user)
+    db.session.add(task)
+    db.session.commit()
+    assert task.serialize()['createdByName'] == 'Jane Doe'
+
+    user.LastName = 'Smith'
+    db.session.flush()
+    db.session.rollback()
+    assert task.serialize()['createdByName'] == 'Jane Doe'
+
+    user.LastName = 'Smith'
+    db.session.commit()
+    assert task.serialize()['createdByName'] == 'Jane Smith'
@@ -0,0 +1,33 @@
+from database import db
+from models import User, Vault, Collaboration, Folder, Workspace
+from loaders import serialize_loaders
+
+
+def list_vaults():
+    return [vault.serialize() for vault in Vault.query.options(*serialize_loaders(Vault)).all()]
+
+
+def test_vault_listing_is_one_query(app, count_queries):
+    owner = User(Username='owner', FirstName='Vault', LastName='Owner')
+    members = [User(Username=f'member{i}') for i in range(3)]
+    shared = Vault(Name='shared', CreatedByUser=owner)
+    folder = Folder(Name='Documents', Vault=shared)
+    workspace = Workspace(Name='workspace', Folder=folder)
+    db.session.add_all([
+        shared,
+        Vault(Name='empty', CreatedByUser=owner),
+        # The same member collaborating on the vault and on things inside it counts once
+        Collaboration(Vault=shared, User=members[0]),
+        Collaboration(Vault=shared, User=members[1]),
+        Collaboration(Vault=shared, User=members[1], Folder=folder),
+        Collaboration(Vault=shared, User=members[2], Workspace=workspace),
+    ])
+    db.session.commit()
+    db.session.expunge_all()
+
+    queries, vaults = count_queries(list_vaults)
+    assert queries == 1
+    byName = {vault['name']: vault for vault in vaults}
+    assert byName['shared']['numOfUsers'] == 3
+    assert byName['empty']['numOfUsers'] == 0
+    assert byName['shared']['createdByName'] == 'Vault Owner'
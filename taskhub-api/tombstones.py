@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import event, select, update, and_
+from sqlalchemy.orm import Session, with_loader_criteria
+from database import db
+from models import Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, File, Url
+from treeDeletes import task_tree_query, delete_tree
+from changeFeed import record_changes, trim_changes
+
+# Deleting a row only sets its DeletedAt, a tombstone, with one UPDATE (a task
+# takes its subtasks along, a page one UPDATE per table of its contents). The
+# rows stay in their tables until purge_tombstones removes them later,
+# off-peak and in small batches.
+# Vaults, folders and workspaces are tombstoned the same way, but purged by
+# the background job their delete queues (deletionJobs.py).
+#
+# Every ORM SELECT leaves tombstoned rows out, and so do the relationship and
+# eager loads of its results, so a deleted row disappears from listings and
+# lookups the moment it is marked. The lookup indexes of these tables only
+# cover the live rows (models.tombstone_indexes). Statements that must still
+# see tombstones, such as the purge, pass execution_options(include_deleted=True).
+#
+# `flask purge-tombstones` purges from cron. With TOMBSTONE_PURGE_INTERVAL set,
+# each API process also purges one batch that often, but only within the
+# TOMBSTONE_PURGE_HOURS window, e.g. '2-5' for 2:00 to 4:59.
+
+TOMBSTONED_MODELS = (Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, File, Url)
+# Tombstones younger than this are left alone
+TOMBSTONE_RETENTION = timedelta(days=7)
+TOMBSTONE_PURGE_BATCH_SIZE = 200
+# delete_tree argument for the ids of each model purge_tombstones purges
+PURGED_MODELS = (('pageIds', Page), ('taskIds', Task), ('cardIds', Card), ('textBoxIds', TextBox),
+                 ('imageIds', Image), ('fileIds', File), ('urlIds', Url))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _hide_deleted(state):
+    # Relationship and column loads inherit the criteria from the query that loaded their parent
+    if not state.is_select or state.is_column_load or state.is_relationship_load \
+            or state.execution_options.get('include_deleted', False):
+        return
+    state.statement = state.statement.options(*(
+        with_loader_criteria(model, lambda cls: cls.DeletedAt.is_(None), include_aliases=True)
+        for model in TOMBSTONED_MODELS
+    ))
+
+
+def tombstone(model, condition, now=None):
+    """Mark the live rows of model matching condition deleted, in one UPDATE; returns how many were marked.
+
+    The change feed (changeFeed.py) records the deletes with one more statement.
+    """
+    now = now or datetime.now()
+    values = {'DeletedAt': now}
+    if 'LastModifyDateTime' in model.__table__.c:
+        values['LastModifyDateTime'] = now
+    record_changes(db.session, model, and_(condition, model.DeletedAt.is_(None)), now)
+    return db.session.execute(update(model).where(condition, model.DeletedAt.is_(None)).values(values)
+                              .execution_options(synchronize_session=False)).rowcount
+
+
+def tombstone_pages(pageCondition, now=None):
+    """Mark pages deleted with their tasks and subtasks, cards, text boxes, images and files; returns how many pages were marked"""
+    now = now or datetime.now()
+    pages = select(Page.Id).where(pageCondition)
+    tombstone_tasks(Task.PageId.in_(pages), now)
+    for model in (Card, TextBox, Image, File):
+        tombstone(model, model.PageId.in_(pages), now)
+    return tombstone(Page, pageCondition, now)
+
+
+def tombstone_tasks(taskCondition, now=None):
+    """Mark tasks deleted with all their subtasks, in one UPDATE; returns how many were marked"""
+    return tombstone(Task, Task.Id.in_(task_tree_query(taskCondition)), now)
+
+
+def purge_tombstones(batchSize=TOMBSTONE_PURGE_BATCH_SIZE, retention=TOMBSTONE_RETENTION):
+    """Delete up to batchSize rows of each kind tombstoned longer than retention ago, in one transaction.
+
+    The change feed is trimmed to the same retention along the way. Returns
+    the number of rows deleted per table, or an empty dict when nothing was due.
+    """
+    cutoff = datetime.now() - retention
+    ids = {argument: db.session.execute(
+        select(model.Id).where(model.DeletedAt < cutoff).order_by(model.DeletedAt).limit(batchSize)
+        .execution_options(include_deleted=True)).scalars().all() for argument, model in PURGED_MODELS}
+    counts = delete_tree(**ids) if any(ids.values()) else {}
+    trimmed = trim_changes(cutoff, batchSize)
+    if trimmed:
+        counts['changes'] = trimmed
+    db.session.commit()
+    return counts
+
+
+def in_purge_hours(hours, now=None):
+    """Whether now falls within a window of hours like '2-5', which may wrap past midnight ('22-4')"""
+    start, end = (int(hour) for hour in hours.split('-'))
+    hour = (now or datetime.now()).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def init_app(app):
+    @app.cli.command('purge-tombstones')
+    @click.option('--batch-size', default=TOMBSTONE_PURGE_BATCH_SIZE, help='Rows of each kind to purge per transaction')
+    @click.option('--retention-days', default=TOMBSTONE_RETENTION.days, help='Only purge rows deleted longer ago than this')
+    @click.option('--all', 'untilComplete', is_flag=True, help='Keep purging until no tombstone is due')
+    @click.option('--pause', default=0.0, help='Seconds to wait between batches')
+    def purge_tombstones_command(batch_size, retention_days, untilComplete, pause):
+        """Delete the rows that have been marked deleted for longer than the retention period"""
+        total = {}
+        while True:
+            counts = purge_tombstones(batch_size, timedelta(days=retention_days))
+            for table, count in counts.items():
+                total[table] = total.get(table, 0) + count
+            if not counts or not untilComplete:
+                break
+            time.sleep(pause)
+        click.echo('Purged ' + (', '.join(f'{count} {table}' for table, count in total.items() if count) or 'nothing'))
+
+    # Optional in-process purge: one batch every TOMBSTONE_PURGE_INTERVAL seconds within TOMBSTONE_PURGE_HOURS
+    interval = app.config.get('TOMBSTONE_PURGE_INTERVAL')
+    if interval:
+        hours = app.config.get('TOMBSTONE_PURGE_HOURS') or '0-24'
+
+        def run():
+            while True:
+                time.sleep(interval)
+                if not in_purge_hours(hours):
+                    continue
+                with app.app_context():
+                    try:
+                        purge_tombstones()
+                    except Exception:
+                        db.session.rollback()
+                        app.logger.exception('Tombstone purge failed')
+        threading.Thread(target=run, name='tombstone-purge', daemon=True).start()
@@ -0,0 +1,151 @@
+from sqlalchemy import event, select, delete, update, and_, or_, false
+from sqlalchemy.orm import object_session
+from database import db
+from models import (Vault, Folder, Workspace, Page, Task, Card, TextBox, Image, File, Url, Collaboration,
+                    FavoriteTasks, PinnedTasks, CardConnection, UploadSession)
+from blobStore import release_references
+from changeFeed import record_changes
+
+# Set-based deletion of whole trees. A vault, folder or workspace and
+# everything below it is removed with a fixed sequence of
+# DELETE ... WHERE ... IN (subquery) statements, leaves first, however many rows
+# the tree holds; nothing is loaded into the session. The same statements clear
+# references into the tree from outside it (workspaces generated from its
+# tasks or cards, favorites, pins, card connections, collaborations) and
+# release the blob references of its files and images.
+# Rows already marked deleted (tombstones.py) are part of the trees here.
+
+
+def _subtree_query(model, rootCondition):
+    # Nested, so an UPDATE ... WHERE Id IN (this) still reports its row count on SQLite
+    tree = select(model.Id).where(rootCondition).cte(f'tree_{model.__tablename__}', recursive=True, nesting=True)
+    # UNION rather than UNION ALL, so a ParentId cycle cannot recurse forever
+    tree = tree.union(select(model.Id).where(model.ParentId == tree.c.Id))
+    return select(tree.c.Id)
+
+
+def folder_tree_query(rootCondition):
+    """SELECT of the ids of the folders matching rootCondition and all their descendants"""
+    return _subtree_query(Folder, rootCondition)
+
+
+def task_tree_query(rootCondition):
+    """SELECT of the ids of the tasks matching rootCondition and all their subtasks"""
+    return _subtree_query(Task, rootCondition)
+
+
+def _run(statement):
+    return db.session.execute(statement.execution_options(synchronize_session=False)).rowcount
+
+
+def _in(column, ids):
+    return column.in_(ids) if ids is not None else false()
+
+
+def delete_tree(folderIds=None, workspaceIds=None, pageIds=None, taskIds=None, cardIds=None, textBoxIds=None,
+                imageIds=None, fileIds=None, urlIds=None):
+    """Delete the folders in folderIds (a whole tree, see folder_tree_query), the workspaces in workspaceIds and the pages in pageIds, with everything below them.
+
+    Each argument is a list of ids or a SELECT of them, such as
+    folder_tree_query(), which the statements embed as a subquery instead of
+    binding every id. The other ids name single rows to delete as well, e.g. a
+    batch of tombstones (tombstones.py); a task takes its subtasks only when
+    they are in taskIds too. Runs in the caller's transaction; returns the
+    number of rows deleted per table.
+    """
+    folders = folderIds
+    workspaces = select(Workspace.Id).where(or_(_in(Workspace.FolderId, folders), _in(Workspace.Id, workspaceIds)))
+    pageCondition = or_(Page.WorkspaceId.in_(workspaces), _in(Page.Id, pageIds))
+    pages = select(Page.Id).where(pageCondition)
+    taskCondition = or_(Task.PageId.in_(pages), _in(Task.Id, taskIds))
+    tasks = select(Task.Id).where(taskCondition)
+    cardCondition = or_(Card.PageId.in_(pages), _in(Card.Id, cardIds))
+    cards = select(Card.Id).where(cardCondition)
+    fileCondition = or_(File.PageId.in_(pages), File.WorkspaceId.in_(workspaces), _in(File.FolderId, folders),
+                        _in(File.Id, fileIds))
+    imageCondition = or_(Image.PageId.in_(pages), _in(Image.Id, imageIds))
+    counts = {}
+
+    # References from outside the tree, changes of the rows that hold them
+    for model, condition, values in (
+            (Workspace, Workspace.CreatedFromTaskId.in_(tasks), {'CreatedFromTaskId': None}),
+            (Workspace, Workspace.CreatedFromCardId.in_(cards), {'CreatedFromCardId': None}),
+            (Task, and_(Task.ParentId.in_(tasks), Task.Id.notin_(tasks)), {'ParentId': None})):
+        record_changes(db.session, model, condition)
+        _run(update(model).where(condition).values(values))
+    counts['favoritetasks'] = _run(delete(FavoriteTasks).where(FavoriteTasks.TaskId.in_(tasks)))
+    counts['pinnedtasks'] = _run(delete(PinnedTasks).where(PinnedTasks.TaskId.in_(tasks)))
+    counts['card_connections'] = _run(delete(CardConnection).where(
+        or_(CardConnection.FromCardId.in_(cards), CardConnection.ToCardId.in_(cards))))
+    counts['collaborations'] = _run(delete(Collaboration).where(or_(
+        Collaboration.FileId.in_(select(File.Id).where(fileCondition)),
+        Collaboration.WorkspaceId.in_(workspaces), _in(Collaboration.FolderId, folders))))
+    counts['upload_sessions'] = _run(delete(UploadSession).where(or_(
+        UploadSession.PageId.in_(pages), UploadSession.WorkspaceId.in_(workspaces), _in(UploadSession.FolderId, folders))))
+
+    # The bulk DELETEs bypass the mapper events that keep the blob reference
+    # counts, so the references of the doomed files and images are released here
+    release_references(db.session, fileCondition, imageCondition)
+
+    # The tree itself, leaves first
+    counts['files'] = _run(delete(File).where(fileCondition))
+    counts['images'] = _run(delete(Image).where(imageCondition))
+    counts['textbox'] = _run(delete(TextBox).where(or_(TextBox.PageId.in_(pages), _in(TextBox.Id, textBoxIds))))
+    counts['cards'] = _run(delete(Card).where(cardCondition))
+    counts['tasks'] = _run(delete(Task).where(taskCondition))
+    counts['pages'] = _run(delete(Page).where(pageCondition))
+    counts['workspaces'] = _run(delete(Workspace).where(Workspace.Id.in_(workspaces)))
+    counts['urls'] = _run(delete(Url).where(or_(_in(Url.FolderId, folders), _in(Url.Id, urlIds))))
+    if folders is not None:
+        counts['folders'] = _run(delete(Folder).where(Folder.Id.in_(folders)))
+    # Objects of the tree still in the session are gone from the database
+    db.session.expire_all()
+    return counts
+
+
+def delete_pages(pageIds):
+    """Delete pages with their tasks, cards, text boxes, images and files; returns the number of rows deleted per table"""
+    return delete_tree(pageIds=pageIds)
+
+
+def delete_vault(vaultId):
+    """Delete a vault with all its folders and their contents; returns the number of rows deleted per table"""
+    counts = delete_tree(folder_tree_query(Folder.VaultId == vaultId))
+    counts['collaborations'] += _run(delete(Collaboration).where(Collaboration.VaultId == vaultId))
+    counts['vaults'] = _run(delete(Vault).where(Vault.Id == vaultId))
+    return counts
+
+
+# The database cascades the delete of a single folder, workspace or page
+# through ON DELETE CASCADE, and the relationships are passive, so
+# session.delete() issues one DELETE for the whole subtree. The files and
+# images it takes along never reach the mapper events, so their blob
+# references are released just before, in one UPDATE. Files and images the
+# same flush deletes itself are left to the mapper events.
+def _release_subtree_blobs(connection, target, fileCondition, imageCondition):
+    session = object_session(target)
+    deletedIds = lambda model: [obj.Id for obj in session.deleted if isinstance(obj, model) and obj.Id is not None]
+    release_references(connection, and_(fileCondition, File.Id.notin_(deletedIds(File))),
+                       and_(imageCondition, Image.Id.notin_(deletedIds(Image))))
+
+
+@event.listens_for(Folder, 'before_delete')
+def _release_folder_blobs(mapper, connection, target):
+    folders = folder_tree_query(Folder.Id == target.Id)
+    workspaces = select(Workspace.Id).where(Workspace.FolderId.in_(folders))
+    pages = select(Page.Id).where(Page.WorkspaceId.in_(workspaces))
+    _release_subtree_blobs(connection, target,
+                           or_(File.FolderId.in_(folders), File.WorkspaceId.in_(workspaces), File.PageId.in_(pages)),
+                           Image.PageId.in_(pages))
+
+
+@event.listens_for(Workspace, 'before_delete')
+def _release_workspace_blobs(mapper, connection, target):
+    pages = select(Page.Id).where(Page.WorkspaceId == target.Id)
+    _release_subtree_blobs(connection, target, or_(File.WorkspaceId == target.Id, File.PageId.in_(pages)),
+                           Image.PageId.in_(pages))
+
+
+@event.listens_for(Page, 'before_delete')
+def _release_page_blobs(mapper, connection, target):
+    _release_subtree_blobs(connection, target, File.PageId == target.Id, Image.PageId == target.Id)
@@ -0,0 +1,171 @@
+import os
+import click
+from sqlalchemy import select, update
+from database import db
+from models import File
+from blobStore import blob_folder, blob_key, blob_path, file_content_hash, is_content_hash
+from storageBackends import storage, write_atomically
+from changeFeed import record_changes
+from imageVariants import IMAGE_VARIANTS, variant_path
+
+# One-off move of the uploads tree into the fanned-out blob layout (see
+# blobStore.py). Each batch
+#   - moves blobs sitting directly in the blob folder into their ab/cd/ shard,
+#   - does the same for cached image variants,
+#   - hashes files still stored in the legacy per-page/folder layout (rows
+#     without a ContentHash) and moves them into the blob store.
+# A file is linked (or copied) to its new path and the rows are committed
+# before the old path is removed, so downloads keep working while it runs and
+# an interrupted run can simply be started again.
+# With a remote storage backend the same command uploads the local blobs and
+# legacy files into the bucket instead; cached variants are rendered again on
+# demand.
+
+LAYOUT_BATCH_SIZE = 500
+
+
+def _link(source, destination):
+    """Make destination a copy of source, as a hard link where the filesystem allows it"""
+    if os.path.exists(destination):
+        return
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        pass
+    except OSError:
+        with open(source, 'rb') as stream:
+            write_atomically(destination, stream)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _flat_entries(folder, batchSize, suffix=''):
+    """Up to batchSize (content hash, path) pairs stored directly in folder"""
+    entries = []
+    try:
+        scan = os.scandir(folder)
+    except FileNotFoundError:
+        return entries
+    with scan:
+        for entry in scan:
+            contentHash = entry.name[:-len(suffix)] if suffix and entry.name.endswith(suffix) else entry.name
+            if (not suffix or entry.name.endswith(suffix)) and is_content_hash(contentHash) \
+                    and entry.is_file(follow_symlinks=False):
+                entries.append((contentHash, entry.path))
+                if len(entries) >= batchSize:
+                    break
+    return entries
+
+
+def _store(path, contentHash):
+    """Put a local file into the storage backend under its blob key and return the blob location"""
+    backend = storage()
+    if backend.remote:
+        if not backend.touch(blob_key(contentHash)):
+            with open(path, 'rb') as stream:
+                backend.put_stream(blob_key(contentHash), stream)
+    else:
+        _link(path, blob_path(contentHash))
+    return backend.location(blob_key(contentHash))
+
+
+def _local_blobs(batchSize):
+    """Up to batchSize (content hash, path) pairs of blobs on local disk, in either layout"""
+    entries = []
+    for directory, directories, names in os.walk(blob_folder()):
+        if os.path.normpath(directory) == os.path.normpath(blob_folder()) and 'variants' in directories:
+            directories.remove('variants')
+        entries += [(name, os.path.join(directory, name)) for name in names if is_content_hash(name)]
+        if len(entries) >= batchSize:
+            break
+    return entries[:batchSize]
+
+
+def migrate_flat_blobs(batchSize=LAYOUT_BATCH_SIZE):
+    """Move up to batchSize flat blobs into their shard (or all local blobs into a remote backend) and return how many were moved"""
+    entries = _local_blobs(batchSize) if storage().remote else _flat_entries(blob_folder(), batchSize)
+    for contentHash, path in entries:
+        location = _store(path, contentHash)
+        record_changes(db.session, File, File.Path == path)
+        db.session.execute(update(File).where(File.Path == path).values(Path=location))
+    db.session.commit()
+    for _, path in entries:
+        _remove(path)
+    return len(entries)
+
+
+def migrate_flat_variants(batchSize=LAYOUT_BATCH_SIZE):
+    """Move up to batchSize cached variants into their shard; nothing in the database points at them"""
+    if storage().remote:
+        return 0
+    moved = 0
+    for variant in IMAGE_VARIANTS:
+        for contentHash, path in _flat_entries(os.path.join(blob_folder(), 'variants', variant), batchSize - moved, '.webp'):
+            destination = variant_path(contentHash, variant)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(path, destination)
+            moved += 1
+        if moved >= batchSize:
+            break
+    return moved
+
+
+def migrate_legacy_files(batchSize=LAYOUT_BATCH_SIZE, afterId=0):
+    """Move up to batchSize legacy-layout files into the blob store.
+
+    Returns (files moved, last File id examined); rows whose file is missing on
+    disk are left alone and passed over on the next batch through afterId.
+    """
+    # Tombstoned files move too: they keep their bytes until the purge
+    files = db.session.execute(
+        select(File).where(File.ContentHash.is_(None), File.Id > afterId).order_by(File.Id).limit(batchSize)
+        .execution_options(include_deleted=True)
+    ).scalars().all()
+    if not files:
+        return 0, None
+    legacyPaths = set()
+    moved = 0
+    for file in files:
+        if file.ContentHash is not None or not file.Path or not os.path.isfile(file.Path):
+            continue
+        legacyPath = file.Path
+        contentHash = file_content_hash(legacyPath)
+        location = _store(legacyPath, contentHash)
+        # Every row sharing the path moves along, through the ORM so the blob reference counts follow
+        for sharing in db.session.execute(
+                select(File).where(File.Path == legacyPath).execution_options(include_deleted=True)).scalars():
+            sharing.ContentHash = contentHash
+            sharing.Size = os.path.getsize(legacyPath)
+            sharing.Path = location
+        legacyPaths.add(legacyPath)
+        moved += 1
+    db.session.commit()
+    for path in legacyPaths:
+        _remove(path)
+    return moved, files[-1].Id
+
+
+def init_app(app):
+    @app.cli.command('migrate-upload-layout')
+    @click.option('--batch-size', default=LAYOUT_BATCH_SIZE, help='Files to move per batch')
+    @click.option('--all', 'untilComplete', is_flag=True, help='Keep going until everything has been moved')
+    def migrate_upload_layout_command(batch_size, untilComplete):
+        """Move stored uploads into the fanned-out blob layout, or into remote storage"""
+        total = {'blobs': 0, 'variants': 0, 'files': 0}
+        lastFileId = 0
+        while True:
+            blobs = migrate_flat_blobs(batch_size)
+            variants = migrate_flat_variants(batch_size)
+            files, lastFileId = migrate_legacy_files(batch_size, lastFileId) if lastFileId is not None else (0, None)
+            total['blobs'] += blobs
+            total['variants'] += variants
+            total['files'] += files
+            if not untilComplete or (blobs < batch_size and variants < batch_size and lastFileId is None):
+                break
+        click.echo(f"Moved {total['blobs']} blobs, {total['variants']} variants and {total['files']} legacy files")
@@ -0,0 +1,168 @@
+import os
+import tempfile
+import uuid
+from datetime import datetime
+from io import BytesIO
+from flask import current_app
+from database import db
+from models import UploadSession
+from blobStore import put_file, put_object, stream_content_hash, file_content_hash
+from storageBackends import storage, PRESIGNED_URL_EXPIRY, MULTIPART_MIN_PART_SIZE
+
+# Resumable uploads. A session is opened with the file's name, size and
+# destination, the bytes are PUT in chunks at explicit offsets and appended to
+# a part file on disk, and finalizing verifies the SHA-256 before the part is
+# moved into the blob store and the File row is created. Chunks are streamed to disk, so memory use does not grow with
+# the file size, and a dropped connection only costs the chunk in flight.
+#
+# A part file lives on one node's disk. With a remote storage backend the
+# chunks are therefore the parts of an S3 multipart upload of the incoming/<id>
+# object instead, so any API node can take the next chunk; every chunk but the
+# last must then hold at least MULTIPART_MIN_PART_SIZE bytes. Finalizing joins
+# the parts and hashes the object before it goes into the blob store.
+#
+# With a remote storage backend a session can instead be a direct upload: the
+# client PUTs the whole file to a presigned URL of an incoming/<id> object, the
+# bucket rejects bytes that do not match the declared SHA-256, and finalizing
+# copies the object into the blob store. No bytes pass through the API.
+
+CHUNK_READ_SIZE = 64 * 1024
+# A chunk bound for a multipart upload is held in memory up to this size, on disk beyond it
+CHUNK_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def part_path(session):
+    return os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), '.sessions', f'{session.Id}.part')
+
+
+def incoming_key(session):
+    """Storage key a direct upload is PUT to"""
+    return f'incoming/{session.Id}'
+
+
+def create_session(direct=False, **columns):
+    now = datetime.now()
+    session = UploadSession(Id=uuid.uuid4().hex, Received=0, Parts=0, CreatedDateTime=now, LastModifyDateTime=now, **columns)
+    if not direct and storage().remote:
+        session.MultipartUploadId = storage().start_multipart(incoming_key(session))
+    elif not direct:
+        path = part_path(session)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+    db.session.add(session)
+    return session
+
+
+def direct_upload_target(session):
+    """(presigned url, headers to send) for PUTting a direct upload's bytes"""
+    expiresIn = current_app.config.get('PRESIGNED_URL_EXPIRY', PRESIGNED_URL_EXPIRY)
+    return storage().presigned_upload(incoming_key(session), session.Checksum, session.Size, expiresIn)
+
+
+def _read_chunk(session, stream, out):
+    written = 0
+    while True:
+        data = stream.read(CHUNK_READ_SIZE)
+        if not data:
+            return written
+        if session.Received + written + len(data) > session.Size:
+            raise ValueError(f'chunk runs past the declared size of {session.Size} bytes')
+        out.write(data)
+        written += len(data)
+
+
+def append_chunk(session, stream):
+    """Write stream to the part file at session.Received and advance it.
+
+    Bytes past the session size are rejected with ValueError. Anything left in
+    the part file beyond the new offset (a chunk that was cut off) is truncated.
+    With a multipart upload the chunk becomes its next part instead; a part
+    that is cut off never counts.
+    """
+    if session.MultipartUploadId is not None:
+        return _upload_part(session, stream)
+    with open(part_path(session), 'r+b') as part:
+        part.seek(session.Received)
+        written = _read_chunk(session, stream, part)
+        part.truncate()
+    session.Received += written
+    session.LastModifyDateTime = datetime.now()
+    return written
+
+
+def _upload_part(session, stream):
+    with tempfile.SpooledTemporaryFile(CHUNK_SPOOL_SIZE) as chunk:
+        written = _read_chunk(session, stream, chunk)
+        if not written:
+            return 0
+        if session.Received + written < session.Size and written < MULTIPART_MIN_PART_SIZE:
+            raise ValueError(f'chunks before the last must hold at least {MULTIPART_MIN_PART_SIZE} bytes')
+        chunk.seek(0)
+        storage().upload_part(incoming_key(session), session.MultipartUploadId, session.Parts + 1, chunk, written)
+    session.Parts += 1
+    session.Received += written
+    session.LastModifyDateTime = datetime.now()
+    return written
+
+
+def received_content_hash(session):
+    """SHA-256 of the bytes a complete chunked upload has received.
+
+    A multipart upload is joined into its object first.
+    """
+    if session.MultipartUploadId is None:
+        return file_content_hash(part_path(session))
+    key = incoming_key(session)
+    # Already there when an earlier finalize failed after joining it
+    if storage().stat(key) is None:
+        if session.Parts:
+            storage().complete_multipart(key, session.MultipartUploadId)
+        else:
+            storage().put_stream(key, BytesIO(b''))
+    with storage().open(key) as stream:
+        return stream_content_hash(stream)
+
+
+def complete_session(session, contentHash):
+    """Move the verified upload into the blob store, drop the session and return the blob location"""
+    if session.MultipartUploadId is not None:
+        location = put_object(incoming_key(session), contentHash)
+    else:
+        location = put_file(part_path(session), contentHash)
+    db.session.delete(session)
+    return location
+
+
+def complete_direct_upload(session):
+    """Move a direct upload into the blob store, drop the session and return (content hash, blob location).
+
+    Returns None while nothing has been uploaded; raises ValueError when the
+    object does not match the session's size or checksum.
+    """
+    key = incoming_key(session)
+    stat = storage().stat(key)
+    if stat is None:
+        return None
+    if stat[0] != session.Size:
+        raise ValueError(f'Received {stat[0]} bytes, expected {session.Size}')
+    # The bucket checked the checksum on upload; objects stored without one are hashed here
+    contentHash = storage().checksum(key)
+    if contentHash is None:
+        with storage().open(key) as stream:
+            contentHash = stream_content_hash(stream)
+    if contentHash != session.Checksum.lower():
+        raise ValueError('Checksum mismatch')
+    location = put_object(key, contentHash)
+    db.session.delete(session)
+    return contentHash, location
+
+
+def discard_session(session):
+    path = part_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+    elif storage().remote:
+        if session.MultipartUploadId is not None:
+            storage().abort_multipart(incoming_key(session), session.MultipartUploadId)
+        storage().delete(incoming_key(session))
+    db.session.delete(session)
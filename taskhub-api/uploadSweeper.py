@@ -0,0 +1,255 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, func
+from database import db
+from models import Blob, File, UploadSession
+from blobStore import blob_folder, blob_key, blob_path, flat_blob_path, is_content_hash, locate_blob
+from imageVariants import IMAGE_VARIANTS, variant_key, variant_path, flat_variant_path
+from storageBackends import storage, write_atomically
+from uploadSessions import discard_session
+
+# Garbage collection for the uploads tree. Each sweep walks the tree in a
+# fixed order from where the previous one stopped (the cursor is kept in
+# .sweep-state.json), looks up at most SWEEP_BATCH_SIZE files in the database
+# at once and deletes what nothing references any more:
+#   blobs        whose reference count is zero (or that have no blobs row)
+#   variants     whose source blob is gone
+#   .sessions    part files of abandoned resumable uploads
+#   anything else, i.e. files in the legacy per-page/folder layout, that no
+#                File row points at
+# Nothing younger than the grace period is touched, so uploads still in flight
+# are safe. When the walk reaches the end the cursor starts over.
+# A remote storage backend is not walked: each sweep also takes a batch of
+# released blobs from the blobs table and of stale upload sessions and
+# deletes their objects and multipart uploads from the bucket.
+
+SWEEP_BATCH_SIZE = 1000
+SWEEP_GRACE_PERIOD = timedelta(hours=24)
+SWEEP_STATE_FILE = '.sweep-state.json'
+
+
+def _upload_root():
+    return current_app.config.get('UPLOAD_FOLDER', 'uploads')
+
+
+def _state_path():
+    return os.path.join(_upload_root(), SWEEP_STATE_FILE)
+
+
+def _load_cursor():
+    try:
+        with open(_state_path()) as state:
+            return tuple(json.load(state).get('cursor') or ())
+    except (FileNotFoundError, ValueError):
+        return ()
+
+
+def _save_cursor(cursor):
+    write_atomically(_state_path(), json.dumps({'cursor': list(cursor)}).encode())
+
+
+def _walk(root, parts, cursor):
+    """Yield (path parts, DirEntry) for the files under root after cursor, in a stable order"""
+    try:
+        entries = sorted(os.scandir(os.path.join(root, *parts)), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        entryParts = parts + (entry.name,)
+        if entry.is_dir(follow_symlinks=False):
+            # Skip subtrees that lie entirely before the cursor
+            if entryParts < cursor and cursor[:len(entryParts)] != entryParts:
+                continue
+            yield from _walk(root, entryParts, cursor)
+        elif entry.is_file(follow_symlinks=False) and entryParts > cursor:
+            yield entryParts, entry
+
+
+def _classify(path):
+    """Which kind of stored file path is: ('blob', hash), ('variant', hash), ('session', id), ('temp', None) or ('legacy', None)"""
+    blobRoot = os.path.normpath(blob_folder())
+    variantRoot = os.path.join(blobRoot, 'variants')
+    directory, name = os.path.split(os.path.normpath(path))
+    if name == SWEEP_STATE_FILE and directory == os.path.normpath(_upload_root()):
+        return 'state', None
+    if name.startswith('.upload-'):
+        return 'temp', None
+    # Blobs and variants in both the flat and the fanned-out layout
+    if directory.startswith(variantRoot + os.sep) and name.endswith('.webp') and is_content_hash(name[:-len('.webp')]):
+        return 'variant', name[:-len('.webp')]
+    if (directory == blobRoot or directory.startswith(blobRoot + os.sep)) and is_content_hash(name):
+        return 'blob', name
+    if directory == os.path.join(os.path.normpath(_upload_root()), '.sessions') and name.endswith('.part'):
+        return 'session', name[:-len('.part')]
+    return 'legacy', None
+
+
+def _remove(path, stat, report):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    report['deleted'] += 1
+    report['reclaimedBytes'] += stat.st_size
+
+
+def _remove_blob(contentHash, report):
+    paths = [blob_path(contentHash), flat_blob_path(contentHash)]
+    for variant in IMAGE_VARIANTS:
+        paths += [variant_path(contentHash, variant), flat_variant_path(contentHash, variant)]
+    for path in paths:
+        try:
+            _remove(path, os.stat(path), report)
+        except FileNotFoundError:
+            pass
+
+
+def _sweep_batch(batch, cutoff, report):
+    byKind = {}
+    for path, stat, kind, key in batch:
+        byKind.setdefault(kind, []).append((path, stat, key))
+    old = lambda stat: datetime.fromtimestamp(stat.st_mtime) < cutoff
+
+    blobs = byKind.get('blob', [])
+    if blobs:
+        rows = {blob.ContentHash: blob for blob in db.session.execute(
+            select(Blob).where(Blob.ContentHash.in_([key for _, _, key in blobs])).with_for_update()).scalars()}
+        for path, stat, key in blobs:
+            blob = rows.get(key)
+            if blob is not None and (blob.RefCount or 0) > 0:
+                continue
+            if not old(stat) or (blob is not None and blob.LastModifyDateTime and blob.LastModifyDateTime >= cutoff):
+                continue
+            if blob is not None:
+                db.session.delete(blob)
+            _remove_blob(key, report)
+
+    for path, stat, key in byKind.get('variant', []):
+        if old(stat) and locate_blob(key) is None:
+            _remove(path, stat, report)
+
+    for path, stat, key in byKind.get('temp', []):
+        if old(stat):
+            _remove(path, stat, report)
+
+    parts = byKind.get('session', [])
+    if parts:
+        sessions = {session.Id: session for session in db.session.execute(
+            select(UploadSession).where(UploadSession.Id.in_([key for _, _, key in parts]))).scalars()}
+        for path, stat, key in parts:
+            session = sessions.get(key)
+            if session is None:
+                if old(stat):
+                    _remove(path, stat, report)
+            elif (session.LastModifyDateTime or session.CreatedDateTime) < cutoff:
+                report['deleted'] += 1
+                report['reclaimedBytes'] += stat.st_size
+                discard_session(session)
+
+    legacy = byKind.get('legacy', [])
+    if legacy:
+        candidates = {os.path.normpath(path) for path, _, _ in legacy}
+        candidates |= {os.path.abspath(path) for path in candidates}
+        # Files waiting for the tombstone purge still own their bytes
+        referenced = {os.path.normpath(filePath) for filePath in db.session.execute(
+            select(File.Path).where(File.Path.in_(list(candidates))).execution_options(include_deleted=True)).scalars()}
+        referenced |= {os.path.abspath(filePath) for filePath in referenced}
+        for path, stat, _ in legacy:
+            if os.path.normpath(path) not in referenced and old(stat):
+                _remove(path, stat, report)
+    db.session.commit()
+
+
+def _sweep_remote(batchSize, cutoff, report):
+    backend = storage()
+    released = db.session.execute(
+        select(Blob).where(Blob.RefCount <= 0, Blob.LastModifyDateTime < cutoff)
+        .order_by(Blob.LastModifyDateTime).limit(batchSize).with_for_update(skip_locked=True)
+    ).scalars().all()
+    for blob in released:
+        stat = backend.stat(blob_key(blob.ContentHash))
+        if stat is not None and stat[1] >= cutoff:
+            # Stored again moments ago; the new reference has not been committed yet
+            continue
+        if stat is not None:
+            report['deleted'] += 1
+            report['reclaimedBytes'] += stat[0]
+        backend.delete(blob_key(blob.ContentHash))
+        for variant in IMAGE_VARIANTS:
+            backend.delete(variant_key(blob.ContentHash, variant))
+        db.session.delete(blob)
+
+    stale = db.session.execute(
+        select(UploadSession).where(func.coalesce(UploadSession.LastModifyDateTime, UploadSession.CreatedDateTime) < cutoff)
+        .limit(batchSize)
+    ).scalars().all()
+    for session in stale:
+        # Chunks of uploads to remote storage are multipart uploads, aborted here with the session
+        report['deleted'] += 1
+        discard_session(session)
+    db.session.commit()
+
+
+def sweep_uploads(batchSize=SWEEP_BATCH_SIZE, gracePeriod=SWEEP_GRACE_PERIOD):
+    """Run one incremental sweep over at most batchSize files and return a report"""
+    root = _upload_root()
+    cursor = _load_cursor()
+    cutoff = datetime.now() - gracePeriod
+    report = {'scanned': 0, 'deleted': 0, 'reclaimedBytes': 0, 'complete': False}
+    batch = []
+    lastParts = cursor
+    for parts, entry in _walk(root, (), cursor):
+        path = os.path.join(root, *parts)
+        kind, key = _classify(path)
+        lastParts = parts
+        report['scanned'] += 1
+        if kind != 'state':
+            batch.append((path, entry.stat(follow_symlinks=False), kind, key))
+        if report['scanned'] >= batchSize:
+            break
+    else:
+        # Reached the end of the tree; the next sweep starts from the top
+        report['complete'] = True
+        lastParts = ()
+    _sweep_batch(batch, cutoff, report)
+    _save_cursor(lastParts)
+    if storage().remote:
+        _sweep_remote(batchSize, cutoff, report)
+    current_app.logger.info('Upload sweep: scanned %(scanned)d, deleted %(deleted)d, reclaimed %(reclaimedBytes)d bytes', report)
+    return report
+
+
+def init_app(app):
+    @app.cli.command('sweep-uploads')
+    @click.option('--batch-size', default=SWEEP_BATCH_SIZE, help='Files to examine in this run')
+    @click.option('--grace-hours', default=SWEEP_GRACE_PERIOD.total_seconds() / 3600, help='Only delete files older than this')
+    @click.option('--all', 'untilComplete', is_flag=True, help='Keep sweeping until the whole tree has been covered')
+    def sweep_uploads_command(batch_size, grace_hours, untilComplete):
+        """Delete uploaded bytes that no file, image or upload session references any more"""
+        total = {'scanned': 0, 'deleted': 0, 'reclaimedBytes': 0}
+        while True:
+            report = sweep_uploads(batch_size, timedelta(hours=grace_hours))
+            for key in total:
+                total[key] += report[key]
+            if report['complete'] or not untilComplete:
+                break
+        click.echo(f"Scanned {total['scanned']} files, deleted {total['deleted']}, reclaimed {total['reclaimedBytes']} bytes")
+
+    # Optional in-process sweeper: one batch every UPLOAD_SWEEP_INTERVAL seconds
+    interval = app.config.get('UPLOAD_SWEEP_INTERVAL')
+    if interval:
+        def run():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        sweep_uploads()
+                    except Exception:
+                        db.session.rollback()
+                        app.logger.exception('Upload sweep failed')
+        threading.Thread(target=run, name='upload-sweeper', daemon=True).start()
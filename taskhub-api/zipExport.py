@@ -0,0 +1,160 @@
+import io
+import os
+import time
+import zipfile
+from flask import Response, stream_with_context
+from sqlalchemy import select, or_
+from werkzeug.utils import secure_filename
+from database import db
+from models import Folder, Workspace, Page, File
+from blobStore import blob_key, open_blob
+from storageBackends import storage
+
+# ZIP exports of a folder, workspace or vault. The archive is produced while it
+# is being sent: each file is read from storage in small chunks and the zip bytes
+# are yielded as soon as zipfile writes them, so memory stays constant however
+# large the export is and nothing is staged on disk. Only the file list (names
+# and paths, no content) is collected up front. The archive is written after
+# the view has returned, so zip_response keeps the request context (and with
+# it the app's storage configuration) around until it is done.
+
+EXPORT_READ_SIZE = 256 * 1024
+# Zip timestamps cannot predate 1980
+ZIP_EPOCH = time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1))
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink that hands the written bytes back in chunks"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def _directory_name(name, kind, id):
+    name = (name or '').replace('/', '_').replace('\\', '_').strip()
+    return name if name and name not in ('.', '..') else f'{kind} {id}'
+
+
+def _folder_directories(roots):
+    """Map folder id to archive directory for every folder under roots ({id: directory}), one query per level"""
+    directories = dict(roots)
+    level = list(roots)
+    while level:
+        children = db.session.execute(
+            select(Folder.Id, Folder.Name, Folder.ParentId).where(Folder.ParentId.in_(level))
+        ).all()
+        level = []
+        for child in children:
+            if child.Id not in directories:
+                directories[child.Id] = f'{directories[child.ParentId]}/{_directory_name(child.Name, "Folder", child.Id)}'
+                level.append(child.Id)
+    return directories
+
+
+def _export_entries(folderDirectories, workspaceDirectories):
+    """(archive name, path, content hash) for every file in the given folders and workspaces, including their pages"""
+    workspaceDirectories = dict(workspaceDirectories)
+    if folderDirectories:
+        for workspace in db.session.execute(
+                select(Workspace.Id, Workspace.Name, Workspace.FolderId).where(Workspace.FolderId.in_(list(folderDirectories)))):
+            workspaceDirectories[workspace.Id] = f'{folderDirectories[workspace.FolderId]}/{_directory_name(workspace.Name, "Workspace", workspace.Id)}'
+    pageDirectories = {}
+    if workspaceDirectories:
+        for page in db.session.execute(
+                select(Page.Id, Page.Name, Page.WorkspaceId).where(Page.WorkspaceId.in_(list(workspaceDirectories)))):
+            pageDirectories[page.Id] = f'{workspaceDirectories[page.WorkspaceId]}/{_directory_name(page.Name, "Page", page.Id)}'
+
+    files = db.session.execute(
+        select(File.Id, File.Name, File.Path, File.ContentHash, File.FolderId, File.WorkspaceId, File.PageId)
+        .where(or_(File.FolderId.in_(list(folderDirectories)), File.WorkspaceId.in_(list(workspaceDirectories)),
+                 File.PageId.in_(list(pageDirectories))))
+        .order_by(File.Id)
+    ).all()
+    entries = []
+    used = set()
+    for file in files:
+        if file.PageId in pageDirectories:
+            directory = pageDirectories[file.PageId]
+        elif file.WorkspaceId in workspaceDirectories:
+            directory = workspaceDirectories[file.WorkspaceId]
+        else:
+            directory = folderDirectories[file.FolderId]
+        base, extension = os.path.splitext(secure_filename(file.Name or '') or f'file-{file.Id}')
+        name = f'{directory}/{base}{extension}'
+        copy = 1
+        while name in used:
+            copy += 1
+            name = f'{directory}/{base} ({copy}){extension}'
+        used.add(name)
+        entries.append((name, file.Path, file.ContentHash))
+    return entries
+
+
+def folder_export_entries(folder):
+    return _export_entries(_folder_directories({folder.Id: _directory_name(folder.Name, 'Folder', folder.Id)}), {})
+
+
+def workspace_export_entries(workspace):
+    return _export_entries({}, {workspace.Id: _directory_name(workspace.Name, 'Workspace', workspace.Id)})
+
+
+def vault_export_entries(vault):
+    roots = db.session.execute(
+        select(Folder.Id, Folder.Name).where(Folder.VaultId == vault.Id, Folder.ParentId.is_(None))
+    ).all()
+    return _export_entries(_folder_directories({root.Id: _directory_name(root.Name, 'Folder', root.Id) for root in roots}), {})
+
+
+def _open_entry(path, contentHash):
+    """(stream, size, modified timestamp) of an entry's content, or None when it is missing"""
+    if contentHash:
+        stat = storage().stat(blob_key(contentHash), contentHash)
+        if stat is None:
+            return None
+        return open_blob(contentHash), stat[0], stat[1].timestamp()
+    try:
+        source = open(path, 'rb')
+    except (FileNotFoundError, IsADirectoryError, TypeError):
+        return None
+    stat = os.fstat(source.fileno())
+    return source, stat.st_size, stat.st_mtime
+
+
+def stream_zip(entries):
+    """Yield a zip archive of entries ((archive name, path, content hash) triples); missing content is skipped"""
+    sink = _ZipStream()
+    # Attachments are mostly compressed formats already, so they are stored as is
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, path, contentHash in entries:
+            opened = _open_entry(path, contentHash)
+            if opened is None:
+                continue
+            source, size, modified = opened
+            with source:
+                info = zipfile.ZipInfo(name, date_time=time.localtime(max(modified, ZIP_EPOCH))[:6])
+                # Known up front so zipfile switches to zip64 for entries over 4 GiB
+                info.file_size = size
+                with archive.open(info, 'w') as target:
+                    for data in iter(lambda: source.read(EXPORT_READ_SIZE), b''):
+                        target.write(data)
+                        yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def zip_response(entries, name):
+    downloadName = secure_filename(name or '') or 'export'
+    return Response(stream_with_context(stream_zip(entries)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{downloadName}.zip"'})